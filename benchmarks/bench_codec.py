@@ -0,0 +1,54 @@
+"""Benchmark of encode and decode throughput per registered codec and message type.
+
+Run from repository root with ``python -m benchmarks.bench_codec``. Decoding includes streaming the data through the codec's
+unpacker and the creation of the message objects.
+"""
+import timeit
+from jep_py.codec import available_codecs
+from jep_py.protocol import MessageSerializer
+from jep_py.serializer import TextPayload
+from jep_py.schema import Shutdown, ContentSync, StaticSyntaxList, StaticSyntax, SyntaxFormatType, \
+    ProblemUpdate, FileProblems, ProblemColumns
+from benchmarks.bench_serializer import problem_update, completion_response
+
+
+def messages():
+    """Representative messages by name."""
+    return [
+        ('Shutdown', Shutdown()),
+        ('ContentSync (1 MB)', ContentSync('file.cmake', 'set(VAR value) # comment\n' * 40000, 0)),
+        ('ContentSync (1 MB payload)', ContentSync('file.cmake', TextPayload.from_text('set(VAR value) # comment\n' * 40000), 0)),
+        ('ContentSync (keystroke)', ContentSync('file.cmake', 'x', 1000, 1000)),
+        ('ProblemUpdate (10000)', problem_update()),
+        ('ProblemUpdate (columns)', ProblemUpdate([FileProblems(fp.file, ProblemColumns.from_items(fp.problems)) for fp in problem_update().fileProblems])),
+        ('CompletionResponse (5000)', completion_response()),
+        ('StaticSyntaxList', StaticSyntaxList(SyntaxFormatType.textmate, [StaticSyntax('cmake', ['cmake', 'txt'], '<plist>%s</plist>' % ('<dict/>' * 20000))])),
+    ]
+
+
+def throughput(function, count, repeat=3):
+    """Best number of executions of given function per second."""
+    best = min(timeit.repeat(function, repeat=repeat, number=count))
+    return count / best
+
+
+def main():
+    print('%-18s %-26s %10s %14s %14s' % ('codec', 'message', 'bytes', 'encode msg/s', 'decode msg/s'))
+    for name in available_codecs():
+        for compact in (False, True):
+            for title, message in messages():
+                serializer = MessageSerializer(codec=name)
+                serializer.compact = compact
+                data = serializer.serialize(message)
+                count = max(1, min(10000, 2000000 // len(data)))
+
+                def decode():
+                    serializer.enque_data(data)
+                    serializer.dequeue_message()
+
+                print('%-18s %-26s %10d %14.0f %14.0f' % (name + (' (compact)' if compact else ''), title, len(data),
+                                                        throughput(lambda: serializer.serialize(message), count), throughput(decode, count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark of content synchronization, replaying a typing session on a large file.
+
+Compares the rope based content monitor with splicing flat strings, as done by the monitor before.
+
+Run from repository root with ``python -m benchmarks.bench_content``.
+"""
+import random
+import time
+from jep_py.content import ContentMonitor
+
+#: Name of synchronized file.
+FILE = 'generated.cmake'
+
+
+def typing_session(length, keystrokes=2000, seed=4711):
+    """Returns list of (data, start, end) edits of a user typing at a few positions of a file of given length."""
+    rng = random.Random(seed)
+    edits = []
+    cursor = rng.randint(0, length)
+    for _ in range(keystrokes):
+        if rng.random() < 0.02:
+            # jump to other position:
+            cursor = rng.randint(0, length)
+        if rng.random() < 0.1 and cursor > 0:
+            edits.append(('', cursor - 1, cursor))
+            cursor -= 1
+            length -= 1
+        else:
+            edits.append((rng.choice('abcdefghijklmnopqrstuvwxyz \n'), cursor, cursor))
+            cursor += 1
+            length += 1
+    return edits
+
+
+def replay_monitor(text, edits):
+    monitor = ContentMonitor()
+    monitor.synchronize(FILE, text, 0)
+    start = time.perf_counter()
+    for data, begin, end in edits:
+        monitor.synchronize(FILE, data, begin, end)
+    return time.perf_counter() - start, monitor[FILE]
+
+
+def replay_flat(text, edits):
+    start = time.perf_counter()
+    for data, begin, end in edits:
+        text = ''.join([text[0:begin], data, text[end:]])
+    return time.perf_counter() - start, text
+
+
+def main():
+    print('%10s %10s %16s %16s' % ('file size', 'keystrokes', 'flat str [ms]', 'rope [ms]'))
+    for size in (100000, 1000000, 10000000):
+        text = ('set(VAR value) # comment %d\n' * (size // 28)) % tuple(range(size // 28))
+        edits = typing_session(len(text))
+        flat_time, flat_text = replay_flat(text, edits)
+        rope_time, rope_text = replay_monitor(text, edits)
+        assert flat_text == rope_text
+        print('%10d %10d %16.1f %16.1f' % (len(text), len(edits), flat_time * 1000, rope_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
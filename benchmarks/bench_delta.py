@@ -0,0 +1,70 @@
+"""Benchmark of resynchronizing a stale file content by block delta instead of sending the complete content.
+
+Compares the bytes on the wire and the time spent by both peers, for files edited at a few positions while out of sync.
+
+Run from repository root with ``python -m benchmarks.bench_delta``.
+"""
+import random
+import time
+from jep_py.backend import Backend, FrontendConnection
+from jep_py.delta import resync_message
+from jep_py.protocol import MessageSerializer, FEATURES
+from jep_py.schema import ContentSync
+
+#: Name of synchronized file.
+FILE = 'generated.cmake'
+
+
+def edited(text, edits, seed=4711):
+    """Returns text changed at given number of random positions."""
+    rng = random.Random(seed)
+    for _ in range(edits):
+        start = rng.randint(0, len(text))
+        text = text[:start] + 'set(NEW value)\n' * rng.randint(1, 10) + text[start + rng.randint(0, 200):]
+    return text
+
+
+class Recorder:
+    """Backend capturing sent messages instead of queuing them to a socket."""
+
+    def __init__(self):
+        self.backend = Backend()
+        self.backend.send_message = lambda connection, msg: self.sent.append(msg)
+        self.connection = FrontendConnection(self.backend, None)
+        self.sent = []
+
+
+def main():
+    serializer = MessageSerializer()
+    serializer.use_features(FEATURES)
+
+    print('%10s %6s %14s %14s %14s %14s' % ('file size', 'edits', 'full [bytes]', 'delta [bytes]', 'backend [ms]', 'frontend [ms]'))
+    for size in (100000, 1000000, 10000000):
+        stale = ('set(VAR value) # comment %d\n' * (size // 28)) % tuple(range(size // 28))
+        for edits in (1, 10, 100):
+            current = edited(stale, edits)
+            full = len(serializer.serialize(ContentSync(FILE, current)))
+
+            recorder = Recorder()
+            recorder.connection.content_monitor.synchronize(FILE, stale, 0)
+            start = time.perf_counter()
+            recorder.backend.on_content_sync(ContentSync(FILE, 'x', len(stale) + 1), recorder.connection)
+            backend_time = time.perf_counter() - start
+            out_of_sync = serializer.deserialize(serializer.serialize(recorder.sent[-1]))
+
+            start = time.perf_counter()
+            content_delta = resync_message(FILE, current, out_of_sync)
+            frontend_time = time.perf_counter() - start
+            encoded_delta = serializer.serialize(content_delta)
+
+            start = time.perf_counter()
+            recorder.backend.on_content_delta(serializer.deserialize(encoded_delta), recorder.connection)
+            backend_time += time.perf_counter() - start
+            assert recorder.connection.content_monitor[FILE] == current
+
+            delta = len(serializer.serialize(out_of_sync)) + len(encoded_delta)
+            print('%10d %6d %14d %14d %14.1f %14.1f' % (len(stale), edits, full, delta, backend_time * 1000, frontend_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Memory benchmark of large problem updates.
+
+Compares schema classes storing their attributes in generated slots with equivalent classes using a per-instance dictionary.
+
+Run from repository root with ``python -m benchmarks.bench_memory``.
+"""
+import gc
+import tracemalloc
+from jep_py.schema import ProblemUpdate, FileProblems, Problem, Severity
+from jep_py.serializer import Serializable
+
+
+class DictProblem(Serializable):
+    __slots__ = ('__dict__',)
+
+    def __init__(self, message: str, severity: Severity, line: int):
+        super().__init__()
+        self.message = message
+        self.severity = severity
+        self.line = line
+
+
+class DictFileProblems(Serializable):
+    __slots__ = ('__dict__',)
+
+    def __init__(self, file: str, problems: [DictProblem], total: int = None, start: int = 0, end: int = None):
+        super().__init__()
+        self.file = file
+        self.problems = problems
+        self.total = total
+        self.start = start
+        self.end = end
+
+
+def problem_update(file_problems_class, problem_class, files=1000, problems_per_file=100):
+    severities = list(Severity)
+    messages = ['Problem %d in line.' % p for p in range(problems_per_file)]
+    return ProblemUpdate([file_problems_class('file%d.cmake' % f, [problem_class(messages[p], severities[p % len(severities)], p) for p in range(problems_per_file)])
+                          for f in range(files)])
+
+
+def allocated(function):
+    """Number of bytes allocated for the object returned by given function."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    # message strings are shared between files to measure object overhead mainly:
+    baseline = allocated(lambda: problem_update(DictFileProblems, DictProblem))
+    optimized = allocated(lambda: problem_update(FileProblems, Problem))
+
+    print('Memory of ProblemUpdate with 100000 problems:')
+    print('  %-12s %8.2f MB' % ('dict:', baseline / 2 ** 20))
+    print('  %-12s %8.2f MB' % ('slots:', optimized / 2 ** 20))
+    print('  %-12s %8.2f x' % ('reduction:', baseline / optimized))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark of newline mode detection on large files.
+
+Compares bulk counting of newlines with the character by character scan done by ``NewlineMode.detect()`` before, and tracking
+the mode of a file during a typing session with rescanning its complete content after each keystroke.
+
+Run from repository root with ``python -m benchmarks.bench_newline``.
+"""
+import time
+from benchmarks.bench_content import FILE, typing_session
+from jep_py.content import ContentMonitor, NewlineMode
+
+
+def detect_by_iteration(text):
+    """Former implementation of NewlineMode.detect()."""
+    mode = NewlineMode.Unknown
+
+    if text:
+        chariter = iter(text)
+        rpending = False
+
+        try:
+            while mode < NewlineMode.All:
+                c = next(chariter)
+                if c == '\n':
+                    mode |= NewlineMode.N
+                elif c == '\r':
+                    rpending = True
+                    c = next(chariter)
+                    rpending = False
+                    if c == '\n':
+                        mode |= NewlineMode.RN
+                    else:
+                        mode |= NewlineMode.R
+        except StopIteration:
+            if rpending:
+                mode |= NewlineMode.R
+
+    return mode
+
+
+def measure(function, *args, repeat=3):
+    """Returns best time of calling function with given arguments and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def replay_tracked(text, edits):
+    monitor = ContentMonitor()
+    monitor.synchronize(FILE, text, 0)
+    start = time.perf_counter()
+    for data, begin, end in edits:
+        monitor.synchronize(FILE, data, begin, end)
+        mode = monitor.newline_mode(FILE)
+    return time.perf_counter() - start, mode
+
+
+def replay_rescan(text, edits):
+    monitor = ContentMonitor()
+    monitor.synchronize(FILE, text, 0)
+    start = time.perf_counter()
+    for data, begin, end in edits:
+        monitor.synchronize(FILE, data, begin, end)
+        mode = NewlineMode.detect(monitor[FILE])
+    return time.perf_counter() - start, mode
+
+
+def main():
+    print('%10s %8s %16s %16s' % ('file size', 'newlines', 'iteration [ms]', 'counting [ms]'))
+    for size in (1000000, 10000000):
+        line = 'set(VAR value) # comment\r\n'
+        for name, text in (('\\r\\n', line * (size // len(line))),
+                           ('\\n', line.replace('\r', '') * (size // len(line))),
+                           ('mixed', line * (size // len(line) - 1) + '\n')):
+            iteration_time, iteration_mode = measure(detect_by_iteration, text)
+            counting_time, counting_mode = measure(NewlineMode.detect, text)
+            assert iteration_mode == counting_mode
+            print('%10d %8s %16.1f %16.1f' % (len(text), name, iteration_time * 1000, counting_time * 1000))
+
+    print()
+    print('%10s %10s %16s %16s' % ('file size', 'keystrokes', 'rescan [ms]', 'tracked [ms]'))
+    for size in (1000000, 10000000):
+        text = 'set(VAR value) # comment\r\n' * (size // 26)
+        edits = typing_session(len(text), keystrokes=200)
+        rescan_time, rescan_mode = replay_rescan(text, edits)
+        tracked_time, tracked_mode = replay_tracked(text, edits)
+        assert rescan_mode == tracked_mode
+        print('%10d %10d %16.1f %16.1f' % (len(text), len(edits), rescan_time * 1000, tracked_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
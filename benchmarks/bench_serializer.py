@@ -0,0 +1,62 @@
+"""Benchmarks of message encoding and decoding.
+
+Decoding from built-in form compares reflective, compiled and lazy deserializers, encoding compares packing of intermediate
+built-in dictionaries with direct packing of message objects.
+
+Run from repository root with ``python -m benchmarks.bench_serializer``.
+"""
+import timeit
+import umsgpack
+from jep_py.packer import pack_message
+from jep_py.schema import ProblemUpdate, FileProblems, Problem, Severity, CompletionResponse, CompletionOption, SemanticType
+from jep_py.serializer import serialize_to_builtins, deserialize_from_builtins, deserialize_reflective
+
+
+def problem_update(files=10, problems_per_file=1000):
+    severities = list(Severity)
+    return ProblemUpdate([FileProblems('file%d.cmake' % f, [Problem('Problem %d in line.' % p, severities[p % len(severities)], p) for p in range(problems_per_file)])
+                          for f in range(files)])
+
+
+def completion_response(options=5000):
+    semantics = list(SemanticType)
+    return CompletionResponse(0, 10, False, [CompletionOption('option%d' % o, 'Description %d' % o, semantics=semantics[o % len(semantics)]) for o in range(options)])
+
+
+def best_of(function, repeat, number):
+    """Best time of single execution of given function in seconds."""
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def pack_via_builtins(message):
+    serialized = serialize_to_builtins(message)
+    serialized['_message'] = type(message).__name__
+    return umsgpack.packb(serialized)
+
+
+def report(title, baseline_name, baseline, optimized_name, optimized):
+    print(title)
+    print('  %-12s %8.2f ms' % (baseline_name + ':', baseline * 1000))
+    print('  %-12s %8.2f ms' % (optimized_name + ':', optimized * 1000))
+    print('  %-12s %8.2f x' % ('speedup:', baseline / optimized))
+
+
+def main(repeat=5, number=3):
+    update = problem_update()
+    serialized = serialize_to_builtins(update)
+    report('Decoding ProblemUpdate with 10000 problems from builtins:',
+           'reflective', best_of(lambda: deserialize_reflective(serialized, ProblemUpdate), repeat, number),
+           'compiled', best_of(lambda: deserialize_from_builtins(serialized, ProblemUpdate), repeat, number))
+    report('Decoding ProblemUpdate with 10000 problems from builtins, fields left unaccessed:',
+           'compiled', best_of(lambda: deserialize_from_builtins(serialized, ProblemUpdate), repeat, number),
+           'lazy', best_of(lambda: ProblemUpdate.from_builtins_lazy(serialized), repeat, number))
+
+    for message in (update, completion_response()):
+        name = type(message).__name__
+        report('Encoding %s to msgpack:' % name,
+               'builtins', best_of(lambda: pack_via_builtins(message), repeat, number),
+               'direct', best_of(lambda: pack_message(message, '_message', name), repeat, number))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,14 @@ import enum
 import logging
 import socket
 import select
-from jep_py.config import TIMEOUT_SELECT_SEC, BUFFER_LENGTH, TIMEOUT_LAST_MESSAGE
-from jep_py.content import ContentMonitor, SynchronizationResult
-from jep_py.protocol import MessageSerializer
-from jep_py.schema import Shutdown, BackendAlive, ContentSync, OutOfSync, StaticSyntaxList, StaticSyntax
+from jep_py.buffer import SendQueue
+from jep_py.config import TIMEOUT_SELECT_SEC, TIMEOUT_LAST_MESSAGE, SEND_BATCH_WINDOW
+from jep_py.content import ContentMonitor, SynchronizationResult, merge_edits
+from jep_py.delta import block_size, block_checksums
+from jep_py.dispatch import Dispatcher, ListenerList
+from jep_py.protocol import MessageSerializer, FrozenMessage, EncodedMessageCache, FEATURES
+from jep_py.serializer import LazyConversionError
+from jep_py.schema import Shutdown, BackendAlive, ContentSync, ContentFingerprint, ContentDelta, OutOfSync, StaticSyntaxList, StaticSyntax
 from jep_py.syntax import SyntaxFileSet, SyntaxFile
 
 _logger = logging.getLogger(__name__)
@@ -21,6 +25,9 @@ LISTEN_QUEUE_LENGTH = 3
 #: Number of seconds between backend alive messages. Optimal: PERIOD_BACKEND_ALIVE_SEC = n * TIMEOUT_SELECT_SEC
 TIMEOUT_BACKEND_ALIVE = datetime.timedelta(minutes=1)
 
+#: Alive message, encoded once for all frontends.
+BACKEND_ALIVE = FrozenMessage(BackendAlive())
+
 
 class NoPortFoundError(Exception):
     pass
@@ -42,6 +49,12 @@ class FrontendListener:
     def on_content_sync(self, content_sync, context):
         return NotImplemented
 
+    def on_content_fingerprint(self, content_fingerprint, context):
+        return NotImplemented
+
+    def on_content_delta(self, content_delta, context):
+        return NotImplemented
+
     def on_completion_request(self, completion_request, context):
         return NotImplemented
 
@@ -55,9 +68,11 @@ class FrontendListener:
 class Backend(FrontendListener):
     """Synchronous JEP backend service."""
 
-    def __init__(self, listeners=None, *, syntax_fileset=None):
-        #: User message listeners.
-        self.listeners = listeners or []
+    def __init__(self, listeners=None, *, syntax_fileset=None, send_batch_window=None, lazy_messages=False):
+        #: User message listeners, changes of a ListenerList are detected without comparing it on each message.
+        self.listeners = listeners if listeners is not None else ListenerList()
+        #: Dispatch of messages to user listeners.
+        self.dispatcher = Dispatcher(FrontendListener)
         #: Registry of static syntax definitions.
         self.syntax_fileset = syntax_fileset or SyntaxFileSet()
         #: Active sockets, [0] is the server socket.
@@ -66,10 +81,14 @@ class Backend(FrontendListener):
         self.state = State.Stopped
         #: Timestamp of last alive message.
         self.ts_alive_sent = None
-        #: Cache for BackendAlive message in serialized form.
-        self.BACKEND_ALIVE_DATA = MessageSerializer().serialize(BackendAlive())
+        #: Encoded messages shared by all frontend connections.
+        self.message_cache = EncodedMessageCache()
         #: Map of socket to frontend descriptor.
         self.connection = dict()
+        #: Maximal period outbound messages are held back to be sent together.
+        self.send_batch_window = send_batch_window if send_batch_window is not None else SEND_BATCH_WINDOW
+        #: Convert attributes of received messages only when listeners access them?
+        self.lazy_messages = lazy_messages
 
     @property
     def serversocket(self):
@@ -93,6 +112,13 @@ class Backend(FrontendListener):
         _logger.debug('Received request to shut down.')
         self.state = State.ShutdownPending
 
+    def subscribe(self, listener, *message_types):
+        """Registers listener for messages of given types only."""
+        self.dispatcher.subscribe(listener, *message_types)
+
+    def unsubscribe(self, listener):
+        self.dispatcher.unsubscribe(listener)
+
     def register_static_syntax(self, name, path, fileformat, *extensions):
         """Adds a new static syntax file to the backend's registry for pickup by the frontend.
 
@@ -116,19 +142,24 @@ class Backend(FrontendListener):
         if self.state is not State.Running:
             _logger.error('Could not bind to any available port in range [%d,%d]. Startup failed.' % PORT_RANGE)
             raise NoPortFoundError()
-        print('JEP service, listening on port %d' % port, flush=True)
+        print('JEP service, listening on port %d (features: %s)' % (port, ', '.join(FEATURES)), flush=True)
 
     def _run(self):
         """Process connections and messages. This is the main loop of the server."""
 
         while self.state is State.Running:
-            readable, *_ = select.select(self.sockets, [], [], TIMEOUT_SELECT_SEC)
+            readable, writable, _ = select.select(self.sockets, self._sockets_to_flush(), [], self._select_timeout())
             for sock in readable:
                 if sock is self.serversocket:
                     self._accept()
                 else:
                     self._receive(sock)
 
+            # continue sending data that sockets did not accept before:
+            for sock in writable:
+                if sock in self.connection:
+                    self._flush(sock)
+
             self._cyclic()
 
         if self.state == State.ShutdownPending:
@@ -141,7 +172,7 @@ class Backend(FrontendListener):
         clientsocket, *_ = self.serversocket.accept()
         clientsocket.setblocking(0)
         self.sockets.append(clientsocket)
-        self.connection[clientsocket] = FrontendConnection(self, clientsocket)
+        self.connection[clientsocket] = FrontendConnection(self, clientsocket, serializer=MessageSerializer(cache=self.message_cache, lazy=self.lazy_messages))
         _logger.info('Frontend %d connected.' % id(clientsocket))
 
     def _receive(self, clientsocket):
@@ -151,13 +182,12 @@ class Backend(FrontendListener):
         cycles = 0
         try:
             while True:
-                data = clientsocket.recv(BUFFER_LENGTH)
+                count = frontend_connector.serializer.buffer.recv_into(clientsocket)
                 cycles += 1
 
-                if data:
-                    _logger.debug('Received data: %s' % data)
+                if count:
+                    _logger.debug('Received %d bytes.' % count)
                     frontend_connector.ts_last_data_received = datetime.datetime.now()
-                    frontend_connector.serializer.enque_data(data)
                 else:
                     _logger.debug('Socket closed by frontend.')
                     raise ConnectionAbortedError()
@@ -170,22 +200,96 @@ class Backend(FrontendListener):
 
         _logger.debug('Read data in %d cycles.' % cycles)
 
-        for msg in frontend_connector.serializer:
+        serializer = frontend_connector.serializer
+        for msg in self._coalesced(serializer, frontend_connector):
             _logger.debug('Received message: %s' % msg)
 
-            # first let backend handle the message, e.g. to preprocess incoming data:
-            msg.invoke(self, frontend_connector)
+            try:
+                # first let backend handle the message, e.g. to preprocess incoming data:
+                msg.invoke(self, frontend_connector)
+
+                # then pass it to user listeners:
+                self.dispatcher.dispatch(msg, frontend_connector, self.listeners)
+            except LazyConversionError as e:
+                # lazily decoded messages are only found invalid when their attributes are accessed:
+                serializer.messages_dropped += 1
+                _logger.warning('Dropping message that could not be decoded (%d dropped so far): %s' % (serializer.messages_dropped, e))
+
+        if serializer.peer_framed and not serializer.framed:
+            # only frontends that understood the announced features send framed messages:
+            _logger.debug('Frontend sends framed messages, enabling protocol extensions.')
+            serializer.use_features(FEATURES)
+
+    def _coalesced(self, messages, connection):
+        """Iterates messages, merging consecutive content syncs of the same file into one where their ranges touch.
+
+        A content sync is only passed on when the next message is known not to extend it, so the content monitor is updated and
+        listeners are notified once per burst of edits. Content of previously passed messages is already synchronized when the
+        next message is read, as this is a generator.
+        """
+        pending = None
+        for msg in messages:
+            if isinstance(msg, ContentSync) and pending is not None:
+                try:
+                    edit = None
+                    if msg.file == pending.file:
+                        edit = merge_edits(connection.content_monitor.length(pending.file),
+                                           (pending.data, pending.start, pending.end), (msg.data, msg.start, msg.end))
+                except LazyConversionError:
+                    # invalid message is passed on separately to be dropped:
+                    pass
+                if edit is not None:
+                    _logger.debug('Merging content sync of %s into preceding one.' % msg.file)
+                    pending = ContentSync(msg.file, *edit)
+                    continue
+
+            if pending is not None:
+                yield pending
+                pending = None
+
+            if isinstance(msg, ContentSync):
+                pending = msg
+            else:
+                yield msg
+
+        if pending is not None:
+            yield pending
+
+    def _sockets_to_flush(self):
+        """Sockets with queued outbound data that is due to be sent."""
+        now = datetime.datetime.now()
+        return [sock for sock, connection in self.connection.items()
+                if connection.send_queue and now - connection.send_queue.ts_oldest >= self.send_batch_window]
+
+    def _select_timeout(self):
+        """Seconds to wait for socket events, shortened to send batched outbound data in time.
 
-            # then pass it to user listeners:
-            for listener in self.listeners:
-                # call listener's message specific handler method (visitor pattern's accept() call):
-                msg.invoke(listener, frontend_connector)
+        Queues already due are not considered, select() wakes up once their sockets accept data again.
+        """
+        timeout = TIMEOUT_SELECT_SEC
+        now = datetime.datetime.now()
+        for connection in self.connection.values():
+            if connection.send_queue:
+                due = connection.send_queue.ts_oldest + self.send_batch_window
+                if due > now:
+                    timeout = min(timeout, (due - now).total_seconds())
+        return timeout
 
     def _close(self, sock):
         _logger.info('Socket %d disconnected.' % id(sock))
         sock.close()
         self.sockets.remove(sock)
-        self.connection.pop(sock, None)
+        connection = self.connection.pop(sock, None)
+        if connection and connection.serializer.stats.cpu_time:
+            _logger.debug('Compression statistics of socket %d: %s.' % (id(sock), connection.serializer.stats))
+        if connection:
+            monitor = connection.content_monitor
+            _logger.debug('Content of socket %d: %d characters resident, %d bytes spilled, %d evictions, %d reloads.'
+                          % (id(sock), monitor.resident_characters, monitor.spilled_bytes, monitor.evictions, monitor.reloads))
+            monitor.close()
+        if connection and (connection.serializer.messages_dropped or connection.serializer.bytes_discarded):
+            _logger.warning('Socket %d dropped %d invalid messages and discarded %d bytes of corrupt data.'
+                            % (id(sock), connection.serializer.messages_dropped, connection.serializer.bytes_discarded))
 
     def _cyclic(self):
         """Cyclic processing of service level tasks."""
@@ -199,7 +303,7 @@ class Backend(FrontendListener):
                 _logger.debug('Sending alive message to %d frontend(s).' % num_frontends)
 
                 for sock in self.sockets[1:]:
-                    self._send_data(sock, self.BACKEND_ALIVE_DATA)
+                    self.send_message(self.connection[sock], BACKEND_ALIVE)
                 self.ts_alive_sent = now
 
             # check timeouts for each connected frontend:
@@ -208,6 +312,10 @@ class Backend(FrontendListener):
                     _logger.debug('Disconnecting frontend after timeout.')
                     self._close(sock)
 
+            # send outbound messages collected during this cycle:
+            for sock in self._sockets_to_flush():
+                self._flush(sock)
+
     def send_message(self, connection, msg):
         """Message used by MessageContext only to delegate send."""
         _logger.debug('Sending message: %s.' % msg)
@@ -215,9 +323,24 @@ class Backend(FrontendListener):
         _logger.debug('Sending data: %s.' % serialized)
         self._send_data(connection.sock, serialized)
 
-    @classmethod
-    def _send_data(cls, sock, data):
-        sock.send(data)
+    def flush(self, connection=None):
+        """Sends queued outbound messages of given or all connections immediately, e.g. for latency critical responses."""
+        for sock in [connection.sock] if connection else list(self.connection):
+            self._flush(sock)
+
+    def _send_data(self, sock, data):
+        """Queues data to be sent with the next flush of the connection's outbound messages."""
+        self.connection[sock].send_queue.append(data, datetime.datetime.now())
+
+    def _flush(self, sock):
+        send_queue = self.connection[sock].send_queue
+        count = len(send_queue)
+        try:
+            sent = send_queue.flush(sock)
+            _logger.debug('Sent %d of %d queued bytes.' % (sent, count))
+        except OSError as e:
+            _logger.warning('Sending data to frontend failed, dropping %d bytes: %s' % (count, e))
+            send_queue.clear()
 
     def on_shutdown(self, context):
         self.stop()
@@ -228,7 +351,40 @@ class Backend(FrontendListener):
         result = context.content_monitor.synchronize(content_sync.file, content_sync.data, content_sync.start, content_sync.end)
 
         if result == SynchronizationResult.OutOfSync:
-            context.send_message(OutOfSync(content_sync.file))
+            context.send_message(self._out_of_sync(content_sync.file, context))
+
+    def on_content_fingerprint(self, content_fingerprint: ContentFingerprint, context):
+        """Verifies file content is in sync with frontend."""
+
+        fingerprint = context.content_monitor.fingerprint(content_fingerprint.file)
+        expected = content_fingerprint.fingerprint
+        # malformed fingerprints never match, not even the missing one of an unknown file:
+        if not isinstance(expected, int) or fingerprint != expected:
+            _logger.warning('Content of %s has fingerprint %s, frontend expected %r.' % (content_fingerprint.file, fingerprint, expected))
+            context.send_message(self._out_of_sync(content_fingerprint.file, context))
+
+    def on_content_delta(self, content_delta: ContentDelta, context):
+        """Resynchronizes file content with blocks sent by frontend after OutOfSync."""
+
+        result = context.content_monitor.apply_delta(content_delta.file, content_delta.blockSize, content_delta.segments,
+                                                     content_delta.fingerprint, content_delta.digest)
+
+        if result == SynchronizationResult.OutOfSync:
+            # without checksums to request the complete content:
+            context.send_message(OutOfSync(content_delta.file))
+
+    def _out_of_sync(self, filepath, context):
+        """Returns OutOfSync message with checksums of the stale content, if any, to be answered by a delta."""
+        content = context.content_monitor[filepath]
+        if not content:
+            return OutOfSync(filepath)
+
+        size = block_size(len(content))
+        checksums = block_checksums(content, size)
+        if not checksums:
+            return OutOfSync(filepath)
+        _logger.debug('Sending checksums of %d blocks of %s.' % (len(checksums), filepath))
+        return OutOfSync(filepath, size, checksums)
 
     def on_static_syntax_request(self, format, fileExtensions, context):
         """Handle requests for static syntax definitions, expected to be in normalized form."""
@@ -263,5 +419,12 @@ class FrontendConnection:
         #: Content monitor for synchronized file data sent by connected frontend.
         self.content_monitor = content_monitor or ContentMonitor()
 
+        #: Outbound data waiting to be sent.
+        self.send_queue = SendQueue()
+
     def send_message(self, msg):
         self.service.send_message(self, msg)
+
+    def flush(self):
+        """Sends queued messages immediately instead of waiting for the end of the current loop cycle."""
+        self.service.flush(self)
@@ -0,0 +1,157 @@
+"""Buffers between sockets and message serialization."""
+from jep_py.config import BUFFER_LENGTH
+
+#: Maximal number of chunks passed to a single vectored write (IOV_MAX is 1024 on common platforms).
+MAX_SEND_CHUNKS = 1024
+
+#: Factor by which a receive buffer may outgrow its initial capacity before it is shrunk again once drained.
+SHRINK_FACTOR = 4
+
+
+class ReceiveBuffer:
+    """Preallocated, growable byte buffer that sockets receive into and decoders read from without copies.
+
+    Readable data is held between a read and a write offset. The buffer is only compacted (or grown) if the free space behind
+    the write offset is not sufficient for the next reception, and both offsets are reset for free whenever all data was read.
+    Storage grown far beyond the initial capacity, e.g. for a single large message, is released once all data was read.
+    """
+
+    def __init__(self, capacity=2 * BUFFER_LENGTH, chunk_size=BUFFER_LENGTH):
+        #: Underlying storage, replaced when grown or shrunk.
+        self.data = bytearray(capacity)
+        #: Capacity the buffer is shrunk back to.
+        self.initial_capacity = capacity
+        #: Start of readable data.
+        self.read_pos = 0
+        #: End of readable data.
+        self.write_pos = 0
+        #: Minimal free space to offer to a single socket reception.
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        """Number of readable bytes."""
+        return self.write_pos - self.read_pos
+
+    @property
+    def capacity(self):
+        return len(self.data)
+
+    def view(self):
+        """Memory view of readable data, to be released before the buffer is written to again."""
+        return memoryview(self.data)[self.read_pos:self.write_pos]
+
+    def consume(self, count):
+        """Marks given number of bytes as read."""
+        assert 0 <= count <= len(self), 'Cannot consume more bytes than readable.'
+        self.read_pos += count
+        if self.read_pos == self.write_pos:
+            self._drained()
+
+    def clear(self):
+        """Drops all readable data."""
+        self._drained()
+
+    def recv_into(self, sock):
+        """Receives data from socket directly into free space of buffer, returns the number of bytes received."""
+        self.reserve(self.chunk_size)
+        with memoryview(self.data) as view:
+            count = sock.recv_into(view[self.write_pos:])
+        self.write_pos += count
+        return count
+
+    def extend(self, chunk):
+        """Copies given data chunk behind readable data."""
+        count = len(chunk)
+        self.reserve(count)
+        self.data[self.write_pos:self.write_pos + count] = chunk
+        self.write_pos += count
+
+    def reserve(self, count):
+        """Makes sure at least the given number of bytes can be written behind readable data."""
+        if self.capacity - self.write_pos >= count:
+            return
+
+        readable = len(self)
+        if readable + count <= self.capacity:
+            # move readable data to front, in place:
+            with memoryview(self.data) as view:
+                view[:readable] = view[self.read_pos:self.write_pos]
+        else:
+            data = bytearray(max(2 * self.capacity, readable + count))
+            data[:readable] = memoryview(self.data)[self.read_pos:self.write_pos]
+            self.data = data
+
+        self.read_pos = 0
+        self.write_pos = readable
+
+    def _drained(self):
+        """Resets offsets of empty buffer and releases storage grown beyond the shrink threshold."""
+        self.read_pos = self.write_pos = 0
+        if self.capacity > SHRINK_FACTOR * self.initial_capacity:
+            self.data = bytearray(self.initial_capacity)
+
+
+class SendQueue:
+    """Outbound data of a connection, collected to be written to its socket with a single vectored write."""
+
+    def __init__(self):
+        #: Queued data chunks, the first one may be a view on the unsent rest of a partially sent chunk.
+        self.chunks = []
+        #: Number of queued bytes.
+        self.size = 0
+        #: Time the oldest queued chunk was added.
+        self.ts_oldest = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data, timestamp=None):
+        """Queues data chunk for sending."""
+        if not self.chunks:
+            self.ts_oldest = timestamp
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def clear(self):
+        """Drops all queued data."""
+        self.chunks = []
+        self.size = 0
+        self.ts_oldest = None
+
+    def flush(self, sock):
+        """Writes as much queued data as the socket accepts without blocking, returns number of bytes sent."""
+        total = 0
+        while self.chunks:
+            try:
+                if len(self.chunks) == 1:
+                    sent = sock.send(self.chunks[0])
+                elif hasattr(sock, 'sendmsg'):
+                    sent = sock.sendmsg(self.chunks[:MAX_SEND_CHUNKS])
+                else:
+                    sent = sock.send(b''.join(self.chunks))
+            except BlockingIOError:
+                break
+
+            self._consume(sent)
+            total += sent
+            if not sent:
+                break
+
+        return total
+
+    def _consume(self, count):
+        """Removes given number of bytes from the head of the queue."""
+        self.size -= count
+        sent_chunks = 0
+        for chunk in self.chunks:
+            if count < len(chunk):
+                break
+            count -= len(chunk)
+            sent_chunks += 1
+        del self.chunks[:sent_chunks]
+
+        if count:
+            # keep unsent rest of partially sent chunk without copying it:
+            self.chunks[0] = memoryview(self.chunks[0])[count:]
+        if not self.chunks:
+            self.ts_oldest = None
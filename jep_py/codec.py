@@ -0,0 +1,306 @@
+"""Registry of codecs used to encode messages and to decode data streams.
+
+All codecs share the same streaming contract: ``codec.unpacker(buffer)`` returns an object that decodes the data received into
+the given ``ReceiveBuffer``, returning the next complete object in built-in form from ``unpack()`` or ``NEED_DATA`` if the
+buffer does not hold one yet. ``at_boundary`` tells whether the buffer's read position is at the start of an object, and
+``reset()`` drops any decoding state, so the caller may consume data from the buffer itself at object boundaries. ``partial``
+is the number of bytes of the object being decoded that were already consumed from the buffer, ``copied`` the number of
+buffered bytes the unpacker holds another copy of.
+
+By default the C accelerated ``msgpack`` extension is used if installed, falling back to the pure Python ``umsgpack``
+implementation. Both produce identical msgpack streams. The JSON codec exchanges newline separated JSON documents and is meant
+for debugging only, as it requires a peer using the same codec.
+"""
+import collections
+import enum
+import json
+import logging
+import umsgpack
+from jep_py.buffer import ReceiveBuffer
+from jep_py.packer import pack_message, packb, serialized_fields
+from jep_py.serializer import Serializable, Columns, TextPayload, serialize_to_builtins, compact_values, enum_ordinal
+from jep_py.unpacker import Unpacker, NEED_DATA
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_logger = logging.getLogger(__name__)
+
+
+class Codec:
+    """Encoding of messages to bytes and streaming decoding of bytes to built-in objects."""
+
+    #: Name the codec is registered with.
+    name = None
+    #: Does the encoded stream support msgpack extension types?
+    supports_ext = False
+
+    def encode_message(self, message, name_key, name, compact=False):
+        """Encodes message object, adding its type name under the given key, with field values optionally in compact form."""
+        raise NotImplementedError()
+
+    def dumps(self, obj):
+        """Encodes object in built-in form."""
+        raise NotImplementedError()
+
+    def loads(self, data):
+        """Decodes single object from given data."""
+        unpacker = self.unpacker(ReceiveBuffer(len(data)))
+        unpacker.feed(data)
+        obj = unpacker.unpack()
+        if obj is NEED_DATA:
+            raise ValueError('Incomplete data, cannot decode object.')
+        return obj
+
+    def unpacker(self, buffer):
+        """Returns streaming decoder reading from given receive buffer."""
+        raise NotImplementedError()
+
+
+class UMsgpackCodec(Codec):
+    """Pure Python msgpack codec."""
+
+    name = 'umsgpack'
+    supports_ext = True
+
+    def encode_message(self, message, name_key, name, compact=False):
+        return pack_message(message, name_key, name, compact)
+
+    def dumps(self, obj):
+        return packb(obj)
+
+    def unpacker(self, buffer):
+        return Unpacker(buffer)
+
+
+def _msgpack_default(obj):
+    """Shallow conversion of schema objects for the C packer, which handles the nested values itself."""
+    if isinstance(obj, Serializable):
+        return {field.name: value for field, value in serialized_fields(obj)}
+    if isinstance(obj, Columns):
+        return list(obj)
+    if isinstance(obj, TextPayload):
+        return obj.text
+    if isinstance(obj, enum.Enum):
+        return obj.name
+    if isinstance(obj, umsgpack.Ext):
+        return msgpack.ExtType(obj.type, obj.data)
+    raise TypeError('Cannot pack object "%s" of type %s.' % (obj, type(obj).__name__))
+
+
+def _msgpack_default_compact(obj):
+    """Shallow conversion of schema objects for the C packer to compact form."""
+    if isinstance(obj, Serializable):
+        return compact_values(obj)
+    if isinstance(obj, Columns):
+        return obj.to_builtins(compact=True)
+    if isinstance(obj, TextPayload):
+        return obj.data
+    if isinstance(obj, enum.Enum):
+        return enum_ordinal(obj)
+    return _msgpack_default(obj)
+
+
+def _msgpack_ext_hook(code, data):
+    return umsgpack.Ext(code, data)
+
+
+def _msgpack_options():
+    """Decoding options of the C extension."""
+    try:
+        msgpack.Unpacker(strict_map_key=False)
+        return dict(raw=False, strict_map_key=False, ext_hook=_msgpack_ext_hook)
+    except TypeError:
+        # versions before 1.0 do not know about strict map keys:
+        return dict(raw=False, ext_hook=_msgpack_ext_hook)
+
+
+#: Decoding options of the C extension, if installed.
+_MSGPACK_OPTIONS = _msgpack_options() if msgpack else None
+
+
+class CMsgpackUnpacker:
+    """Adapter of the C extension's unpacker to the streaming contract.
+
+    Data is fed to the C unpacker as it arrives, but only consumed from the receive buffer once it was decoded, so the buffer
+    always holds exactly the undecoded data.
+    """
+
+    #: Data is only consumed from the buffer for complete objects.
+    partial = 0
+
+    @property
+    def copied(self):
+        """Buffered bytes fed to the C unpacker are held in its internal buffer as well."""
+        return self._fed
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._unpacker = None
+        #: Number of readable bytes of buffer already fed to the C unpacker.
+        self._fed = 0
+        self.reset()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    @property
+    def pending(self):
+        return len(self.buffer)
+
+    @property
+    def at_boundary(self):
+        return True
+
+    def reset(self):
+        """Drops data fed to the C unpacker, it is still held by the receive buffer."""
+        if self._unpacker is None or self._fed:
+            self._unpacker = msgpack.Unpacker(**_MSGPACK_OPTIONS)
+            self._fed = 0
+
+    def unpack(self):
+        buffer = self.buffer
+        if len(buffer) > self._fed:
+            with memoryview(buffer.data) as view:
+                self._unpacker.feed(view[buffer.read_pos + self._fed:buffer.write_pos])
+            self._fed = len(buffer)
+
+        start = self._unpacker.tell()
+        try:
+            obj = next(self._unpacker)
+        except StopIteration:
+            return NEED_DATA
+
+        count = self._unpacker.tell() - start
+        self._fed -= count
+        buffer.consume(count)
+        return obj
+
+    def __iter__(self):
+        obj = self.unpack()
+        while obj is not NEED_DATA:
+            yield obj
+            obj = self.unpack()
+
+
+class CMsgpackCodec(Codec):
+    """Codec based on the C accelerated msgpack extension."""
+
+    name = 'msgpack'
+    supports_ext = True
+
+    def __init__(self):
+        self._packer = msgpack.Packer(default=_msgpack_default, use_bin_type=True)
+        self._compact_packer = msgpack.Packer(default=_msgpack_default_compact, use_bin_type=True)
+
+    def encode_message(self, message, name_key, name, compact=False):
+        serialized = collections.OrderedDict([(name_key, name)])
+        serialized.update((field.name, value) for field, value in serialized_fields(message))
+        return (self._compact_packer if compact else self._packer).pack(serialized)
+
+    def dumps(self, obj):
+        return self._packer.pack(obj)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, **_MSGPACK_OPTIONS)
+
+    def unpacker(self, buffer):
+        return CMsgpackUnpacker(buffer)
+
+
+class JsonUnpacker:
+    """Streaming decoder of newline separated JSON documents."""
+
+    #: Data is only consumed from the buffer for complete documents.
+    partial = 0
+    #: Documents are decoded from the buffer directly.
+    copied = 0
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        #: Number of readable bytes already searched for a separator.
+        self._scanned = 0
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    @property
+    def pending(self):
+        return len(self.buffer)
+
+    @property
+    def at_boundary(self):
+        return True
+
+    def reset(self):
+        self._scanned = 0
+
+    def unpack(self):
+        buffer = self.buffer
+        end = buffer.data.find(b'\n', buffer.read_pos + self._scanned, buffer.write_pos)
+        if end < 0:
+            self._scanned = len(buffer)
+            return NEED_DATA
+
+        with memoryview(buffer.data) as view:
+            text = str(view[buffer.read_pos:end], 'utf-8')
+        buffer.consume(end + 1 - buffer.read_pos)
+        self._scanned = 0
+        return json.loads(text)
+
+    def __iter__(self):
+        obj = self.unpack()
+        while obj is not NEED_DATA:
+            yield obj
+            obj = self.unpack()
+
+
+class JsonCodec(Codec):
+    """Newline separated JSON codec for debugging."""
+
+    name = 'json'
+
+    def encode_message(self, message, name_key, name, compact=False):
+        serialized = {field.name: serialize_to_builtins(value, compact) for field, value in serialized_fields(message)}
+        serialized[name_key] = name
+        return self.dumps(serialized)
+
+    def dumps(self, obj):
+        return (json.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def unpacker(self, buffer):
+        return JsonUnpacker(buffer)
+
+
+#: Registered codec classes by name, in order of preference.
+_codecs = collections.OrderedDict()
+
+
+def register_codec(codec_class):
+    """Registers codec class under its name."""
+    _codecs[codec_class.name] = codec_class
+
+
+def available_codecs():
+    """Names of registered codecs in order of preference."""
+    return list(_codecs)
+
+
+def get_codec(name=None):
+    """Returns new instance of codec with given name, or of the preferred msgpack codec if no name is given."""
+    if name is None:
+        name = 'msgpack' if 'msgpack' in _codecs else 'umsgpack'
+    try:
+        return _codecs[name]()
+    except KeyError:
+        raise ValueError('Unknown codec %s, available: %s.' % (name, ', '.join(_codecs)))
+
+
+if msgpack:
+    register_codec(CMsgpackCodec)
+else:
+    _logger.debug('C accelerated msgpack extension not installed, using pure Python implementation.')
+register_codec(UMsgpackCodec)
+register_codec(JsonCodec)
@@ -8,6 +8,29 @@ import datetime
 #: Length of socket reception buffer.
 BUFFER_LENGTH = 65536
 
+#: Maximal number of bytes buffered per connection while waiting for a message to complete, more data is discarded.
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+#: Maximal period outbound messages are held back to be sent together, zero sends them at the end of each loop iteration.
+SEND_BATCH_WINDOW = datetime.timedelta(microseconds=0)
+
+#: Minimal size of encoded messages to be compressed, if compression is enabled.
+COMPRESSION_THRESHOLD = 4096
+
+#: Compression level passed to zlib, trading CPU time for bytes saved.
+COMPRESSION_LEVEL = 6
+
+#: Number of characters of synchronized file contents kept in memory per connection, including flat texts built from them, least
+#: recently used files beyond are moved to a spill file. None keeps all contents in memory.
+CONTENT_CHARACTER_BUDGET = 256 * 1024 * 1024
+
+#: Number of edits kept per synchronized file, for listeners to ask for the changes since the version they analyzed last.
+EDIT_LOG_SIZE = 1000
+
+#: Minimal number of characters per block of the checksums a backend sends along with OutOfSync, for the frontend to resynchronize
+#: by sending changed blocks only.
+DELTA_BLOCK_SIZE = 1024
+
 #: Number of seconds between select timeouts.
 TIMEOUT_SELECT_SEC = 0.5
 
@@ -2,9 +2,22 @@
 import enum
 import logging
 import collections
+import mmap
+import tempfile
+from jep_py.config import CONTENT_CHARACTER_BUDGET, EDIT_LOG_SIZE
+from jep_py.delta import content_digest
+from jep_py.rope import Rope
+from jep_py.schema import DeltaSegment
+from jep_py.serializer import TextPayload
 
 _logger = logging.getLogger(__name__)
 
+#: Minimal number of unused bytes in spill file before it is compacted.
+SPILL_COMPACTION_MIN = 1024 * 1024
+
+#: Returned by ContentMonitor.edits_since() if the edits are not known anymore, so the file has to be analyzed as a whole.
+FULL_REPARSE = 'FULL_REPARSE'
+
 
 @enum.unique
 class SynchronizationResult(enum.Enum):
@@ -28,31 +41,30 @@ class NewlineMode:
 
     @classmethod
     def detect(cls, text):
-        mode = cls.Unknown
-
-        if text:
-            chariter = iter(text)
-            rpending = False
-
-            try:
-                while mode < cls.All:
-                    c = next(chariter)
-                    if c == '\n':
-                        mode |= cls.N
-                    elif c == '\r':
-                        rpending = True
-                        c = next(chariter)
-                        rpending = False
-                        if c == '\n':
-                            mode |= cls.RN
-                        else:
-                            mode |= cls.R
-            except StopIteration:
-                # check if '\r' was last character in text and iteration stopped when testing for following '\n'
-                if rpending:
-                    mode |= cls.R
-
-        return mode
+        return cls.from_counts(cls.count(text)) if text else cls.Unknown
+
+    @classmethod
+    def count(cls, text):
+        """Returns numbers of '\n', '\r' and '\r\n' newlines in text, each '\r\n' is only counted as such."""
+        rn = text.count('\r\n')
+        return text.count('\n') - rn, text.count('\r') - rn, rn
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Returns mode of text with given numbers of newlines."""
+        n, r, rn = counts
+        return (cls.N if n else 0) | (cls.R if r else 0) | (cls.RN if rn else 0)
+
+    @classmethod
+    def update_counts(cls, counts, removed, inserted):
+        """Returns numbers of newlines after replacing a range of text.
+
+        Both removed and inserted text must include the characters next to the range, if any, to account for '\r\n' newlines
+        split or joined by the replacement.
+        """
+        removed = cls.count(removed)
+        inserted = cls.count(inserted)
+        return tuple(c - d + i for c, d, i in zip(counts, removed, inserted))
 
     @classmethod
     def open_newline_mode(cls, mode):
@@ -72,31 +84,461 @@ class NewlineMode:
         return ''
 
 
+def merge_edits(length, first, second):
+    """Returns a single edit equivalent to applying two edits one after the other, or None if they cannot be merged.
+
+    Edits are (data, start, end) tuples like the arguments of ContentMonitor.synchronize(), the first one applied to text of
+    given length. Edits are merged if the range of the second one overlaps or touches the data inserted by the first one, so
+    the merged data is built from both edits without the text itself. The merged end index is always explicit.
+    """
+    data1, start1, end1 = first
+    data2, start2, end2 = second
+    if isinstance(data1, TextPayload):
+        data1 = data1.text
+    if isinstance(data2, TextPayload):
+        data2 = data2.text
+
+    end1 = length if end1 is None else end1
+    if not 0 <= start1 <= end1 <= length:
+        return None
+
+    # second edit refers to text after first one:
+    length2 = length - (end1 - start1) + len(data1)
+    end2 = length2 if end2 is None else end2
+    if not 0 <= start2 <= end2 <= length2:
+        return None
+
+    inserted_end = start1 + len(data1)
+    if start2 > inserted_end or end2 < start1:
+        # disjoint, text between the edits is unknown:
+        return None
+
+    data = data1[:max(start2 - start1, 0)] + data2 + data1[max(end2 - start1, 0):]
+    return data, min(start1, start2), end1 + max(end2 - inserted_end, 0)
+
+
+def compose_edits(edits):
+    """Returns the combined effect of edits applied one after the other, as sorted and disjoint (start, end, length) changes.
+
+    Each edit is a (start, end, length) tuple replacing the range of the text at that time by length characters. The start and
+    end index of changes refer to the text before the first edit, their length is the one of the replacement in the text after
+    the last edit. Changes touching each other are merged, changes without effect are dropped.
+    """
+    changes = []
+    for start, end, length in edits:
+        # offset of current text relative to original text, by changes before the edit:
+        shift = i = 0
+        while i < len(changes) and changes[i][0] + shift + changes[i][2] < start:
+            shift += changes[i][2] - (changes[i][1] - changes[i][0])
+            i += 1
+        first = i
+        shift_before = shift
+
+        merged_start = start - shift_before
+        merged_end = end - shift_before
+        while i < len(changes) and changes[i][0] + shift <= end:
+            merged_start = min(merged_start, changes[i][0])
+            shift += changes[i][2] - (changes[i][1] - changes[i][0])
+            merged_end = max(changes[i][1], end - shift)
+            i += 1
+
+        # current length of merged range before the edit:
+        current_length = merged_end + shift - (merged_start + shift_before)
+        merged = [merged_start, merged_end, current_length - (end - start) + length]
+        changes[first:i] = [merged] if merged[0] < merged[1] or merged[2] else []
+    return [tuple(change) for change in changes]
+
+
+class Snapshot:
+    """Immutable content of a file at a given version.
+
+    Snapshots share all unchanged parts of the content with earlier and later versions, so they are cheap to take and can be
+    analyzed in the background while the file is updated. Line numbers start at 1 like the ones of problems, columns start at 0.
+    """
+
+    __slots__ = ('filepath', 'version', 'rope', 'newline_counts', '_text')
+
+    def __init__(self, filepath, version, rope, newline_counts=None):
+        self.filepath = filepath
+        #: Number of updates of the file up to this snapshot.
+        self.version = version
+        #: Content as rope.
+        self.rope = rope
+        #: Numbers of '\n', '\r' and '\r\n' newlines, see NewlineMode.count().
+        self.newline_counts = newline_counts or NewlineMode.count(str(rope))
+        #: Flat text, built on demand.
+        self._text = None
+
+    def __repr__(self):
+        return 'Snapshot(%s, version %d, %d characters)' % (self.filepath, self.version, len(self.rope))
+
+    def __len__(self):
+        return len(self.rope)
+
+    def __getitem__(self, index):
+        return self.rope[index]
+
+    @property
+    def newline_mode(self):
+        return NewlineMode.from_counts(self.newline_counts)
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of content, see jep_py.rope.fingerprint()."""
+        return self.rope.fingerprint
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = str(self.rope)
+        return self._text
+
+    def offset_to_line_col(self, offset):
+        """Returns line and column of character at given offset."""
+        index = self.rope.line_index(offset)
+        return index + 1, offset - self.rope.line_start(index)
+
+    def line_col_to_offset(self, line, col):
+        """Returns offset of character at given line and column."""
+        rope = self.rope
+        start = rope.line_start(line - 1)
+        end = rope.line_end(line - 1)
+        if not 0 <= col <= end - start:
+            raise IndexError('Column %d out of range, line %d of %s has %d characters.' % (col, line, self.filepath, end - start))
+        return start + col
+
+    def line(self, line):
+        """Returns text of line, without line end."""
+        return self.rope.line(line - 1)
+
+
+class SpillFile:
+    """Temporary file holding UTF-8 encoded contents by key, read back through memory maps.
+
+    Lone surrogates, which decoding JSON may produce, are kept as is, like in fingerprints.
+
+    Entries are appended and become unused when taken. The file is compacted once the unused part exceeds the used one.
+    """
+
+    def __init__(self, directory=None):
+        #: Directory to create the file in, None for the system default.
+        self.directory = directory
+        #: Number of bytes written to file.
+        self.size = 0
+        #: Number of bytes of entries not taken yet.
+        self.used = 0
+        #: Entries as (offset, length) by key.
+        self._entries = {}
+        self._file = None
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def put(self, key, chunks):
+        """Appends entry with given text chunks."""
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='jep-content-', dir=self.directory)
+
+        self._file.seek(self.size)
+        length = 0
+        for chunk in chunks:
+            length += self._file.write(chunk.encode('utf-8', 'surrogatepass'))
+        self._file.flush()
+
+        self._entries[key] = (self.size, length)
+        self.size += length
+        self.used += length
+
+    def take(self, key):
+        """Returns text of entry and removes it."""
+        offset, length = self._entries.pop(key)
+        text = self._read(offset, length).decode('utf-8', 'surrogatepass')
+
+        self.used -= length
+        if not self._entries:
+            self._file.truncate(0)
+            self.size = 0
+        elif self.size - self.used > max(self.used, SPILL_COMPACTION_MIN):
+            self._compact()
+        return text
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._entries.clear()
+        self.size = self.used = 0
+
+    def _read(self, offset, length):
+        if not length:
+            return b''
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[offset:offset + length]
+
+    def _compact(self):
+        """Copies entries not taken yet to a new file."""
+        _logger.debug('Compacting spill file, %d of %d bytes used.' % (self.used, self.size))
+        compacted = tempfile.TemporaryFile(prefix='jep-content-', dir=self.directory)
+        entries = {}
+        for key, (offset, length) in self._entries.items():
+            entries[key] = (compacted.tell(), length)
+            compacted.write(self._read(offset, length))
+        compacted.flush()
+
+        self._file.close()
+        self._file = compacted
+        self._entries = entries
+        self.size = self.used
+
+
 class ContentMonitor:
     """Monitors the file contents based on synchronization requests from a frontend.
 
-    Current implementation uses straight forward Python strings, which involves multiple copies on insert:
-
-        * Copy to first slice
-        * Copy to second slice
-        * Copy of all slices and inserted text to destination string
+    Contents are stored in ropes, so an update takes logarithmic time in the file size instead of copying the complete file. Each
+    update creates a new immutable snapshot of the file with the next version number, sharing structure with the previous one.
+    The flat text of a file is only built when requested and then kept until the file's next update.
 
-    If this becomes too much of a performance hit, it may be optimized, e.g. in form of an extension in C or
-    a data structure that directly represents string edit operations (btree, ...).
+    If the resident contents exceed the character budget, the least recently used files are moved to a spill file. They are read
+    back transparently on their next access. Flat texts built for resident files count against the budget as well.
     """
 
-    def __init__(self):
-        #: File contents by path.
-        self._content_by_path = {}
+    def __init__(self, *, character_budget=CONTENT_CHARACTER_BUDGET, spill_directory=None, edit_log_size=EDIT_LOG_SIZE):
+        #: Latest snapshot of resident file contents by path, least recently used first.
+        self._snapshot_by_path = collections.OrderedDict()
+        #: Versions, newline counts and fingerprints of contents moved to spill file by path.
+        self._spilled_by_path = {}
+        #: Latest edits by path as (version, start, end, length) tuples, oldest first, dropped if replaced as a whole.
+        self._edit_log_by_path = {}
+        #: Maximal number of edits kept per file.
+        self.edit_log_size = edit_log_size
+        #: Maximal number of characters of resident file contents, None for no limit.
+        self.character_budget = character_budget
+        #: Number of characters of resident file contents, including flat texts built.
+        self.resident_characters = 0
+        #: Number of resident characters counted per file.
+        self._resident_by_path = {}
+        #: Number of times a file was moved to the spill file.
+        self.evictions = 0
+        #: Number of times a file was read back from the spill file.
+        self.reloads = 0
+        self._spill = SpillFile(spill_directory)
 
     def __getitem__(self, filepath):
-        """Returns the bytes know for file with given path."""
-        return self._content_by_path.get(filepath, None)
+        """Returns the text known for file with given path."""
+        snapshot = self._get(filepath)
+        if snapshot is None:
+            return None
+        text = snapshot.text
+        self._count(snapshot)
+        return text
+
+    @property
+    def spilled_bytes(self):
+        """Number of bytes of file contents in spill file."""
+        return self._spill.used
+
+    def snapshot(self, filepath):
+        """Returns the current snapshot of file with given path, or None if its content is not known."""
+        return self._get(filepath)
+
+    def version(self, filepath):
+        """Returns the current version of file with given path, 0 if its content is not known."""
+        snapshot = self._snapshot_by_path.get(filepath)
+        if snapshot is None:
+            return self._spilled_by_path.get(filepath, (0, None, None))[0]
+        return snapshot.version
+
+    def length(self, filepath):
+        """Returns the number of characters of file with given path, 0 if its content is not known."""
+        snapshot = self._get(filepath)
+        return 0 if snapshot is None else len(snapshot)
+
+    def newline_mode(self, filepath):
+        """Returns the newline mode of file with given path, kept up to date with each update."""
+        snapshot = self._snapshot_by_path.get(filepath)
+        if snapshot is None:
+            counts = self._spilled_by_path.get(filepath, (0, (0, 0, 0), None))[1]
+            return NewlineMode.from_counts(counts)
+        return snapshot.newline_mode
+
+    def fingerprint(self, filepath):
+        """Returns the fingerprint of the content of file with given path, None if its content is not known.
+
+        The fingerprint is kept up to date with each update, so frontends can cheaply verify the backend is still in sync.
+        """
+        snapshot = self._snapshot_by_path.get(filepath)
+        if snapshot is None:
+            return self._spilled_by_path.get(filepath, (0, None, None))[2]
+        return snapshot.fingerprint
+
+    def is_current(self, snapshot):
+        """Checks whether the given snapshot still reflects the latest content of its file, e.g. before publishing results."""
+        return self.version(snapshot.filepath) == snapshot.version
+
+    def rope(self, filepath):
+        """Returns the content of file with given path as rope, e.g. to extract slices without building the flat text."""
+        snapshot = self._get(filepath)
+        return None if snapshot is None else snapshot.rope
+
+    def edits_since(self, filepath, version):
+        """Returns the changes of given file since the given version as sorted (start, end, length) tuples, see compose_edits().
+
+        Start and end index refer to the content of the given version, e.g. the version of the snapshot a listener analyzed last.
+        Returns FULL_REPARSE if the edits since that version are not known, because the file was replaced as a whole or more
+        edits were made than are kept.
+        """
+        current = self.version(filepath)
+        if current and version == current:
+            return []
+
+        log = self._edit_log_by_path.get(filepath)
+        if not log or not 0 < version < current or log[0][0] > version + 1:
+            return FULL_REPARSE
+        return compose_edits(edit[1:] for edit in log if edit[0] > version)
+
+    def apply_delta(self, filepath, block_size, segments, fingerprint, digest):
+        """Replaces content of given file by DeltaSegment or (data, block, count) segments referring to blocks of its current content.
+
+        The content is only updated if the result has the given fingerprint and digest, see jep_py.delta. Copied blocks share the
+        nodes of the current rope, so only literal data is stored anew.
+        """
+        snapshot = self._get(filepath)
+        if snapshot is None:
+            _logger.warning('Received content delta for unknown file %s.' % filepath)
+            return SynchronizationResult.OutOfSync
+
+        if not isinstance(block_size, int) or block_size <= 0:
+            _logger.warning('Received content delta for %s with invalid block size %r.' % (filepath, block_size))
+            return SynchronizationResult.OutOfSync
+
+        if not isinstance(segments, list):
+            _logger.warning('Received content delta for %s with invalid segments %r.' % (filepath, type(segments)))
+            return SynchronizationResult.OutOfSync
+
+        content = snapshot.rope
+        updated = Rope()
+        for segment in segments:
+            if isinstance(segment, DeltaSegment):
+                segment = segment.data, segment.block, segment.count
+            if not isinstance(segment, (tuple, list)) or len(segment) != 3:
+                _logger.warning('Received content delta for %s with invalid segment %r.' % (filepath, type(segment)))
+                return SynchronizationResult.OutOfSync
+            data, block, count = segment
+            if isinstance(data, TextPayload):
+                data = data.text
+            if not isinstance(data, str) or not isinstance(block, int) or not isinstance(count, int):
+                _logger.warning('Received content delta for %s with invalid segment (%r, %r, %r).' % (filepath, type(data), block, count))
+                return SynchronizationResult.OutOfSync
+            if data:
+                updated += Rope(data)
+            if count:
+                start = block * block_size
+                end = start + count * block_size
+                if not 0 <= start <= end <= len(content):
+                    _logger.warning('Received content delta for %s, with current length %d. Blocks %d to %d inconsistent.'
+                                    % (filepath, len(content), block, block + count))
+                    return SynchronizationResult.OutOfSync
+                updated += content.slice(start, end)
+
+        if updated.fingerprint != fingerprint:
+            _logger.warning('Received content delta for %s, result has fingerprint %d instead of %r.'
+                            % (filepath, updated.fingerprint, fingerprint))
+            return SynchronizationResult.OutOfSync
+
+        if content_digest(updated.chunks()) != digest:
+            _logger.warning('Received content delta for %s, result does not match digest, copied blocks may differ.' % filepath)
+            return SynchronizationResult.OutOfSync
+
+        _logger.debug('Updating file %s from delta of %d segments.' % (filepath, len(segments)))
+        self._edit_log_by_path.pop(filepath, None)
+        self._store(Snapshot(filepath, snapshot.version + 1, updated))
+        return SynchronizationResult.Updated
+
+    def close(self):
+        """Drops all contents and removes the spill file."""
+        self._snapshot_by_path.clear()
+        self._spilled_by_path.clear()
+        self._edit_log_by_path.clear()
+        self._resident_by_path.clear()
+        self.resident_characters = 0
+        self._spill.close()
+
+    def offset_to_line_col(self, filepath, offset):
+        """Returns line and column of character at given offset of file."""
+        return self._snapshot(filepath).offset_to_line_col(offset)
+
+    def line_col_to_offset(self, filepath, line, col):
+        """Returns offset of character at given line and column of file."""
+        return self._snapshot(filepath).line_col_to_offset(line, col)
+
+    def line(self, filepath, line):
+        """Returns text of line of file, without line end."""
+        return self._snapshot(filepath).line(line)
+
+    def _snapshot(self, filepath):
+        snapshot = self._get(filepath)
+        if snapshot is None:
+            raise KeyError('No content known for file %s.' % filepath)
+        return snapshot
+
+    def _get(self, filepath):
+        """Returns current snapshot of file, read back from spill file if needed, or None if its content is not known."""
+        snapshot = self._snapshot_by_path.get(filepath)
+        if snapshot is not None:
+            self._snapshot_by_path.move_to_end(filepath)
+            # the flat text may have been built since the snapshot was counted:
+            self._count(snapshot)
+            return snapshot
+
+        spilled = self._spilled_by_path.pop(filepath, None)
+        if spilled is None:
+            return None
+
+        _logger.debug('Reading content of %s back from spill file.' % filepath)
+        version, newline_counts, _ = spilled
+        snapshot = Snapshot(filepath, version, Rope(self._spill.take(filepath)), newline_counts)
+        self.reloads += 1
+        self._store(snapshot)
+        return snapshot
+
+    def _log_edit(self, filepath, edit):
+        log = self._edit_log_by_path.get(filepath)
+        if log is None:
+            log = self._edit_log_by_path[filepath] = collections.deque(maxlen=self.edit_log_size)
+        log.append(edit)
+
+    def _store(self, snapshot):
+        """Makes given snapshot the current one of its file and moves other files to the spill file if over budget."""
+        self._snapshot_by_path.pop(snapshot.filepath, None)
+        self._snapshot_by_path[snapshot.filepath] = snapshot
+        self._count(snapshot)
+
+    def _count(self, snapshot):
+        """Counts the characters of given current snapshot of its file and moves other files to the spill file if over budget."""
+        characters = len(snapshot) + (0 if snapshot._text is None else len(snapshot._text))
+        self.resident_characters += characters - self._resident_by_path.get(snapshot.filepath, 0)
+        self._resident_by_path[snapshot.filepath] = characters
+
+        if self.character_budget is None:
+            return
+
+        # never evict the file just counted, which was used most recently:
+        while self.resident_characters > self.character_budget and len(self._snapshot_by_path) > 1:
+            filepath, evicted = self._snapshot_by_path.popitem(last=False)
+            _logger.debug('Moving content of %s to spill file, %d characters resident.' % (filepath, self.resident_characters))
+            self._spill.put(filepath, evicted.rope.chunks())
+            self._spilled_by_path[filepath] = (evicted.version, evicted.newline_counts, evicted.fingerprint)
+            self.resident_characters -= self._resident_by_path.pop(filepath)
+            self.evictions += 1
 
     def synchronize(self, filepath, data, start, end=None):
-        """Synchronizes content of given file."""
+        """Synchronizes content of given file with string or text payload."""
+
+        if isinstance(data, TextPayload):
+            data = data.text
 
-        content = self._content_by_path.get(filepath, '')
+        snapshot = self._get(filepath)
+        content = Rope() if snapshot is None else snapshot.rope
         length = len(content)
 
         # end index is optional:
@@ -113,8 +555,16 @@ class ContentMonitor:
 
         _logger.debug('Updating file %s from index %d to %d with "%s".' % (filepath, start, end, data))
 
-        before = content[0:start]
-        after = content[end:]
-
-        self._content_by_path[filepath] = ''.join([before, data, after])
+        if snapshot is None:
+            version, newline_counts = 1, NewlineMode.count(data)
+            self._edit_log_by_path.pop(filepath, None)
+        else:
+            # only count newlines in the replaced range, extended by one character on each side for split or joined '\r\n':
+            before = content[start - 1] if start else ''
+            after = content[end] if end < length else ''
+            newline_counts = NewlineMode.update_counts(snapshot.newline_counts, content[start - len(before):end + len(after)],
+                                                       before + data + after)
+            version = snapshot.version + 1
+            self._log_edit(filepath, (version, start, end, len(data)))
+        self._store(Snapshot(filepath, version, content.replace(start, end, data), newline_counts))
         return SynchronizationResult.Updated
@@ -0,0 +1,101 @@
+"""Delta encoding of file content against block checksums of a stale copy, following the rsync algorithm.
+
+The peer holding the stale copy splits it into blocks of equal size and sends a checksum of each complete block. The peer
+holding the current content slides a window of block size over it, looking up the checksum of the window at each position,
+which is updated in constant time when the window moves on. The resulting delta is a list of segments, each holding literal
+text followed by a run of consecutive blocks of the stale copy.
+
+Unlike rsync, the rolling checksum is the 61 bit polynomial fingerprint also used to verify content, see
+``jep_py.rope.fingerprint()``, and there is no second, strong checksum per block. Blocks whose fingerprints collide are copied
+as if equal, which the fingerprint of the updated content cannot detect, as it is composed of the same block fingerprints. Like
+rsync's whole file checksum, a SHA-256 digest of the updated content therefore verifies the result independently, falling back
+to sending the complete content on mismatch.
+"""
+import hashlib
+import math
+import sys
+from jep_py.config import DELTA_BLOCK_SIZE
+from jep_py.rope import FINGERPRINT_MODULUS, fingerprint
+from jep_py.schema import ContentSync, ContentDelta, DeltaSegment
+
+#: Encoding of texts to native unsigned integers per code point.
+_CODEPOINT_ENCODING = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+
+def content_digest(chunks):
+    """Returns SHA-256 digest of the UTF-8 encoded text given as chunks, as hexadecimal string."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def block_size(length):
+    """Returns block size for checksums of a text of given length, growing with its square root to bound the number of blocks."""
+    return max(DELTA_BLOCK_SIZE, int(math.sqrt(length)))
+
+
+def block_checksums(text, size):
+    """Returns fingerprints of the complete blocks of given size of text."""
+    return [fingerprint(text[start:start + size]) for start in range(0, len(text) - size + 1, size)]
+
+
+def delta(text, size, checksums):
+    """Returns text as list of (data, block, count) segments, literal data followed by count blocks of the stale copy starting at
+    given block index, matched by the given block checksums."""
+    block_by_checksum = {}
+    for index, checksum in enumerate(checksums):
+        block_by_checksum.setdefault(checksum, index)
+
+    # weight of code point leaving the window:
+    weight = pow(2, 32 * (size - 1), FINGERPRINT_MODULUS)
+    values = memoryview(text.encode(_CODEPOINT_ENCODING, 'surrogatepass')).cast('I')
+    length = len(text)
+    segments = []
+    literal_start = pos = 0
+    checksum = None
+    while pos + size <= length:
+        if checksum is None:
+            checksum = fingerprint(text[pos:pos + size])
+
+        block = block_by_checksum.get(checksum)
+        if block is not None and segments and literal_start == pos:
+            # prefer block continuing the current run over an equal one elsewhere:
+            following = segments[-1][1] + segments[-1][2]
+            if following < len(checksums) and checksums[following] == checksum:
+                block = following
+
+        if block is not None:
+            if segments and literal_start == pos and segments[-1][1] + segments[-1][2] == block:
+                # continue run of consecutive blocks:
+                segments[-1][2] += 1
+            else:
+                segments.append([text[literal_start:pos], block, 1])
+            pos += size
+            literal_start = pos
+            checksum = None
+            continue
+
+        if pos + size < length:
+            # roll window by one character:
+            checksum = (checksum - values[pos] * weight) % FINGERPRINT_MODULUS
+            checksum = ((checksum << 32) + values[pos + size]) % FINGERPRINT_MODULUS
+        pos += 1
+
+    if literal_start < length or not segments:
+        segments.append([text[literal_start:], 0, 0])
+    return [tuple(segment) for segment in segments]
+
+
+def resync_message(filepath, text, out_of_sync):
+    """Returns message to resynchronize the peer's content of a file after it sent the given OutOfSync message.
+
+    This is a content delta if the peer sent checksums of its stale copy with valid block size, otherwise the complete content.
+    """
+    size, checksums = out_of_sync.blockSize, out_of_sync.blocks
+    if not isinstance(size, int) or size <= 0 or not isinstance(checksums, (list, tuple)) or not checksums:
+        return ContentSync(filepath, text)
+
+    segments = delta(text, size, checksums)
+    return ContentDelta(filepath, size, [DeltaSegment(*segment) for segment in segments], fingerprint(text),
+                        content_digest((text,)))
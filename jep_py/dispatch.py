@@ -0,0 +1,99 @@
+"""Dispatch of received messages to listeners."""
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ListenerList(list):
+    """List of listeners counting its modifications, so tables computed for it are found outdated without comparing it."""
+
+    #: Number of modifications of the list.
+    version = 0
+
+
+def _counting(name):
+    """Returns list method of given name that counts the modification of the list."""
+    method = getattr(list, name)
+
+    def modify(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    modify.__name__ = name
+    return modify
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse', '__setitem__', '__delitem__', '__iadd__',
+              '__imul__'):
+    setattr(ListenerList, _name, _counting(_name))
+
+
+class Dispatcher:
+    """Calls listener handlers for received messages, only considering handlers that are actually implemented.
+
+    For each message class the listeners to be called are computed once: general listeners that override the message's handler
+    of the listener API class, followed by listeners subscribed to that message type. The table is recomputed whenever the list
+    of general listeners or the subscriptions change. Changes of a ListenerList are detected by its version, other lists are
+    compared with the copy the table was computed for.
+    """
+
+    def __init__(self, api_class):
+        #: Listener API class, whose handlers are treated as not implemented.
+        self.api_class = api_class
+        #: Listeners subscribed to selected message types only, as (listener, message types).
+        self.subscriptions = []
+        #: Listeners to call by message class.
+        self._table = {}
+        #: General listeners the table was computed for, copied unless a ListenerList.
+        self._listeners = None
+        #: Version of the ListenerList the table was computed for.
+        self._version = None
+
+    def subscribe(self, listener, *message_types):
+        """Calls listener for messages of given types, regardless of which handlers it implements."""
+        self.subscriptions.append((listener, message_types))
+        self._table.clear()
+
+    def unsubscribe(self, listener):
+        self.subscriptions = [(l, message_types) for l, message_types in self.subscriptions if l is not listener]
+        self._table.clear()
+
+    def dispatch(self, message, context, listeners):
+        """Passes message to the relevant general listeners in given list and to subscribed listeners."""
+        if listeners is not self._listeners or listeners.version != self._version:
+            self._outdated(listeners)
+
+        cls = message.__class__
+        targets = self._table.get(cls)
+        if targets is None:
+            targets = self._table[cls] = self._targets(cls)
+
+        for listener in targets:
+            # call listener's message specific handler method (visitor pattern's accept() call):
+            message.invoke(listener, context)
+
+    def _outdated(self, listeners):
+        """Clears the table if it was computed for other listeners than given."""
+        if isinstance(listeners, ListenerList):
+            self._table.clear()
+            self._listeners = listeners
+            self._version = listeners.version
+        elif self._listeners != listeners:
+            self._table.clear()
+            self._listeners = list(listeners)
+            self._version = None
+
+    def _targets(self, cls):
+        """Listeners to be called for messages of given class."""
+        name = cls.handler_name()
+        stub = getattr(self.api_class, name, None)
+
+        targets = [listener for listener in self._listeners if self._implements(listener, name, stub)]
+        targets.extend(listener for listener, message_types in self.subscriptions if issubclass(cls, message_types))
+        _logger.debug('Dispatching %s to %d listener(s).' % (cls.__name__, len(targets)))
+        return targets
+
+    @classmethod
+    def _implements(cls, listener, name, stub):
+        handler = getattr(listener, name, None)
+        return handler is not None and getattr(handler, '__func__', handler) is not stub
@@ -0,0 +1,111 @@
+"""Length prefixed framing of encoded messages.
+
+A frame starts with the marker byte ``0xc1``, which is never used in msgpack or JSON data, followed by the payload length as
+unsigned LEB128 varint and the payload itself. Receivers can therefore tell framed from bare messages by their first byte, know
+whether a frame is complete without decoding it, and skip messages by their type name without decoding their fields. An empty
+frame carries no message and is used to announce framing to the peer.
+"""
+from jep_py.unpacker import NEED_DATA, _UINT16, _UINT32
+
+#: First byte of each frame.
+FRAME_MARKER = 0xc1
+
+#: Frame without payload.
+EMPTY_FRAME = bytes((FRAME_MARKER, 0))
+
+#: Maximal number of bytes of the length prefix.
+MAX_LENGTH_BYTES = 10
+
+
+class FrameError(ValueError):
+    """Raised if a frame header is corrupt."""
+
+
+def frame_header(length):
+    """Returns header of frame with payload of given length."""
+    header = bytearray((FRAME_MARKER,))
+    while length >= 0x80:
+        header.append(length & 0x7f | 0x80)
+        length >>= 7
+    header.append(length)
+    return bytes(header)
+
+
+def read_frame(buffer, max_length=None):
+    """Returns payload of the frame at the read position of given receive buffer and consumes it, or NEED_DATA if incomplete.
+
+    Frames announcing a payload longer than the optional maximal length are rejected before any data is buffered for them. The
+    buffer is not grown ahead for the announced length, but only as the payload arrives.
+    """
+    data = buffer.data
+    end = buffer.write_pos
+    pos = buffer.read_pos + 1
+    length = 0
+    shift = 0
+    while True:
+        if pos >= end:
+            return NEED_DATA
+        b = data[pos]
+        pos += 1
+        length |= (b & 0x7f) << shift
+        if not b & 0x80:
+            break
+        shift += 7
+        if shift >= 7 * MAX_LENGTH_BYTES:
+            raise FrameError('Frame length prefix exceeds %d bytes.' % MAX_LENGTH_BYTES)
+
+    if max_length is not None and length > max_length:
+        raise FrameError('Frame length %d exceeds limit of %d bytes.' % (length, max_length))
+    if pos + length > end:
+        return NEED_DATA
+
+    with memoryview(data) as view:
+        payload = bytes(view[pos:pos + length])
+    buffer.consume(pos + length - buffer.read_pos)
+    return payload
+
+
+def peek_message_name(data, name_key):
+    """Returns the message type name of a msgpack encoded message if it is the map's first item, otherwise None."""
+    if not data:
+        return None
+
+    b = data[0]
+    if 0x80 <= b <= 0x8f:
+        pos = 1
+    elif b == 0xde:
+        pos = 3
+    elif b == 0xdf:
+        pos = 5
+    else:
+        return None
+
+    key, pos = _read_str(data, pos)
+    if key != name_key:
+        return None
+    return _read_str(data, pos)[0]
+
+
+def _read_str(data, pos):
+    """Returns msgpack encoded string at given position and the position behind it, or None if there is no valid one."""
+    if pos >= len(data):
+        return None, pos
+
+    b = data[pos]
+    if 0xa0 <= b <= 0xbf:
+        start, length = pos + 1, b & 0x1f
+    elif b == 0xd9 and pos + 1 < len(data):
+        start, length = pos + 2, data[pos + 1]
+    elif b == 0xda and pos + 3 <= len(data):
+        start, length = pos + 3, _UINT16.unpack_from(data, pos + 1)[0]
+    elif b == 0xdb and pos + 5 <= len(data):
+        start, length = pos + 5, _UINT32.unpack_from(data, pos + 1)[0]
+    else:
+        return None, pos
+
+    if start + length > len(data):
+        return None, pos
+    try:
+        return str(data[start:start + length], 'utf-8'), start + length
+    except UnicodeDecodeError:
+        return None, pos
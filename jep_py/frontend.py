@@ -12,15 +12,18 @@ import datetime
 import os
 import uuid
 from jep_py.async import AsynchronousFileReader
-from jep_py.config import ServiceConfigProvider, BUFFER_LENGTH, TIMEOUT_LAST_MESSAGE
-from jep_py.protocol import MessageSerializer
+from jep_py.buffer import SendQueue
+from jep_py.config import ServiceConfigProvider, TIMEOUT_LAST_MESSAGE, SEND_BATCH_WINDOW
+from jep_py.dispatch import Dispatcher, ListenerList
+from jep_py.framing import EMPTY_FRAME
+from jep_py.protocol import MessageSerializer, FrozenMessage
 from jep_py.schema import Shutdown, TOKEN_ATTR_NAME
 from jep_py.syntax import SyntaxFileSet
 
 _logger = logging.getLogger(__name__)
 
-#: Regex to find backend port announcement from backend.
-PATTERN_PORT_ANNOUNCEMENT = re.compile(r'JEP service, listening on port (?P<port>\d+)')
+#: Regex to find backend port announcement from backend, optionally followed by the protocol extensions it supports.
+PATTERN_PORT_ANNOUNCEMENT = re.compile(r'JEP service, listening on port (?P<port>\d+)(?: \(features: (?P<features>[\w, ]*)\))?')
 
 #: Timeout to wait for backend startup.
 TIMEOUT_BACKEND_STARTUP = datetime.timedelta(seconds=5)
@@ -28,6 +31,9 @@ TIMEOUT_BACKEND_STARTUP = datetime.timedelta(seconds=5)
 #: Timeout to wait for backend shutdown.
 TIMEOUT_BACKEND_SHUTDOWN = datetime.timedelta(seconds=5)
 
+#: Shutdown message, encoded once for all connections.
+SHUTDOWN = FrozenMessage(Shutdown())
+
 
 class BackendListener:
     """API to listen to messages from backend, communicated by frontend."""
@@ -58,10 +64,25 @@ class Frontend(BackendListener):
     """Top level frontend class, once to be instantiated per editor plugin."""
 
     def __init__(self, listeners=None, *, service_config_provider=None, provide_backend_connection=None):
-        self.listeners = listeners or []
+        self.listeners = listeners if listeners is not None else ListenerList()
         self.service_config_provider = service_config_provider or ServiceConfigProvider()
         self.provide_backend_connection = provide_backend_connection or BackendConnection
         self.connection_by_service_selector = collections.defaultdict(lambda: None)
+        #: Listeners registered for selected message types only, as (listener, message types).
+        self.subscriptions = []
+
+    def subscribe(self, listener, *message_types):
+        """Registers listener for messages of given types only, received by current and future connections."""
+        self.subscriptions.append((listener, message_types))
+        for connection in self.connection_by_service_selector.values():
+            if connection:
+                connection.subscribe(listener, *message_types)
+
+    def unsubscribe(self, listener):
+        self.subscriptions = [(l, message_types) for l, message_types in self.subscriptions if l is not listener]
+        for connection in self.connection_by_service_selector.values():
+            if connection:
+                connection.unsubscribe(listener)
 
     def get_connection(self, filename):
         """Returns connection to a backend service that can deal with the given file. Existing service connections are reused if possible."""
@@ -96,6 +117,8 @@ class Frontend(BackendListener):
     def _connect(self, service_config):
         """Connect to service described in configuration."""
         connection = self.provide_backend_connection(self, service_config, self.listeners)
+        for listener, message_types in self.subscriptions:
+            connection.subscribe(listener, *message_types)
         self.connection_by_service_selector[service_config.selector] = connection
         connection.connect()
         return connection
@@ -113,10 +136,11 @@ class State(enum.Enum):
 class BackendConnection():
     """Connection to a single backend service."""
 
-    def __init__(self, frontend, service_config, listeners, *, serializer=None, provide_async_reader=None):
+    def __init__(self, frontend, service_config, listeners, *, serializer=None, provide_async_reader=None, send_batch_window=None):
         self.frontend = frontend
         self.service_config = service_config
         self.listeners = listeners
+        self._dispatcher = Dispatcher(BackendListener)
         self._state = State.Disconnected
         self._serializer = serializer or MessageSerializer()
         self._provide_async_reader = provide_async_reader or AsynchronousFileReader
@@ -136,6 +160,12 @@ class BackendConnection():
         self._current_request_token = None
         #: Message received as response to pending request.
         self._current_request_response = None
+        #: Outbound data waiting to be sent.
+        self._send_queue = SendQueue()
+        #: Protocol extensions announced by backend.
+        self._backend_features = ()
+        #: Maximal period outbound messages are held back to be sent together.
+        self.send_batch_window = send_batch_window if send_batch_window is not None else SEND_BATCH_WINDOW
 
     @property
     def state(self):
@@ -190,7 +220,8 @@ class BackendConnection():
     def disconnect(self):
         """Closes connection to backend service."""
         self._reconnect_expected = False
-        self.send_message(Shutdown())
+        self.send_message(SHUTDOWN)
+        self.flush()
         self._state_timer_reset = datetime.datetime.now()
         self.state = State.Disconnecting
 
@@ -225,12 +256,40 @@ class BackendConnection():
                 _logger.debug('Sending message %s.' % message)
                 data = self._serializer.serialize(message)
                 _logger.debug('Sending data %s.' % data)
-                self._socket.send(data)
+                self._send_queue.append(data, datetime.datetime.now())
             except Exception as e:
                 _logger.warning('Sending message failed: %s' % e)
+            else:
+                if self._send_due():
+                    self.flush()
         else:
             _logger.warning('In state %s no messages are sent to backend, but received request to send %s.' % (self.state, message))
 
+    def flush(self):
+        """Sends queued messages immediately instead of waiting for the batch window to expire."""
+        if not self._send_queue:
+            return
+        count = len(self._send_queue)
+        try:
+            sent = self._send_queue.flush(self._socket)
+            _logger.debug('Sent %d of %d queued bytes.' % (sent, count))
+        except Exception as e:
+            _logger.warning('Sending data failed, dropping %d bytes: %s' % (count, e))
+            self._send_queue.clear()
+
+    def _send_due(self):
+        """Is the oldest queued message held back for the full batch window already?"""
+        if not self._send_queue:
+            return False
+        return not self.send_batch_window or datetime.datetime.now() - self._send_queue.ts_oldest >= self.send_batch_window
+
+    def subscribe(self, listener, *message_types):
+        """Registers listener for messages of given types only."""
+        self._dispatcher.subscribe(listener, *message_types)
+
+    def unsubscribe(self, listener):
+        self._dispatcher.unsubscribe(listener)
+
     def request_message(self, message, duration):
         """Sends a request message and waits synchronously for the response from backend.
 
@@ -282,7 +341,7 @@ class BackendConnection():
         # check for backend's port announcement:
         lines = []
         self._read_backend_output(lines)
-        port = self._parse_port_announcement(lines)
+        port, self._backend_features = self._parse_port_announcement(lines)
 
         if not port:
             if datetime.datetime.now() - self._state_timer_reset > TIMEOUT_BACKEND_STARTUP:
@@ -295,10 +354,17 @@ class BackendConnection():
     def _run_connected(self, duration):
         self._read_backend_output()
 
+        if self._send_queue and self.send_batch_window:
+            # wake up in time to send batched messages:
+            duration = min(duration, max(datetime.timedelta(0), self._send_queue.ts_oldest + self.send_batch_window - datetime.datetime.now()))
+
         readable, *_ = select.select([self._socket], [], [], duration.total_seconds())
         if readable:
             self._receive()
 
+        if self._socket and self._send_due():
+            self.flush()
+
         if datetime.datetime.now() - self._state_timer_reset > TIMEOUT_LAST_MESSAGE:
             _logger.debug('Backend did not sent any message for %.2f seconds, reconnecting.' % TIMEOUT_LAST_MESSAGE.total_seconds())
             self.reconnect()
@@ -327,6 +393,12 @@ class BackendConnection():
                 _logger.info('Connected to backend command %s' % self.service_config.command)
                 self.state = State.Connected
 
+                self._serializer.use_features(self._backend_features)
+                if 'framed' in self._backend_features:
+                    # let backend know it may use protocol extensions as well:
+                    self._send_queue.append(EMPTY_FRAME, datetime.datetime.now())
+                    self.flush()
+
                 # from now on, only the user can stop this connection for good:
                 self._reconnect_expected = True
             else:
@@ -342,15 +414,13 @@ class BackendConnection():
         cycles = 0
         try:
             while True:
-                data = self._socket.recv(BUFFER_LENGTH)
+                count = self._serializer.buffer.recv_into(self._socket)
                 cycles += 1
 
-                if data:
+                if count:
                     # any received message resets the timeout:
                     self._state_timer_reset = datetime.datetime.now()
-
-                    _logger.debug('Received data: %s' % data)
-                    self._serializer.enque_data(data)
+                    _logger.debug('Received %d bytes.' % count)
                 else:
                     _logger.debug('Socket closed by backend.')
                     raise ConnectionResetError()
@@ -369,9 +439,8 @@ class BackendConnection():
             # first allow processing of global messages by frontend:
             msg.invoke(self.frontend, self)
 
-            # call listeners' message specific handler methods (visitor pattern's accept() call):
-            for listener in self.listeners:
-                msg.invoke(listener, self)
+            # call listeners' message specific handler methods:
+            self._dispatcher.dispatch(msg, self, self.listeners)
 
             # handle response messages:
             if self._current_request_token is not None:
@@ -391,6 +460,7 @@ class BackendConnection():
         if self._socket:
             self._socket.close()
             self._socket = None
+        self._send_queue.clear()
 
         # kill process if still running (graceful shutdown tried elsewhere):
         if self._process:
@@ -417,14 +487,18 @@ class BackendConnection():
 
     @classmethod
     def _parse_port_announcement(cls, lines):
+        """Returns port and supported protocol extensions announced by backend."""
         port = None
+        features = ()
         for line in lines:
             m = PATTERN_PORT_ANNOUNCEMENT.search(line)
             if m:
                 port = int(m.group('port'))
-                _logger.debug('Backend announced listening at port %d.' % port)
+                if m.group('features'):
+                    features = tuple(feature.strip() for feature in m.group('features').split(','))
+                _logger.debug('Backend announced listening at port %d with features %s.' % (port, features))
                 break
-        return port
+        return port, features
 
     def _read_backend_output(self, result_lines=None):
         if self._process_output_reader:
@@ -0,0 +1,284 @@
+"""Direct msgpack encoding of serializable objects.
+
+Objects are written into a single output buffer while walking their attributes, without building an intermediate tree of
+built-in dictionaries first. Which attributes to write, their encoded keys and defaults to elide are planned once per class.
+In compact form, nested objects are written as arrays of attribute values, enum members as ordinals and text payloads as binary
+data, see ``serializer``.
+"""
+import enum
+import inspect
+import struct
+import umsgpack
+from jep_py.serializer import Serializable, Columns, TextPayload, compact_values, enum_ordinal
+
+_UINT16 = struct.Struct('>BH')
+_UINT32 = struct.Struct('>BI')
+_UINT64 = struct.Struct('>BQ')
+_INT8 = struct.Struct('>Bb')
+_INT16 = struct.Struct('>Bh')
+_INT32 = struct.Struct('>Bi')
+_INT64 = struct.Struct('>Bq')
+_FLOAT64 = struct.Struct('>Bd')
+
+#: Marker for attributes not set on an instance.
+_MISSING = object()
+
+
+class FieldPlan:
+    """Precomputed encoding information of a single serialized attribute."""
+
+    def __init__(self, name, default):
+        self.name = name
+        #: Values equal to the default are elided, attributes without default are always written.
+        self.has_default = default is not inspect._empty
+        self.default = default
+        #: Map key in packed form.
+        self.key = packb(name)
+
+
+#: Field plans by serializable class.
+_plans = {}
+
+
+def field_plan(cls):
+    """Returns the list of field plans of given serializable class, computed on first use."""
+    plan = _plans.get(cls)
+    if plan is None:
+        plan = _plans[cls] = [FieldPlan(attrib.name, attrib.default) for attrib in cls.serialized_attribs.values()]
+    return plan
+
+
+def pack_message(message, name_key, name, compact=False):
+    """Packs message object to map holding its fields and its type name under the given key, with field values optionally
+    packed in compact form."""
+    out = bytearray()
+    pack_serializable(out, message, ((name_key, name),), pack_compact if compact else pack)
+    return bytes(out)
+
+
+def packb(obj):
+    """Packs arbitrary object to msgpack bytes."""
+    out = bytearray()
+    pack(out, obj)
+    return bytes(out)
+
+
+def pack(out, obj):
+    """Appends packed object to output buffer."""
+    packer = _PACKERS.get(obj.__class__)
+    if packer:
+        packer(out, obj)
+    elif isinstance(obj, Serializable):
+        pack_serializable(out, obj)
+    elif isinstance(obj, TextPayload):
+        # already encoded, only the header is written:
+        pack_str_header(out, len(obj.data))
+        out += obj.data
+    elif isinstance(obj, Columns):
+        pack_array_header(out, len(obj))
+        for item in obj:
+            pack_serializable(out, item)
+    elif isinstance(obj, enum.Enum):
+        pack_str(out, obj.name)
+    elif isinstance(obj, (list, tuple)):
+        pack_array(out, obj)
+    elif isinstance(obj, dict):
+        pack_map(out, obj)
+    elif isinstance(obj, str):
+        pack_str(out, obj)
+    elif isinstance(obj, int):
+        pack_int(out, obj)
+    elif hasattr(obj, '__dict__'):
+        pack_map(out, obj.__dict__)
+    else:
+        raise TypeError('Cannot pack object "%s" of type %s.' % (obj, type(obj).__name__))
+
+
+def pack_compact(out, obj):
+    """Appends packed object to output buffer, with serializable objects and enum members in compact form."""
+    if isinstance(obj, Serializable):
+        values = compact_values(obj)
+        pack_array_header(out, len(values))
+        for value in values:
+            pack_compact(out, value)
+    elif isinstance(obj, Columns):
+        pack_map(out, obj.to_builtins(compact=True))
+    elif isinstance(obj, TextPayload):
+        pack_bin(out, obj.data)
+    elif isinstance(obj, enum.Enum):
+        pack_int(out, enum_ordinal(obj))
+    elif isinstance(obj, (list, tuple)):
+        pack_array_header(out, len(obj))
+        for item in obj:
+            pack_compact(out, item)
+    elif isinstance(obj, dict):
+        pack_map_header(out, len(obj))
+        for key, value in obj.items():
+            pack(out, key)
+            pack_compact(out, value)
+    else:
+        pack(out, obj)
+
+
+def serialized_fields(obj):
+    """Returns list of (field plan, value) of all attributes of serializable object that differ from their defaults."""
+    fields = []
+    for field in field_plan(obj.__class__):
+        value = getattr(obj, field.name, _MISSING)
+        if value is _MISSING or (field.has_default and field.default == value):
+            continue
+        fields.append((field, value))
+    return fields
+
+
+def pack_serializable(out, obj, extra=(), pack_value=None):
+    """Appends map of serialized attributes that differ from their defaults, preceded by optional extra key/value pairs."""
+    fields = serialized_fields(obj)
+    pack_value = pack_value or pack
+
+    pack_map_header(out, len(fields) + len(extra))
+    for key, value in extra:
+        pack_str(out, key)
+        pack_value(out, value)
+    for field, value in fields:
+        out += field.key
+        pack_value(out, value)
+
+
+def pack_nil(out, obj):
+    out.append(0xc0)
+
+
+def pack_bool(out, obj):
+    out.append(0xc3 if obj else 0xc2)
+
+
+def pack_int(out, obj):
+    if 0 <= obj < 0x80:
+        out.append(obj)
+    elif -0x20 <= obj < 0:
+        out.append(obj & 0xff)
+    elif obj >= 0:
+        if obj <= 0xff:
+            out += bytes((0xcc, obj))
+        elif obj <= 0xffff:
+            out += _UINT16.pack(0xcd, obj)
+        elif obj <= 0xffffffff:
+            out += _UINT32.pack(0xce, obj)
+        elif obj <= 0xffffffffffffffff:
+            out += _UINT64.pack(0xcf, obj)
+        else:
+            raise OverflowError('Integer %d too large to be packed.' % obj)
+    elif obj >= -0x80:
+        out += _INT8.pack(0xd0, obj)
+    elif obj >= -0x8000:
+        out += _INT16.pack(0xd1, obj)
+    elif obj >= -0x80000000:
+        out += _INT32.pack(0xd2, obj)
+    elif obj >= -0x8000000000000000:
+        out += _INT64.pack(0xd3, obj)
+    else:
+        raise OverflowError('Integer %d too small to be packed.' % obj)
+
+
+def pack_float(out, obj):
+    out += _FLOAT64.pack(0xcb, obj)
+
+
+def pack_str(out, obj):
+    data = obj.encode('utf-8')
+    n = len(data)
+    if n < 0x20:
+        out.append(0xa0 | n)
+    elif n <= 0xff:
+        out += bytes((0xd9, n))
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xda, n)
+    else:
+        out += _UINT32.pack(0xdb, n)
+    out += data
+
+
+def pack_str_header(out, n):
+    if n < 0x20:
+        out.append(0xa0 | n)
+    elif n <= 0xff:
+        out += bytes((0xd9, n))
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xda, n)
+    else:
+        out += _UINT32.pack(0xdb, n)
+
+
+def pack_bin(out, obj):
+    n = len(obj)
+    if n <= 0xff:
+        out += bytes((0xc4, n))
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xc5, n)
+    else:
+        out += _UINT32.pack(0xc6, n)
+    out += obj
+
+
+def pack_ext(out, obj):
+    n = len(obj.data)
+    code = obj.type & 0xff
+    if n in (1, 2, 4, 8, 16):
+        out += bytes(({1: 0xd4, 2: 0xd5, 4: 0xd6, 8: 0xd7, 16: 0xd8}[n], code))
+    elif n <= 0xff:
+        out += bytes((0xc7, n, code))
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xc8, n)
+        out.append(code)
+    else:
+        out += _UINT32.pack(0xc9, n)
+        out.append(code)
+    out += obj.data
+
+
+def pack_array_header(out, n):
+    if n < 0x10:
+        out.append(0x90 | n)
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xdc, n)
+    else:
+        out += _UINT32.pack(0xdd, n)
+
+
+def pack_array(out, obj):
+    pack_array_header(out, len(obj))
+    for item in obj:
+        pack(out, item)
+
+
+def pack_map_header(out, n):
+    if n < 0x10:
+        out.append(0x80 | n)
+    elif n <= 0xffff:
+        out += _UINT16.pack(0xde, n)
+    else:
+        out += _UINT32.pack(0xdf, n)
+
+
+def pack_map(out, obj):
+    pack_map_header(out, len(obj))
+    for key, value in obj.items():
+        pack(out, key)
+        pack(out, value)
+
+
+#: Packer functions by exact type of object.
+_PACKERS = {
+    type(None): pack_nil,
+    bool: pack_bool,
+    int: pack_int,
+    float: pack_float,
+    str: pack_str,
+    bytes: pack_bin,
+    bytearray: pack_bin,
+    list: pack_array,
+    tuple: pack_array,
+    dict: pack_map,
+    umsgpack.Ext: pack_ext,
+}
@@ -1,26 +1,238 @@
 import umsgpack
 
+import collections
+import enum
 import io
 import logging
-from jep_py.schema import Message
-from jep_py.serializer import serialize_to_builtins, deserialize_from_builtins
+import time
+import zlib
+from jep_py.buffer import ReceiveBuffer
+from jep_py.codec import get_codec
+from jep_py.config import COMPRESSION_LEVEL, COMPRESSION_THRESHOLD, MAX_BUFFERED_BYTES
+from jep_py.framing import FRAME_MARKER, frame_header, read_frame, peek_message_name
+from jep_py.packer import pack_ext
+from jep_py.schema import Message, Shutdown, BackendAlive, StaticSyntaxList
+from jep_py.serializer import Serializable, Columns, TextPayload, serialize_to_builtins, deserialize_from_builtins
+from jep_py.unpacker import NEED_DATA
 
 _logger = logging.getLogger(__name__)
 
 MESSAGE_KEY = '_message'
 
+#: Protocol extensions supported by this implementation, announced by the backend at startup.
+FEATURES = ('framed', 'compressed', 'compact')
+
+#: Message types whose encoded form is kept in an encoded message cache by default. Messages carrying request tokens or content
+#: checksums are left out, as they rarely repeat and comparing them costs more than encoding them.
+CACHED_MESSAGE_TYPES = (Shutdown, BackendAlive, StaticSyntaxList)
+
+#: Default number of encoded messages kept in cache.
+MESSAGE_CACHE_SIZE = 64
+
+#: Msgpack extension type code of zlib compressed messages.
+COMPRESSED_EXT_TYPE = 1
+
+
+class CompressionStats:
+    """Statistics of message compression of a single connection, to weigh bytes saved against CPU time spent."""
+
+    def __init__(self):
+        #: Number of sent messages that were compressed.
+        self.messages_compressed = 0
+        #: Number of received messages that were decompressed.
+        self.messages_decompressed = 0
+        #: Bytes not transmitted thanks to compression, in both directions.
+        self.bytes_saved = 0
+        #: Seconds spent compressing, including attempts that did not reduce the size.
+        self.compress_time = 0.0
+        #: Seconds spent decompressing.
+        self.decompress_time = 0.0
+
+    @property
+    def cpu_time(self):
+        return self.compress_time + self.decompress_time
+
+    def __str__(self):
+        return '%d bytes saved in %d sent and %d received messages, %.3f ms CPU time' % (
+            self.bytes_saved, self.messages_compressed, self.messages_decompressed, self.cpu_time * 1000)
+
+
+class FrozenMessage:
+    """Message that is never modified, so its encoded form is computed only once per wire encoding and then reused."""
+
+    __slots__ = ('message', '_encoded')
+
+    def __init__(self, message):
+        self.message = message
+        #: Encoded message by wire encoding.
+        self._encoded = {}
+
+    def __repr__(self):
+        return 'FrozenMessage(%r)' % self.message
+
+    def encoded(self, serializer):
+        """Returns message encoded by given serializer."""
+        encoding = serializer.encoding
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = serializer.encode(self.message)
+        return data
+
+
+class EncodedMessageCache:
+    """Least recently used cache of encoded messages, keyed by wire encoding and message content.
+
+    A single cache can be shared by the serializers of several connections, so identical messages sent to several peers are
+    encoded only once.
+    """
+
+    def __init__(self, size=MESSAGE_CACHE_SIZE, message_types=CACHED_MESSAGE_TYPES):
+        #: Maximal number of cached messages.
+        self.size = size
+        #: Message types to be cached, other messages are always encoded.
+        self.message_types = message_types
+        #: Number of cache hits.
+        self.hits = 0
+        #: Number of cache misses.
+        self.misses = 0
+        self._encoded = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._encoded)
+
+    def accepts(self, message):
+        return isinstance(message, self.message_types)
+
+    def encoded(self, serializer, message):
+        """Returns message encoded by given serializer, from cache if an equal message was encoded before."""
+        key = (serializer.encoding, content_key(message))
+        data = self._encoded.get(key)
+        if data is not None:
+            self.hits += 1
+            self._encoded.move_to_end(key)
+            return data
+
+        self.misses += 1
+        data = self._encoded[key] = serializer.encode(message)
+        if len(self._encoded) > self.size:
+            self._encoded.popitem(last=False)
+        return data
+
+    def clear(self):
+        self._encoded.clear()
+
+
+def content_key(obj):
+    """Hashable representation of serializable object, equal for objects with equal encoded form."""
+    if isinstance(obj, Serializable):
+        return (obj.__class__,) + tuple(content_key(getattr(obj, name, None)) for name in obj.serialized_attribs)
+    if isinstance(obj, Columns):
+        # encoded differently from lists in compact form:
+        return (obj.__class__,) + tuple(content_key(column) for column in obj.columns.values())
+    if isinstance(obj, TextPayload):
+        return TextPayload, bytes(obj.data)
+    if isinstance(obj, (list, tuple)):
+        return (list,) + tuple(content_key(item) for item in obj)
+    if isinstance(obj, dict):
+        return (dict,) + tuple((content_key(key), content_key(value)) for key, value in obj.items())
+    if isinstance(obj, (bool, float)):
+        # keep apart from equal integers, which are encoded differently:
+        return obj.__class__, obj
+    if obj is None or isinstance(obj, (str, int, bytes, enum.Enum)):
+        return obj
+    raise TypeError('Cannot derive content key of object "%s" of type %s.' % (obj, type(obj).__name__))
+
+
+def _packed_ext_size(n):
+    """Size of packed extension type with data of given size."""
+    if n in (1, 2, 4, 8, 16):
+        return n + 2
+    return n + (3 if n <= 0xff else 4 if n <= 0xffff else 6)
+
 
 class MessageSerializer:
     """Serialization of JEP message objects."""
 
-    def __init__(self, packer=None):
-        #: Optional packer/formatter like json or msgpack, exposing typical load/dump interface.
-        self.packer = packer or umsgpack
-        #: Buffer holding chunked data (mutable).
-        self.buffer = bytearray()
+    def __init__(self, packer=None, *, codec=None, cache=None, compress_threshold=None, lazy=False, max_buffered=MAX_BUFFERED_BYTES):
+        if isinstance(codec, str):
+            codec = get_codec(codec)
+        elif codec is None and (packer is None or packer is umsgpack):
+            codec = get_codec('umsgpack' if packer else None)
+
+        #: Codec encoding messages and decoding the data stream.
+        self.codec = codec
+        #: Optional packer/formatter exposing typical load/dump interface, used instead of a codec.
+        self.packer = packer if codec is None else None
+        #: Buffer holding chunked data, sockets may receive directly into it.
+        self.buffer = ReceiveBuffer()
+        #: Incremental decoder keeping its position across chunks, only available with codec.
+        self.unpacker = codec.unpacker(self.buffer) if codec else None
+        #: Optional cache of encoded messages, only used with codec.
+        self.cache = cache if codec else None
+
+        if compress_threshold is not None and not (codec and codec.supports_ext):
+            raise ValueError('Message compression requires a msgpack codec.')
+        #: Minimal size of encoded messages to be sent compressed, None to disable compression. Compressed messages received
+        #: are always decoded, but peers not supporting them cannot decode them, so compression must be enabled explicitly.
+        self.compress_threshold = compress_threshold
+        #: Compression statistics of this serializer's connection.
+        self.stats = CompressionStats()
+        #: Send messages in length prefixed frames? Framed and bare messages are always accepted on input.
+        self.framed = False
+        #: Send nested objects as arrays of attribute values and enum members as ordinals? Both forms are accepted on input.
+        self.compact = False
+        #: Did the peer send framed messages, so it supports the protocol extensions?
+        self.peer_framed = False
+        #: Number of received messages of unknown type that were skipped without decoding them.
+        self.messages_skipped = 0
+        #: Number of received objects that could not be decoded to messages and were dropped.
+        self.messages_dropped = 0
+        #: Number of received bytes discarded because they were corrupt or exceeded the buffer limit.
+        self.bytes_discarded = 0
+        #: Were bytes discarded since the last message was decoded, so objects dropped may be rests of a discarded one?
+        self._resynchronizing = False
+        #: Maximal number of bytes buffered while waiting for a message to complete, including copies held by the unpacker.
+        self.max_buffered = max_buffered
+        #: Decode message type only and convert message attributes when they are first accessed?
+        self.lazy = lazy
+
+    def use_features(self, features):
+        """Enables protocol extensions for output that the peer supports."""
+        if not self.codec:
+            return
+        self.framed = 'framed' in features
+        self.compact = 'compact' in features
+        if 'compressed' not in features or not self.codec.supports_ext:
+            self.compress_threshold = None
+        elif self.compress_threshold is None:
+            self.compress_threshold = COMPRESSION_THRESHOLD
+
+    @property
+    def encoding(self):
+        """Identifier of the wire encoding produced by this serializer, messages with equal encoding are encoded identically."""
+        if not self.codec:
+            return None
+        return self.codec.name, self.compress_threshold, self.framed, self.compact
 
     def serialize(self, message):
-        """Serialize object to builtins and then optionally apply packer."""
+        """Serialize message, reusing the encoded form of frozen messages and of messages found in cache."""
+
+        if isinstance(message, FrozenMessage):
+            return message.encoded(self)
+        if self.cache is not None and self.cache.accepts(message):
+            return self.cache.encoded(self, message)
+        return self.encode(message)
+
+    def encode(self, message):
+        """Serialize object with codec or to builtins and then optionally apply packer."""
+
+        if self.codec:
+            data = self.codec.encode_message(message, MESSAGE_KEY, type(message).__name__, self.compact)
+            if self.compress_threshold is not None and len(data) >= self.compress_threshold:
+                data = self._compress(data)
+            if self.framed:
+                data = frame_header(len(data)) + data
+            return data
 
         serialized = serialize_to_builtins(message)
         serialized[MESSAGE_KEY] = type(message).__name__
@@ -31,7 +243,16 @@ class MessageSerializer:
         return serialized
 
     def deserialize(self, serialized):
-        """Deserialize with optional packer, then create message object from builtins."""
+        """Deserialize with codec or optional packer, then create message object from builtins."""
+
+        if self.codec:
+            if serialized[:1] == bytes((FRAME_MARKER,)):
+                buffer = ReceiveBuffer(len(serialized))
+                buffer.extend(serialized)
+                serialized = read_frame(buffer)
+                if serialized is NEED_DATA:
+                    raise ValueError('Incomplete frame, cannot decode message.')
+            return self._message_from_object(self.codec.loads(serialized))
 
         with io.BytesIO(serialized) as f:
             return self._dequeue_message_from_stream(f)
@@ -41,20 +262,32 @@ class MessageSerializer:
         self.buffer.extend(chunk)
 
     def dequeue_message(self):
-        """Returns next deserialized message in queue or None."""
-        if not self.buffer:
-            return None
+        """Returns next deserialized message in queue or None.
 
-        try:
-            with io.BytesIO(self.buffer) as f:
-                message = self._dequeue_message_from_stream(f)
-                pos = f.tell()
-                self.buffer = self.buffer[pos:]
+        Objects that cannot be converted to messages are dropped. Data that is not decodable at all cannot be resynchronized
+        and is discarded, as is incomplete data exceeding the buffer limit.
+        """
+        if self.unpacker:
+            return self._dequeue_message_incremental()
+
+        while self.buffer:
+            try:
+                with self.buffer.view() as view, io.BytesIO(view) as f:
+                    obj = self.packer.load(f)
+                    pos = f.tell()
+            except (EOFError, umsgpack.InsufficientDataException):
+                _logger.debug('Buffered %d bytes do not hold a complete object yet.' % len(self.buffer))
+                self._check_buffer_limit()
+                return None
+            except Exception as e:
+                self._discard('corrupt stream data: %s' % e)
+                return None
+
+            self.buffer.consume(pos)
+            message = self._message_or_none(obj)
+            if message:
                 _logger.debug('Decoded %d bytes from stream to message %s. %d bytes left.' % (pos, message.__class__, len(self.buffer)))
-            return message
-        except Exception as e:
-            _logger.debug('Exception during stream decode: %s' % e)
-            _logger.debug('Decoding of buffer with size %d failed, data assumed incomplete.' % len(self.buffer))
+                return message
 
     def __iter__(self):
         """Iterator over messages in data buffer."""
@@ -63,11 +296,138 @@ class MessageSerializer:
             yield msg
             msg = self.dequeue_message()
 
+    def _dequeue_message_incremental(self):
+        """Returns next message decoded by the incremental unpacker or None if data is incomplete."""
+        while True:
+            try:
+                obj = self._next_object()
+            except Exception as e:
+                self._discard('corrupt stream data: %s' % e)
+                return None
+
+            if obj is NEED_DATA:
+                self._check_buffer_limit()
+                return None
+
+            message = self._message_or_none(obj)
+            if message:
+                _logger.debug('Decoded message %s from stream. %d bytes left.' % (message.__class__, self.unpacker.pending))
+                return message
+
+    def _message_or_none(self, obj):
+        """Returns message created from unpacked object, or None if the object is dropped as it is not a valid message."""
+        try:
+            message = self._message_from_object(obj)
+        except Exception as e:
+            self.messages_dropped += 1
+            if self._resynchronizing:
+                # already reported with the discarded data:
+                _logger.debug('Dropping object following discarded data (%d dropped so far): %s' % (self.messages_dropped, e))
+            else:
+                _logger.warning('Dropping message that could not be decoded (%d dropped so far): %s' % (self.messages_dropped, e))
+            return None
+
+        self._resynchronizing = False
+        return message
+
+    @property
+    def _buffered(self):
+        """Number of bytes held for the object being decoded, including data already decoded into its containers."""
+        return len(self.buffer) + (self.unpacker.partial if self.unpacker else 0)
+
+    def _check_buffer_limit(self):
+        # copies held by the unpacker count against the limit, but are not discarded as stream data:
+        if self._buffered + (self.unpacker.copied if self.unpacker else 0) > self.max_buffered:
+            self._discard('incomplete data exceeding limit of %d bytes' % self.max_buffered)
+
+    def _discard(self, reason):
+        """Drops all buffered data, as the start of the next object cannot be found.
+
+        Until a message is decoded again, objects dropped are likely rests of the discarded data and are not reported again.
+        """
+        count = self._buffered
+        self.bytes_discarded += count
+        _logger.warning('Discarding %d buffered bytes of %s (%d discarded so far).' % (count, reason, self.bytes_discarded))
+        self._resynchronizing = True
+        self.buffer.clear()
+        if self.unpacker:
+            self.unpacker.reset()
+
+    def _next_object(self):
+        """Returns next framed or bare object in buffer, or NEED_DATA if incomplete. Frames of unknown messages are skipped."""
+        buffer = self.buffer
+        while buffer and self.unpacker.at_boundary and buffer.data[buffer.read_pos] == FRAME_MARKER:
+            # the frame is consumed here, so the unpacker must not keep any data fed to it before:
+            self.unpacker.reset()
+            frame = read_frame(buffer, self.max_buffered)
+            if frame is NEED_DATA:
+                return NEED_DATA
+
+            self.peer_framed = True
+            if not frame:
+                continue
+
+            name = peek_message_name(frame, MESSAGE_KEY) if self.codec.supports_ext else None
+            if name is not None and not Message.has_class(name):
+                _logger.debug('Skipping message of unknown type %s.' % name)
+                self.messages_skipped += 1
+                continue
+
+            try:
+                return self.codec.loads(frame)
+            except Exception as e:
+                # frames can be skipped without losing track of the stream:
+                self.messages_dropped += 1
+                _logger.warning('Dropping frame that could not be decoded (%d dropped so far): %s' % (self.messages_dropped, e))
+
+        return self.unpacker.unpack()
+
     def _dequeue_message_from_stream(self, f):
         """Returns next deserialized message in queue or None."""
         assert self.packer, 'Cannot unpack stream data without packer.'
 
-        obj = self.packer.load(f)
-        datatypename = obj[MESSAGE_KEY]
-        message = deserialize_from_builtins(obj, Message.class_by_name(datatypename))
-        return message
+        return self._message_from_builtins(self.packer.load(f), self.lazy)
+
+    def _compress(self, data):
+        """Returns compressed message wrapped in extension type, or the given data if compression does not reduce its size."""
+        start = time.perf_counter()
+        out = bytearray()
+        pack_ext(out, umsgpack.Ext(COMPRESSED_EXT_TYPE, zlib.compress(data, COMPRESSION_LEVEL)))
+        self.stats.compress_time += time.perf_counter() - start
+
+        if len(out) >= len(data):
+            return data
+
+        self.stats.messages_compressed += 1
+        self.stats.bytes_saved += len(data) - len(out)
+        return bytes(out)
+
+    def _decompress(self, ext):
+        """Decodes built-in form of message from extension type."""
+        if ext.type != COMPRESSED_EXT_TYPE:
+            raise ValueError('Unknown message extension type %d.' % ext.type)
+
+        start = time.perf_counter()
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(ext.data, self.max_buffered)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Decompressed message exceeds limit of %d bytes.' % self.max_buffered)
+        obj = self.codec.loads(data)
+        self.stats.decompress_time += time.perf_counter() - start
+        self.stats.messages_decompressed += 1
+        self.stats.bytes_saved += len(data) - _packed_ext_size(len(ext.data))
+        return obj
+
+    def _message_from_object(self, obj):
+        """Creates message object from unpacked object, which may be a compressed message."""
+        if isinstance(obj, umsgpack.Ext):
+            obj = self._decompress(obj)
+        return self._message_from_builtins(obj, self.lazy)
+
+    @classmethod
+    def _message_from_builtins(cls, obj, lazy=False):
+        """Creates message object from its unpacked built-in form."""
+        datatype = Message.class_by_name(obj[MESSAGE_KEY])
+        if lazy:
+            return datatype.from_builtins_lazy(obj)
+        return deserialize_from_builtins(obj, datatype)
@@ -0,0 +1,366 @@
+"""Persistent rope holding text as a balanced binary tree of string chunks.
+
+Ropes are immutable: an edit returns a new rope sharing all unchanged nodes with the original one, so it takes O(log n) time and
+memory instead of copying the complete text. The tree is kept balanced like an AVL tree, by joining subtrees of different height
+along the spine of the higher one and rotating where needed.
+
+Each node also counts the line ends of its text, so lines can be located in logarithmic time as well. Lines end with ``'\n'``,
+``'\r\n'`` or a single ``'\r'``, like in the newline modes tracked for file contents. A node counts a leading ``'\n'`` and a
+trailing ``'\r'`` as line ends of their own, and branches subtract one where such a pair meets at the seam of their subtrees.
+
+Finally each node caches the fingerprint of its text, a polynomial hash that is combined from the fingerprints of the subtrees.
+It is computed on demand, so after an edit only the new nodes along the edited path are hashed. See ``fingerprint()``.
+"""
+import re
+
+#: Maximal number of characters held by a single leaf.
+LEAF_SIZE = 2048
+
+#: Line ends.
+_LINE_END = re.compile('\r\n|\r|\n')
+
+#: Modulus of fingerprints, the largest safe prime below 2**61. Modulo a safe prime 2 is a primitive root, so the powers of the
+#: base 2**32 do not repeat within any realistic text length, as they would modulo the Mersenne prime 2**61-1 after 61 characters.
+FINGERPRINT_MODULUS = (1 << 61) - 2373
+
+#: Powers of two modulo FINGERPRINT_MODULUS by exponent, used to reduce large values.
+_powers = {}
+
+
+def fingerprint(text):
+    """Returns fingerprint of given text, to compare texts by a few bytes only.
+
+    The fingerprint is the text's UTF-32-BE encoding read as big endian unsigned integer, modulo FINGERPRINT_MODULUS. It is a
+    polynomial hash of the code points with base 2**32, which peers can compute without hashing library. The fingerprint of a
+    concatenation is ``(fingerprint(a) * 2**(32 * len(b)) + fingerprint(b)) % FINGERPRINT_MODULUS``.
+    """
+    return _reduce(int.from_bytes(text.encode('utf-32-be', 'surrogatepass'), 'big'))
+
+
+def _reduce(value):
+    """Returns value modulo FINGERPRINT_MODULUS, folding large values first as that is much faster than long division."""
+    bits = value.bit_length()
+    while bits > 128:
+        # replace high part by its product with 2**shift modulo FINGERPRINT_MODULUS, shift is a power of two below bits / 2:
+        shift = 1 << (bits.bit_length() - 2)
+        power = _powers.get(shift)
+        if power is None:
+            power = _powers[shift] = pow(2, shift, FINGERPRINT_MODULUS)
+        value = (value >> shift) * power + (value & ((1 << shift) - 1))
+        bits = value.bit_length()
+    return value % FINGERPRINT_MODULUS
+
+
+class Leaf:
+    """Chunk of text."""
+
+    __slots__ = ('text', 'length', 'newlines', 'starts_lf', 'ends_cr', 'fingerprint', 'scale')
+
+    #: Height of subtree.
+    height = 0
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        #: Number of line ends.
+        self.newlines = _count_line_ends(text)
+        #: Does text start with '\n', respectively end with '\r', which form a single line end if joined?
+        self.starts_lf = text[:1] == '\n'
+        self.ends_cr = text[-1:] == '\r'
+        #: Fingerprint of text and factor shifting fingerprints of preceding text, 2**(32 * length) modulo FINGERPRINT_MODULUS,
+        #: computed on demand by _fingerprint().
+        self.fingerprint = self.scale = None
+
+
+class Branch:
+    """Concatenation of two non-empty subtrees."""
+
+    __slots__ = ('left', 'right', 'length', 'height', 'newlines', 'starts_lf', 'ends_cr', 'fingerprint', 'scale')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.height = max(left.height, right.height) + 1
+        self.newlines = left.newlines + right.newlines - _seam(left, right)
+        self.starts_lf = left.starts_lf
+        self.ends_cr = right.ends_cr
+        self.fingerprint = self.scale = None
+
+
+def _count_line_ends(text):
+    return text.count('\n') + text.count('\r') - text.count('\r\n')
+
+
+def _seam(left, right):
+    """Returns 1 if a '\r\n' line end is split between given subtrees, which both count as line end, otherwise 0."""
+    return 1 if left.ends_cr and right.starts_lf else 0
+
+
+def _fingerprint(node):
+    """Returns fingerprint of given tree, computing and caching it for all nodes that have none yet."""
+    if node.fingerprint is None:
+        if node.height:
+            left, right = _fingerprint(node.left), _fingerprint(node.right)
+            value = (left * node.right.scale + right) % FINGERPRINT_MODULUS
+            scale = node.left.scale * node.right.scale % FINGERPRINT_MODULUS
+        else:
+            value = fingerprint(node.text)
+            scale = pow(2, 32 * node.length, FINGERPRINT_MODULUS)
+        # scale first, as other threads take a node with fingerprint as complete:
+        node.scale = scale
+        node.fingerprint = value
+    return node.fingerprint
+
+
+#: Tree of empty text.
+EMPTY = Leaf('')
+
+
+def build(text):
+    """Returns balanced tree holding given text."""
+    if len(text) <= LEAF_SIZE:
+        return Leaf(text)
+    return _build([text[i:i + LEAF_SIZE] for i in range(0, len(text), LEAF_SIZE)], 0, (len(text) + LEAF_SIZE - 1) // LEAF_SIZE)
+
+
+def _build(chunks, lo, hi):
+    if hi - lo == 1:
+        return Leaf(chunks[lo])
+    mid = (lo + hi) // 2
+    return Branch(_build(chunks, lo, mid), _build(chunks, mid, hi))
+
+
+def join(a, b):
+    """Returns balanced concatenation of given trees, merging small leaves at the seam."""
+    if not a.length:
+        return b
+    if not b.length:
+        return a
+
+    ha, hb = a.height, b.height
+    if ha > hb + 1:
+        return _balance(a.left, join(a.right, b))
+    if hb > ha + 1:
+        return _balance(join(a, b.left), b.right)
+
+    if ha == 0 and hb == 0:
+        if a.length + b.length <= LEAF_SIZE:
+            return Leaf(a.text + b.text)
+    elif ha == 1 and hb == 0:
+        if a.right.length + b.length <= LEAF_SIZE:
+            return Branch(a.left, Leaf(a.right.text + b.text))
+    elif ha == 0 and hb == 1:
+        if a.length + b.left.length <= LEAF_SIZE:
+            return Branch(Leaf(a.text + b.left.text), b.right)
+    return Branch(a, b)
+
+
+def _balance(left, right):
+    """Returns branch of given subtrees, rotated if their heights differ by two."""
+    if left.height > right.height + 1:
+        if left.left.height >= left.right.height:
+            return Branch(left.left, Branch(left.right, right))
+        return Branch(Branch(left.left, left.right.left), Branch(left.right.right, right))
+    if right.height > left.height + 1:
+        if right.right.height >= right.left.height:
+            return Branch(Branch(left, right.left), right.right)
+        return Branch(Branch(left, right.left.left), Branch(right.left.right, right.right))
+    return Branch(left, right)
+
+
+def split(node, index):
+    """Returns trees holding the text before and after given index."""
+    if index <= 0:
+        return EMPTY, node
+    if index >= node.length:
+        return node, EMPTY
+
+    if not node.height:
+        return Leaf(node.text[:index]), Leaf(node.text[index:])
+
+    left = node.left
+    if index < left.length:
+        head, tail = split(left, index)
+        return head, join(tail, node.right)
+    head, tail = split(node.right, index - left.length)
+    return join(left, head), tail
+
+
+def _replace_in_leaf(node, start, end, text):
+    """Returns tree with range replaced inside a single leaf, or None if the range spans leaves or the leaf would overflow."""
+    if not node.height:
+        replaced = node.text[:start] + text + node.text[end:]
+        if not replaced or len(replaced) > LEAF_SIZE:
+            return None
+        return Leaf(replaced)
+
+    left = node.left
+    if end <= left.length:
+        replaced = _replace_in_leaf(left, start, end, text)
+        return None if replaced is None else Branch(replaced, node.right)
+    if start >= left.length:
+        replaced = _replace_in_leaf(node.right, start - left.length, end - left.length, text)
+        return None if replaced is None else Branch(left, replaced)
+    return None
+
+
+class Rope:
+    """Immutable text supporting edits in logarithmic time.
+
+    Indexing and slicing return strings, ``str()`` returns the complete text.
+    """
+
+    __slots__ = ('root',)
+
+    def __init__(self, text=''):
+        #: Root node of tree.
+        self.root = build(text) if text else EMPTY
+
+    @classmethod
+    def from_root(cls, root):
+        rope = cls.__new__(cls)
+        rope.root = root
+        return rope
+
+    def __len__(self):
+        return self.root.length
+
+    def __str__(self):
+        if not self.root.height:
+            return self.root.text
+        return ''.join(self.chunks())
+
+    def __repr__(self):
+        return '%s(%d characters)' % (self.__class__.__name__, len(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (Rope, str)):
+            return len(self) == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        if not isinstance(other, Rope):
+            return NotImplemented
+        return self.from_root(join(self.root, other.root))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            return ''.join(self.chunks(start, stop))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Rope index out of range.')
+        return next(self.chunks(index, index + 1))
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of complete text, see module function fingerprint()."""
+        return _fingerprint(self.root)
+
+    @property
+    def line_count(self):
+        return self.root.newlines + 1
+
+    def line_start(self, index):
+        """Returns offset of the first character of the line with given zero-based index."""
+        if not 0 <= index <= self.root.newlines:
+            raise IndexError('Line %d out of range, rope has %d lines.' % (index, self.line_count))
+        if not index:
+            return 0
+
+        # find the index-th line end:
+        node, offset, count = self.root, 0, index
+        while node.height:
+            if count <= node.left.newlines:
+                node = node.left
+            else:
+                # skip leading '\n' of right subtree completing a '\r' of the left one:
+                count -= node.left.newlines - _seam(node.left, node.right)
+                offset += node.left.length
+                node = node.right
+
+        for match in _LINE_END.finditer(node.text):
+            count -= 1
+            if not count:
+                break
+        end = offset + match.end()
+        if node.text.endswith('\r', 0, match.end()) and match.end() == node.length and self[end:end + 1] == '\n':
+            # '\r\n' split between leaves:
+            end += 1
+        return end
+
+    def line_index(self, offset):
+        """Returns zero-based index of the line holding the character at given offset."""
+        if not 0 <= offset <= len(self):
+            raise IndexError('Offset %d out of range, rope has %d characters.' % (offset, len(self)))
+
+        # count line ends completed before offset, a '\r' at the seam is only completed by the '\n' following it:
+        node, count = self.root, 0
+        while node.height:
+            if offset < node.left.length:
+                node = node.left
+            else:
+                count += node.left.newlines - _seam(node.left, node.right)
+                offset -= node.left.length
+                node = node.right
+
+        text = node.text
+        count += _count_line_ends(text[:offset])
+        if text.endswith('\r', 0, offset) and text.startswith('\n', offset):
+            count -= 1
+        return count
+
+    def line_end(self, index):
+        """Returns offset behind the last character of the line with given zero-based index, excluding its line end."""
+        if index == self.root.newlines:
+            return len(self)
+
+        end = self.line_start(index + 1) - 1
+        return end - 1 if end and self[end - 1:end + 1] == '\r\n' else end
+
+    def line(self, index):
+        """Returns text of the line with given zero-based index, without line end."""
+        return self[self.line_start(index):self.line_end(index)]
+
+    def chunks(self, start=0, end=None):
+        """Iterates pieces of text between given indexes, without copying leaves that are covered completely."""
+        end = len(self) if end is None else min(end, len(self))
+        stack = [(self.root, 0)]
+        while stack:
+            node, offset = stack.pop()
+            if offset >= end or offset + node.length <= start:
+                continue
+            if node.height:
+                stack.append((node.right, offset + node.left.length))
+                stack.append((node.left, offset))
+            elif start <= offset and offset + node.length <= end:
+                yield node.text
+            else:
+                yield node.text[max(start - offset, 0):end - offset]
+
+    def slice(self, start, end):
+        """Returns rope holding the text between given indexes, sharing all nodes covered completely with this rope."""
+        if not 0 <= start <= end <= len(self):
+            raise IndexError('Range [%d,%d] exceeds rope of length %d.' % (start, end, len(self)))
+        head, _ = split(self.root, end)
+        _, sliced = split(head, start)
+        return self.from_root(sliced)
+
+    def replace(self, start, end, text):
+        """Returns new rope with the text between given indexes replaced."""
+        if not 0 <= start <= end <= len(self):
+            raise IndexError('Range [%d,%d] exceeds rope of length %d.' % (start, end, len(self)))
+
+        root = _replace_in_leaf(self.root, start, end, text) if len(text) <= LEAF_SIZE else None
+        if root is None:
+            head, rest = split(self.root, start)
+            _, tail = split(rest, end - start)
+            root = join(join(head, build(text) if text else EMPTY), tail)
+        return self.from_root(root)
@@ -1,6 +1,8 @@
 """JEP message types."""
+import collections
 import enum
-from jep_py.serializer import Serializable
+import re
+from jep_py.serializer import Serializable, Columns, TextPayload, register_columns
 
 #: Name of token attribute for request/response messages.
 TOKEN_ATTR_NAME = 'token'
@@ -21,6 +23,20 @@ class Message(Serializable):
             cls._class_by_name = {sc.__name__: sc for sc in cls.__subclasses__()}
         return cls._class_by_name[name]
 
+    @classmethod
+    def handler_name(cls):
+        """Name of listener method handling messages of this type, e.g. on_content_sync for ContentSync."""
+        return 'on_' + re.sub(r'(?<!^)(?=[A-Z])', '_', cls.__name__).lower()
+
+    @classmethod
+    def has_class(cls, name):
+        """Is a message class with the given name known?"""
+        try:
+            cls.class_by_name(name)
+            return True
+        except KeyError:
+            return False
+
 
 class Shutdown(Message):
     def invoke(self, listener, context):
@@ -33,7 +49,10 @@ class BackendAlive(Message):
 
 
 class ContentSync(Message):
-    def __init__(self, file: str, data: str, start: int = 0, end: int = None):
+    """Update of file content, data is a string or a text payload. Received data is a text payload if it was sent as such to a
+    peer supporting the compact form."""
+
+    def __init__(self, file: str, data: TextPayload, start: int = 0, end: int = None):
         super().__init__()
         self.file = file
         self.start = start
@@ -44,15 +63,59 @@ class ContentSync(Message):
         listener.on_content_sync(self, context)
 
 
+class ContentFingerprint(Message):
+    """Request to verify the receiver's content of a file has the given fingerprint, see jep_py.rope.fingerprint(). Answered by
+    OutOfSync only if it has not."""
+
+    def __init__(self, file: str, fingerprint: int):
+        super().__init__()
+        self.file = file
+        self.fingerprint = fingerprint
+
+    def invoke(self, listener, context):
+        listener.on_content_fingerprint(self, context)
+
+
 class OutOfSync(Message):
-    def __init__(self, file: str):
+    """Notification that the sender's content of a file is out of sync. May carry fingerprints of the complete blocks of the given
+    size of the stale content, for the receiver to answer with a ContentDelta instead of the complete content."""
+
+    def __init__(self, file: str, blockSize: int = None, blocks: [int] = ()):
         super().__init__()
         self.file = file
+        self.blockSize = blockSize
+        self.blocks = blocks
 
     def invoke(self, listener, context):
         listener.on_out_of_sync(self, context)
 
 
+class DeltaSegment(Serializable):
+    """Literal data followed by a run of count blocks of the receiver's stale content, starting at given block index."""
+
+    def __init__(self, data: str, block: int = 0, count: int = 0):
+        super().__init__()
+        self.data = data
+        self.block = block
+        self.count = count
+
+
+class ContentDelta(Message):
+    """Update of file content in response to OutOfSync with block checksums, fingerprint and digest verify the updated content."""
+
+    def __init__(self, file: str, blockSize: int, segments: [DeltaSegment], fingerprint: int, digest: str):
+        super().__init__()
+        self.file = file
+        self.blockSize = blockSize
+        self.segments = segments
+        self.fingerprint = fingerprint
+        #: SHA-256 digest of the UTF-8 encoded content, see jep_py.delta.content_digest().
+        self.digest = digest
+
+    def invoke(self, listener, context):
+        listener.on_content_delta(self, context)
+
+
 @enum.unique
 class Severity(enum.Enum):
     debug = 1
@@ -70,6 +133,18 @@ class Problem(Serializable):
         self.line = line
 
 
+@register_columns
+class ProblemColumns(Columns):
+    """Problems held as parallel lists of messages, severities and lines, to be used instead of lists of problems."""
+
+    __slots__ = ()
+    item_class = Problem
+
+    @classmethod
+    def from_lists(cls, messages, severities, lines):
+        return cls(collections.OrderedDict([('message', messages), ('severity', severities), ('line', lines)]))
+
+
 class FileProblems(Serializable):
     def __init__(self, file: str, problems: [Problem], total: int = None, start: int = 0, end: int = None):
         super().__init__()
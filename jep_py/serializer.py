@@ -1,7 +1,24 @@
-"""Reflective serialization of messages based on mapping classes to built-in types."""
+"""Reflective serialization of messages based on mapping classes to built-in types.
+
+Serializable objects are represented by maps of their attributes by name, enum members by their names. In compact form, objects
+are represented by arrays of their attribute values in declaration order instead, with trailing defaults omitted, and enum members
+by their ordinals. Both forms are accepted on decoding.
+
+Long lists of objects of a single class may be held in ``Columns``, storing one list per attribute instead of one object per
+item. In compact form they are represented by a map of these columns, with strings replaced by indexes into a table of unique
+strings. Otherwise they are represented like lists of their items, so peers not supporting the compact form can decode them.
+
+Large texts may be held in ``TextPayload``, keeping them UTF-8 encoded. They are sent as binary data in compact form and as
+strings otherwise.
+"""
+import collections
+import collections.abc
 import enum
 import inspect
 
+#: Marker for attributes not set on an instance.
+_MISSING = object()
+
 
 class SerializedAttribute:
     """Description of constructor attribute to be serialized as member of object."""
@@ -28,12 +45,44 @@ class SerializedAttribute:
 
 
 class SerializableMeta(type):
-    """Metaclass remembering the types and default values passed to class constructors."""
+    """Metaclass remembering the types and default values passed to class constructors.
+
+    Instances store their attributes in ``__slots__`` generated from the constructor arguments, instead of a per-instance
+    ``__dict__``. Classes defining ``__slots__`` themselves are left untouched, e.g. to add ``'__dict__'`` for attributes that
+    are not passed to the constructor.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        if '__slots__' not in namespace:
+            namespace['__slots__'] = _generated_slots(bases, namespace)
+        return super().__new__(mcs, name, bases, namespace)
 
     def __init__(cls, name, bases, namespace):
         super().__init__(name, bases, namespace)
         ctor = inspect.signature(cls.__init__)
-        cls.serialized_attribs = {p.name: SerializedAttribute(p.name, p.annotation, p.default) for p in ctor.parameters.values() if p.name is not 'self'}
+        cls.serialized_attribs = collections.OrderedDict((p.name, SerializedAttribute(p.name, p.annotation, p.default))
+                                                         for p in ctor.parameters.values() if p.name != 'self')
+        #: Decoder from built-in form, compiled on first use.
+        cls._deserializer = None
+        #: Decoder from built-in form deferring conversion of attributes to first access, compiled on first use.
+        cls._lazy_deserializer = None
+
+
+def _generated_slots(bases, namespace):
+    """Names of constructor arguments that are neither stored in slots of a base class nor shadowed by class attributes."""
+    init = namespace.get('__init__')
+    if init is None:
+        return ()
+
+    inherited = set()
+    for base in bases:
+        for cls in base.__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            inherited.update((slots,) if isinstance(slots, str) else slots)
+
+    kinds = (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+    return tuple(p.name for p in inspect.signature(init).parameters.values()
+                 if p.name != 'self' and p.kind in kinds and p.name not in inherited and p.name not in namespace)
 
 
 class Serializable(metaclass=SerializableMeta):
@@ -46,6 +95,16 @@ class Serializable(metaclass=SerializableMeta):
         # hide base class init arguments to prevent they are collected:
         super().__init__()
 
+    @classmethod
+    def from_builtins(cls, serialized):
+        """Instantiates class from its built-in serialized form."""
+        return (cls._deserializer or compile_deserializer(cls))(serialized)
+
+    @classmethod
+    def from_builtins_lazy(cls, serialized):
+        """Instantiates class from its built-in serialized form, converting attributes only when they are first accessed."""
+        return (cls._lazy_deserializer or compile_lazy_deserializer(cls))(serialized)
+
     @classmethod
     def is_serialized_and_not_default(cls, name, value):
         """Checks if attribute with given name has a value different from its optional default."""
@@ -56,27 +115,225 @@ class Serializable(metaclass=SerializableMeta):
         return attrib and ((attrib.default is inspect._empty) or (attrib.default != value))
 
 
-def serialize_to_builtins(o):
-    """Serialization of arbitrary object to built-in data types."""
+class Columns(collections.abc.Sequence):
+    """Sequence of serializable objects of a single class, stored as one list of values per attribute.
+
+    Items are only created when accessed by index, ``rows()`` iterates the attribute values without creating any objects. Equal
+    strings are stored only once.
+    """
+
+    __slots__ = ('columns',)
+
+    #: Serializable class of items, set by derived classes.
+    item_class = None
+    #: Key of table of unique strings in compact form.
+    STRINGS_KEY = '_strings'
+
+    def __init__(self, columns):
+        #: Lists of attribute values by attribute name, in declaration order of the item class.
+        self.columns = collections.OrderedDict()
+        interned = {}
+        for attrib in self.item_class.serialized_attribs.values():
+            column = columns.get(attrib.name, ())
+            if attrib.datatype is str:
+                self.columns[attrib.name] = [interned.setdefault(value, value) for value in column]
+            else:
+                self.columns[attrib.name] = list(column)
+        lengths = set(len(column) for column in self.columns.values())
+        if len(lengths) > 1:
+            raise ValueError('Columns of %s differ in length: %s.' % (self.__class__.__name__, sorted(lengths)))
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates columns from sequence of items."""
+        columns = collections.OrderedDict((name, []) for name in cls.item_class.serialized_attribs)
+        for item in items:
+            for name, column in columns.items():
+                column.append(getattr(item, name))
+        return cls(columns)
+
+    def __len__(self):
+        column = next(iter(self.columns.values()), ())
+        return len(column)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.__class__(collections.OrderedDict((name, column[index]) for name, column in self.columns.items()))
+        return self.item_class(**{name: column[index] for name, column in self.columns.items()})
+
+    def __repr__(self):
+        return '%s(%d items)' % (self.__class__.__name__, len(self))
+
+    def rows(self):
+        """Iterates tuples of attribute values in declaration order."""
+        return zip(*self.columns.values())
+
+    def to_builtins(self, compact=False):
+        """Returns map of columns in compact form, or list of items in built-in form."""
+        if not compact:
+            return [serialize_to_builtins(item) for item in self]
+
+        strings = {}
+        serialized = {}
+        for attrib in self.item_class.serialized_attribs.values():
+            column = self.columns[attrib.name]
+            if attrib.datatype is str:
+                serialized[attrib.name] = [strings.setdefault(value, len(strings)) for value in column]
+            elif attrib.datatype in (int, float, bool):
+                serialized[attrib.name] = column
+            elif isinstance(attrib.datatype, type) and issubclass(attrib.datatype, enum.Enum):
+                serialized[attrib.name] = [None if value is None else enum_ordinal(value) for value in column]
+            else:
+                serialized[attrib.name] = [serialize_to_builtins(value, True) for value in column]
+        serialized[self.STRINGS_KEY] = list(strings)
+        return serialized
+
+    @classmethod
+    def from_builtins(cls, serialized):
+        """Instantiates columns from their compact built-in form."""
+        strings = serialized.get(cls.STRINGS_KEY) or []
+        length = max([len(value) for key, value in serialized.items() if key != cls.STRINGS_KEY] or [0])
+        columns = {}
+        for attrib in cls.item_class.serialized_attribs.values():
+            values = serialized.get(attrib.name)
+            if values is None:
+                if attrib.default is inspect._empty:
+                    raise TypeError("While trying to deserialize type %s, required column %s was not in stream." % (cls, attrib.name))
+                columns[attrib.name] = [attrib.default] * length
+            elif attrib.datatype is str:
+                columns[attrib.name] = [strings[index] for index in values]
+            else:
+                convert = _compile_converter(attrib.datatype, attrib.itemtype, attrib.name)
+                columns[attrib.name] = [convert(value) for value in values]
+        return cls(columns)
+
+
+class LazyConversionError(TypeError):
+    """Raised on first access of an attribute of a lazily decoded object whose serialized value cannot be converted."""
+
+
+class TextPayload:
+    """UTF-8 encoded text that is passed on as is, and only decoded when its text is accessed."""
+
+    __slots__ = ('data', '_text')
+
+    def __init__(self, data, text=None):
+        #: Encoded text as bytes-like object, a memory view for received payloads.
+        self.data = data
+        self._text = text
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(text.encode('utf-8'), text)
+
+    @property
+    def text(self):
+        """Decoded text, computed on first access."""
+        if self._text is None:
+            self._text = str(self.data, 'utf-8')
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return '%s(%d bytes)' % (self.__class__.__name__, len(self.data))
+
+    def __eq__(self, other):
+        if isinstance(other, TextPayload):
+            return self.data == other.data
+        if isinstance(other, str):
+            return self.text == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(bytes(self.data))
+
+    @classmethod
+    def from_builtins(cls, value):
+        """Wraps received binary data without copying it, text received as string is returned as is."""
+        if value is None or isinstance(value, str):
+            return value
+        return cls(memoryview(value))
+
+
+#: Columns classes by item class, to decode lists of items sent in columnar form.
+_columns_classes = {}
+
+
+def register_columns(columns_class):
+    """Registers columns class as in-memory and compact form of lists of its item class."""
+    _columns_classes[columns_class.item_class] = columns_class
+    return columns_class
 
-    if isinstance(o, enum.Enum):
-        serialized = o.name
+
+def serialize_to_builtins(o, compact=False):
+    """Serialization of arbitrary object to built-in data types, optionally in compact form."""
+
+    if isinstance(o, Columns):
+        serialized = o.to_builtins(compact)
+    elif isinstance(o, TextPayload):
+        serialized = o.text
+    elif isinstance(o, enum.Enum):
+        serialized = enum_ordinal(o) if compact else o.name
+    elif isinstance(o, Serializable) and compact:
+        serialized = [serialize_to_builtins(value, compact) for value in compact_values(o)]
     elif isinstance(o, Serializable):
-        serialized = serialize_to_builtins({key: value for key, value in o.__dict__.items() if o.is_serialized_and_not_default(key, value)})
+        serialized = {}
+        for attrib in o.serialized_attribs.values():
+            value = getattr(o, attrib.name, _MISSING)
+            if value is not _MISSING and (attrib.default is inspect._empty or attrib.default != value):
+                serialized[attrib.name] = serialize_to_builtins(value)
     elif hasattr(o, '__dict__'):
-        serialized = serialize_to_builtins(o.__dict__)
+        serialized = serialize_to_builtins(o.__dict__, compact)
     elif isinstance(o, list):
-        serialized = [serialize_to_builtins(item) for item in o]
+        serialized = [serialize_to_builtins(item, compact) for item in o]
     elif isinstance(o, dict):
-        serialized = {key: serialize_to_builtins(value) for key, value in o.items()}
+        serialized = {key: serialize_to_builtins(value, compact) for key, value in o.items()}
     else:
         serialized = o
 
     return serialized
 
 
+def compact_values(o):
+    """Returns values of all attributes of serializable object in declaration order, omitting trailing default values."""
+    values = []
+    count = 0
+    for attrib in o.serialized_attribs.values():
+        value = getattr(o, attrib.name, _MISSING)
+        if value is _MISSING:
+            value = None if attrib.default is inspect._empty else attrib.default
+        elif attrib.default is inspect._empty or attrib.default != value:
+            count = len(values) + 1
+        values.append(value)
+    del values[count:]
+    return values
+
+
+#: Ordinals of enum members by enum class.
+_ordinals = {}
+
+
+def enum_ordinal(member):
+    """Returns position of enum member in declaration order of its class, ignoring aliases."""
+    ordinals = _ordinals.get(member.__class__)
+    if ordinals is None:
+        ordinals = _ordinals[member.__class__] = {m: i for i, m in enumerate(member.__class__)}
+    return ordinals[member]
+
+
 def deserialize_from_builtins(serialized, datatype, itemtype=None, name=None):
-    """Instantiation of data type from built-in serialized form."""
+    """Instantiation of data type from built-in serialized form, using compiled decoders for serializable classes."""
+
+    if isinstance(datatype, SerializableMeta) and serialized is not None and serialized is not inspect._empty:
+        return datatype.from_builtins(serialized)
+
+    return deserialize_reflective(serialized, datatype, itemtype, name)
+
+
+def deserialize_reflective(serialized, datatype, itemtype=None, name=None):
+    """Instantiation of data type from built-in serialized form by inspection of each value."""
 
     # check for common encoding errors that may come up when hooking up different
     # libraries in frontend and backend to emit better error message:
@@ -88,18 +345,169 @@ def deserialize_from_builtins(serialized, datatype, itemtype=None, name=None):
     elif serialized is inspect._empty:
         raise TypeError("While trying to deserialize type %s, required attribute %s was not in stream." % (datatype, name))
     elif isinstance(datatype, SerializableMeta):
-        ctor_arguments = {attrib.name: deserialize_from_builtins(serialized.get(attrib.name, attrib.default), attrib.datatype, attrib.itemtype, attrib.name)
+        if isinstance(serialized, list):
+            serialized = dict(zip(datatype.serialized_attribs, serialized))
+        ctor_arguments = {attrib.name: deserialize_reflective(serialized.get(attrib.name, attrib.default), attrib.datatype, attrib.itemtype, attrib.name)
                           for attrib in datatype.serialized_attribs.values()}
         instantiated = datatype(**ctor_arguments)
+    elif datatype is TextPayload:
+        instantiated = TextPayload.from_builtins(serialized)
+    elif datatype is list and itemtype and isinstance(serialized, dict) and itemtype in _columns_classes:
+        instantiated = _columns_classes[itemtype].from_builtins(serialized)
     elif datatype is list and itemtype:
-        instantiated = [deserialize_from_builtins(item, itemtype) for item in serialized]
+        instantiated = [deserialize_reflective(item, itemtype) for item in serialized]
     elif datatype is dict and itemtype:
-        instantiated = {key: deserialize_from_builtins(value, itemtype) for key, value in serialized.items()}
+        instantiated = {key: deserialize_reflective(value, itemtype) for key, value in serialized.items()}
     elif issubclass(datatype, enum.Enum):
-        instantiated = datatype[serialized]
+        instantiated = list(datatype)[serialized] if isinstance(serialized, int) and serialized >= 0 else datatype[serialized]
     elif not itemtype:
         instantiated = datatype(serialized)
     else:
         raise TypeError("Cannot deserialize type %s with item type %s." % (datatype, itemtype))
 
-    return instantiated
\ No newline at end of file
+    return instantiated
+
+
+def compile_deserializer(cls):
+    """Creates decoder function for serializable class, with all type dispatch of its attributes resolved ahead of time."""
+
+    # one entry per constructor argument: (name, default, converter):
+    plan = []
+
+    def deserialize(serialized):
+        if serialized.__class__ is list:
+            return deserialize_compact(serialized)
+        get = serialized.get
+        ctor_arguments = {}
+        for name, default, convert in plan:
+            value = get(name, default)
+            if value is inspect._empty:
+                raise TypeError("While trying to deserialize type %s, required attribute %s was not in stream." % (cls, name))
+            ctor_arguments[name] = convert(value)
+        return cls(**ctor_arguments)
+
+    def deserialize_compact(values):
+        count = len(values)
+        ctor_arguments = {}
+        for i, (name, default, convert) in enumerate(plan):
+            value = values[i] if i < count else default
+            if value is inspect._empty:
+                raise TypeError("While trying to deserialize type %s, required attribute %s was not in stream." % (cls, name))
+            ctor_arguments[name] = convert(value)
+        return cls(**ctor_arguments)
+
+    # register before compiling attributes so recursive types find their decoder:
+    cls._deserializer = deserialize
+    plan.extend((attrib.name, attrib.default, _compile_converter(attrib.datatype, attrib.itemtype, attrib.name))
+                for attrib in cls.serialized_attribs.values())
+    return deserialize
+
+
+def _compile_converter(datatype, itemtype, name):
+    """Returns function converting a serialized value to the given data type."""
+
+    if isinstance(datatype, SerializableMeta):
+        def convert(value):
+            return None if value is None else datatype.from_builtins(value)
+    elif datatype is TextPayload:
+        convert = TextPayload.from_builtins
+    elif datatype is list and itemtype:
+        convert_item = _compile_converter(itemtype, None, None)
+        columns_class = _columns_classes.get(itemtype)
+
+        def convert(value):
+            if value is None:
+                return None
+            if columns_class and value.__class__ is dict:
+                return columns_class.from_builtins(value)
+            return [convert_item(item) for item in value]
+    elif datatype is dict and itemtype:
+        convert_item = _compile_converter(itemtype, None, None)
+
+        def convert(value):
+            return None if value is None else {key: convert_item(item) for key, item in value.items()}
+    elif isinstance(datatype, type) and issubclass(datatype, enum.Enum):
+        members = datatype.__members__
+        by_ordinal = dict(enumerate(datatype))
+
+        def convert(value):
+            if value is None:
+                return None
+            return by_ordinal[value] if value.__class__ is int else members[value]
+    elif datatype is str or datatype is bytes:
+        mismatch = bytes if datatype is str else str
+
+        def convert(value):
+            if value is None or value.__class__ is datatype:
+                return value
+            if isinstance(value, mismatch):
+                raise TypeError('Cannot deserialize attribute %s of type %s from object "%s" of type %s.' % (name, datatype.__name__, value, type(value).__name__))
+            return datatype(value)
+    elif isinstance(datatype, type) and not itemtype:
+        def convert(value):
+            return value if value is None or value.__class__ is datatype else datatype(value)
+    else:
+        def convert(value):
+            return deserialize_reflective(value, datatype, itemtype, name)
+
+    return convert
+
+
+def compile_lazy_deserializer(cls):
+    """Creates decoder function instantiating a lazy subclass of given serializable class.
+
+    The lazy subclass has the same name and keeps the serialized form of the object. Each attribute is a property converting its
+    serialized value on first access and storing the result in the slot of the original class. Only the presence of required
+    attributes is checked upfront, values that cannot be converted raise LazyConversionError on access. Classes storing
+    attributes outside of slots are decoded eagerly.
+    """
+    slots = {}
+    for name in cls.serialized_attribs:
+        slot = next((klass.__dict__[name] for klass in cls.__mro__ if name in klass.__dict__), None)
+        if not inspect.ismemberdescriptor(slot):
+            cls._lazy_deserializer = cls._deserializer or compile_deserializer(cls)
+            return cls._lazy_deserializer
+        slots[name] = slot
+
+    namespace = {'__slots__': ('_serialized',), '__module__': cls.__module__, '__qualname__': cls.__qualname__}
+    for attrib in cls.serialized_attribs.values():
+        namespace[attrib.name] = _lazy_property(attrib.name, attrib.default, _compile_converter(attrib.datatype, attrib.itemtype, attrib.name),
+                                                slots[attrib.name])
+    lazy_cls = type(cls)(cls.__name__, (cls,), namespace)
+
+    required = [attrib.name for attrib in cls.serialized_attribs.values() if attrib.default is inspect._empty]
+    names = tuple(cls.serialized_attribs)
+    new = object.__new__
+
+    def deserialize(serialized):
+        if serialized.__class__ is list:
+            serialized = dict(zip(names, serialized))
+        for name in required:
+            if name not in serialized:
+                raise TypeError("While trying to deserialize type %s, required attribute %s was not in stream." % (cls, name))
+        obj = new(lazy_cls)
+        obj._serialized = serialized
+        return obj
+
+    cls._lazy_deserializer = deserialize
+    return deserialize
+
+
+def _lazy_property(name, default, convert, slot):
+    """Returns property converting serialized attribute value on first access."""
+
+    def getter(self):
+        try:
+            return slot.__get__(self, None)
+        except AttributeError:
+            try:
+                value = convert(self._serialized.get(name, default))
+            except Exception as e:
+                raise LazyConversionError('Cannot convert attribute %s of %s: %s' % (name, type(self).__name__, e)) from e
+            slot.__set__(self, value)
+            return value
+
+    def setter(self, value):
+        slot.__set__(self, value)
+
+    return property(getter, setter)
@@ -0,0 +1,233 @@
+"""Incremental decoding of msgpack streams.
+
+The unpacker keeps its parse position and the stack of partially decoded containers across calls, so data arriving in chunks
+is examined only once, no matter how many chunks a single object is spread over. A missing tail is reported by returning
+``NEED_DATA`` instead of raising.
+"""
+import struct
+import umsgpack
+from jep_py.buffer import ReceiveBuffer
+
+
+class _NeedData:
+    def __repr__(self):
+        return 'NEED_DATA'
+
+    def __bool__(self):
+        return False
+
+
+#: Returned by Unpacker.unpack() if the buffered data does not hold another complete object yet.
+NEED_DATA = _NeedData()
+
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_INT64 = struct.Struct('>q')
+_FLOAT32 = struct.Struct('>f')
+_FLOAT64 = struct.Struct('>d')
+
+#: Fixed size scalars by type byte: (struct, size).
+_SCALARS = {
+    0xca: (_FLOAT32, 4),
+    0xcb: (_FLOAT64, 8),
+    0xcc: (None, 1),
+    0xcd: (_UINT16, 2),
+    0xce: (_UINT32, 4),
+    0xcf: (_UINT64, 8),
+    0xd0: (_INT8, 1),
+    0xd1: (_INT16, 2),
+    0xd2: (_INT32, 4),
+    0xd3: (_INT64, 8),
+}
+
+#: Length prefix of str, bin and ext types by type byte: (struct, size).
+_LENGTHS = {
+    0xc4: (None, 1), 0xc5: (_UINT16, 2), 0xc6: (_UINT32, 4),
+    0xc7: (None, 1), 0xc8: (_UINT16, 2), 0xc9: (_UINT32, 4),
+    0xd9: (None, 1), 0xda: (_UINT16, 2), 0xdb: (_UINT32, 4),
+    0xdc: (_UINT16, 2), 0xdd: (_UINT32, 4),
+    0xde: (_UINT16, 2), 0xdf: (_UINT32, 4),
+}
+
+#: Data sizes of fixext types by type byte.
+_FIXEXT_SIZES = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+
+#: Marker for map frames that wait for the next key.
+_NO_KEY = object()
+
+
+class UnpackError(ValueError):
+    """Raised if the stream does not contain valid msgpack data."""
+
+
+class Unpacker:
+    """Resumable msgpack decoder reading from a receive buffer."""
+
+    #: Objects are decoded from the buffer directly.
+    copied = 0
+
+    def __init__(self, buffer=None):
+        #: Data received but not decoded yet, bytes are consumed from it as soon as they are parsed.
+        self.buffer = buffer if buffer is not None else ReceiveBuffer()
+        #: Containers currently being decoded as [container, remaining items, pending map key].
+        self._stack = []
+        #: Number of bytes of the object being decoded that were already consumed from the buffer into its containers.
+        self.partial = 0
+
+    def feed(self, data):
+        """Appends chunk of stream data."""
+        self.buffer.extend(data)
+
+    @property
+    def pending(self):
+        """Number of buffered bytes not yet consumed by the decoder."""
+        return len(self.buffer)
+
+    @property
+    def at_boundary(self):
+        """Is the read position of the buffer at the start of a top level object?"""
+        return not self._stack
+
+    def reset(self):
+        """Drops partially decoded containers."""
+        self._stack = []
+        self.partial = 0
+
+    def unpack(self):
+        """Returns next complete object in stream or NEED_DATA."""
+        buffer = self.buffer
+        data = buffer.data
+        end = buffer.write_pos
+        pos = buffer.read_pos
+        stack = self._stack
+
+        view = memoryview(data)
+        try:
+            while True:
+                if pos >= end:
+                    return self._need_data(pos)
+
+                b = data[pos]
+
+                if b <= 0x7f:
+                    obj = b
+                    pos += 1
+                elif b >= 0xe0:
+                    obj = b - 0x100
+                    pos += 1
+                elif b <= 0x8f:
+                    pos += 1
+                    obj = self._open(stack, {}, b & 0x0f)
+                    if obj is None:
+                        continue
+                elif b <= 0x9f:
+                    pos += 1
+                    obj = self._open(stack, [], b & 0x0f)
+                    if obj is None:
+                        continue
+                elif b <= 0xbf:
+                    n = b & 0x1f
+                    if pos + 1 + n > end:
+                        return self._need_data(pos)
+                    obj = str(view[pos + 1:pos + 1 + n], 'utf-8')
+                    pos += 1 + n
+                elif b == 0xc0:
+                    obj = None
+                    pos += 1
+                elif b == 0xc2:
+                    obj = False
+                    pos += 1
+                elif b == 0xc3:
+                    obj = True
+                    pos += 1
+                elif b in _SCALARS:
+                    fmt, size = _SCALARS[b]
+                    if pos + 1 + size > end:
+                        return self._need_data(pos)
+                    obj = fmt.unpack_from(data, pos + 1)[0] if fmt else data[pos + 1]
+                    pos += 1 + size
+                elif b in _LENGTHS:
+                    fmt, size = _LENGTHS[b]
+                    if pos + 1 + size > end:
+                        return self._need_data(pos)
+                    n = fmt.unpack_from(data, pos + 1)[0] if fmt else data[pos + 1]
+                    start = pos + 1 + size
+
+                    if b >= 0xdc:
+                        # array or map, items follow as separate objects:
+                        pos = start
+                        obj = self._open(stack, [] if b <= 0xdd else {}, n)
+                        if obj is None:
+                            continue
+                    else:
+                        is_ext = 0xc7 <= b <= 0xc9
+                        if is_ext:
+                            # type code precedes ext data:
+                            start += 1
+                        if start + n > end:
+                            return self._need_data(pos)
+                        if b >= 0xd9:
+                            obj = str(view[start:start + n], 'utf-8')
+                        elif is_ext:
+                            obj = umsgpack.Ext(_INT8.unpack_from(data, start - 1)[0], bytes(view[start:start + n]))
+                        else:
+                            obj = bytes(view[start:start + n])
+                        pos = start + n
+                elif b in _FIXEXT_SIZES:
+                    n = _FIXEXT_SIZES[b]
+                    if pos + 2 + n > end:
+                        return self._need_data(pos)
+                    obj = umsgpack.Ext(_INT8.unpack_from(data, pos + 1)[0], bytes(view[pos + 2:pos + 2 + n]))
+                    pos += 2 + n
+                else:
+                    raise UnpackError('Invalid msgpack type byte 0x%02x at stream position %d.' % (b, pos))
+
+                # attach completed object to enclosing containers, which may complete them as well:
+                while stack:
+                    frame = stack[-1]
+                    container = frame[0]
+                    if container.__class__ is list:
+                        container.append(obj)
+                    elif frame[2] is _NO_KEY:
+                        frame[2] = tuple(obj) if obj.__class__ is list else obj
+                        break
+                    else:
+                        container[frame[2]] = obj
+                        frame[2] = _NO_KEY
+
+                    frame[1] -= 1
+                    if frame[1]:
+                        break
+                    stack.pop()
+                    obj = container
+                else:
+                    buffer.consume(pos - buffer.read_pos)
+                    self.partial = 0
+                    return obj
+        finally:
+            view.release()
+
+    def __iter__(self):
+        """Iterator over complete objects in buffer."""
+        obj = self.unpack()
+        while obj is not NEED_DATA:
+            yield obj
+            obj = self.unpack()
+
+    def _need_data(self, pos):
+        """Consumes the data decoded into open containers up to given position, returns NEED_DATA."""
+        count = pos - self.buffer.read_pos
+        self.partial += count
+        self.buffer.consume(count)
+        return NEED_DATA
+
+    def _open(self, stack, container, count):
+        """Starts decoding of container with given number of items, returns it if already complete."""
+        if not count:
+            return container
+        stack.append([container, count, _NO_KEY])
+        return None
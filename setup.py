@@ -40,8 +40,11 @@ def main():
     setup(
             name='jep-python',
             version='0.5.5',
-            packages=find_packages(),
+            packages=find_packages(exclude=['test', 'test.*', 'benchmarks', 'benchmarks.*']),
             install_requires=install_requires,
+            extras_require={
+                'speedups': ['msgpack']
+            },
             tests_require=[
                 'pytest'
             ],
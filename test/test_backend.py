@@ -3,9 +3,13 @@ from unittest import mock
 import datetime
 import pytest
 from jep_py.backend import Backend, State, NoPortFoundError, PORT_RANGE, FrontendConnection, TIMEOUT_BACKEND_ALIVE, TIMEOUT_LAST_MESSAGE
+from jep_py.config import TIMEOUT_SELECT_SEC
 from jep_py.content import SynchronizationResult
-from jep_py.protocol import MessageSerializer
-from jep_py.schema import Shutdown, BackendAlive, CompletionRequest, ContentSync, StaticSyntaxList, StaticSyntax
+from jep_py.framing import EMPTY_FRAME
+from jep_py.delta import block_checksums, resync_message
+from jep_py.protocol import MessageSerializer, FEATURES
+from jep_py.rope import fingerprint
+from jep_py.schema import Shutdown, BackendAlive, CompletionRequest, ContentSync, ContentFingerprint, ContentDelta, DeltaSegment, OutOfSync, StaticSyntaxList, StaticSyntax
 from jep_py.syntax import SyntaxFile
 from test.logconfig import configure_test_logger
 
@@ -14,6 +18,20 @@ def setup_function(function):
     configure_test_logger()
 
 
+def receiving(*chunks):
+    """Mocks socket.recv_into() to deliver the given data chunks and then block."""
+    chunks = list(chunks)
+
+    def recv_into(view):
+        if not chunks:
+            raise BlockingIOError()
+        chunk = chunks.pop(0)
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    return mock.MagicMock(side_effect=recv_into)
+
+
 def test_initial_state():
     backend = Backend()
     assert not backend.serversocket
@@ -56,7 +74,7 @@ def test_bind_and_listen_and_accept_and_disconnect(mock_select_mod, mock_socket_
 
     # mock a connecting frontend:
     mock_select_mod.select = mock.MagicMock(return_value=([server_socket], [], []))
-    client_socket = mock.MagicMock()
+    client_socket = mock.MagicMock(send=mock.MagicMock(side_effect=len))
     server_socket.accept = mock.MagicMock(side_effect=set_backend_state(backend, State.ShutdownPending, [client_socket]))
     backend.start()
     assert backend.state is State.Stopped
@@ -64,12 +82,12 @@ def test_bind_and_listen_and_accept_and_disconnect(mock_select_mod, mock_socket_
     assert client_socket.close.call_count == 1
 
     out, *_ = capsys.readouterr()
-    assert 'JEP service, listening on port 9001' in out
+    assert 'JEP service, listening on port 9001 (features: framed, compressed, compact)' in out
 
 
 def test_receive_shutdown():
     mock_clientsocket = mock.MagicMock()
-    mock_clientsocket.recv = mock.MagicMock(side_effect=[MessageSerializer().serialize(Shutdown()), BlockingIOError])
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(Shutdown()))
     mock_listener1 = mock.MagicMock()
     mock_listener2 = mock.MagicMock()
     backend = Backend([mock_listener1, mock_listener2])
@@ -86,9 +104,22 @@ def test_receive_shutdown():
     assert backend.state is State.ShutdownPending
 
 
+def test_receive_listener_added_to_given_list():
+    mock_clientsocket = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(Shutdown()))
+    listeners = []
+    backend = Backend(listeners)
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+
+    mock_listener = mock.MagicMock()
+    listeners.append(mock_listener)
+    backend._receive(mock_clientsocket)
+    assert mock_listener.on_shutdown.call_count == 1
+
+
 def test_receive_empty():
     mock_clientsocket = mock.MagicMock()
-    mock_clientsocket.recv = mock.MagicMock(return_value=None)
+    mock_clientsocket.recv_into = mock.MagicMock(return_value=0)
     backend = Backend()
     backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
     backend.sockets.append(mock_clientsocket)
@@ -99,7 +130,7 @@ def test_receive_empty():
 
 def test_message_context():
     mock_clientsocket = mock.MagicMock()
-    mock_clientsocket.recv = mock.MagicMock(side_effect=[MessageSerializer().serialize(Shutdown()), BlockingIOError])
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(Shutdown()))
     mock_listener = mock.MagicMock()
     backend = Backend([mock_listener])
     backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
@@ -109,7 +140,9 @@ def test_message_context():
     assert message_context.service is backend
     assert message_context.sock is mock_clientsocket
 
+    mock_clientsocket.send = mock.MagicMock(side_effect=len)
     message_context.send_message(BackendAlive())
+    message_context.flush()
     assert mock_clientsocket.send.call_count == 1
 
 
@@ -120,8 +153,8 @@ def test_backend_alive_cycle(mock_datetime_mod):
 
     assert TIMEOUT_BACKEND_ALIVE > datetime.timedelta(0)
 
-    mock_clientsocket1 = mock.MagicMock()
-    mock_clientsocket2 = mock.MagicMock()
+    mock_clientsocket1 = mock.MagicMock(send=mock.MagicMock(side_effect=len))
+    mock_clientsocket2 = mock.MagicMock(send=mock.MagicMock(side_effect=len))
     backend = Backend()
     backend.sockets = [mock.sentinel.SERVER_SOCKET, mock_clientsocket1, mock_clientsocket2]
     backend.connection[mock_clientsocket1] = FrontendConnection(backend, mock_clientsocket1)
@@ -153,8 +186,8 @@ def test_backend_alive_cycle(mock_datetime_mod):
 def test_frontend_timeout(mock_datetime_mod):
     now = datetime.datetime.now()
     mock_datetime_mod.datetime.now = mock.MagicMock(side_effect=lambda: now)
-    mock_clientsocket1 = mock.MagicMock()
-    mock_clientsocket2 = mock.MagicMock()
+    mock_clientsocket1 = mock.MagicMock(send=mock.MagicMock(side_effect=len))
+    mock_clientsocket2 = mock.MagicMock(send=mock.MagicMock(side_effect=len))
     backend = Backend()
     backend.sockets = [mock.sentinel.SERVER_SOCKET, mock_clientsocket1, mock_clientsocket2]
     backend.connection[mock_clientsocket1] = FrontendConnection(backend, mock_clientsocket1)
@@ -176,7 +209,7 @@ def test_frontend_timeout(mock_datetime_mod):
     assert not mock_clientsocket2.close.called
 
     # now receive a message from one frontend:
-    mock_clientsocket1.recv = mock.MagicMock(side_effect=[MessageSerializer().serialize(CompletionRequest('t', 'g', 10)), BlockingIOError])
+    mock_clientsocket1.recv_into = receiving(MessageSerializer().serialize(CompletionRequest('t', 'g', 10)))
     backend._receive(mock_clientsocket1)
 
     now += 0.2 * TIMEOUT_LAST_MESSAGE
@@ -193,7 +226,7 @@ def test_frontend_timeout(mock_datetime_mod):
 
 def test_propagate_content_sync():
     mock_clientsocket = mock.MagicMock()
-    mock_clientsocket.recv = mock.MagicMock(side_effect=[MessageSerializer().serialize(ContentSync('/path/to/file', 'new content', 17, 21)), BlockingIOError])
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(ContentSync('/path/to/file', 'new content', 17, 21)))
     mock_clientsocket.send = mock.MagicMock()
     mock_listener = mock.MagicMock()
     backend = Backend([mock_listener])
@@ -218,16 +251,22 @@ def test_propagate_content_sync():
 
 def test_propagate_content_sync_out_of_sync():
     mock_clientsocket = mock.MagicMock()
-    mock_clientsocket.recv = mock.MagicMock(side_effect=[MessageSerializer().serialize(ContentSync('/path/to/file', 'new content', 17, 21)), BlockingIOError])
-    mock_clientsocket.send = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(ContentSync('/path/to/file', 'new content', 17, 21)))
+    mock_clientsocket.send = mock.MagicMock(side_effect=len)
     mock_listener = mock.MagicMock()
     backend = Backend([mock_listener])
     mock_content_monitor = mock.MagicMock()
     mock_content_monitor.synchronize = mock.MagicMock(return_value=SynchronizationResult.OutOfSync)
+    # no stale content to send checksums of:
+    mock_content_monitor.__getitem__.return_value = None
     backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket, content_monitor=mock_content_monitor)
 
     backend._receive(mock_clientsocket)
 
+    # response is queued until end of cycle:
+    assert not mock_clientsocket.send.called
+    backend.flush()
+
     # listeners are called:
     assert mock_listener.on_content_sync.call_count == 1
     mock_content_monitor.synchronize.assert_called_once_with('/path/to/file', 'new content', 17, 21)
@@ -237,6 +276,112 @@ def test_propagate_content_sync_out_of_sync():
     assert b'OutOfSync' in arg
 
 
+def test_coalesce_content_sync():
+    serializer = MessageSerializer()
+    data = b''.join(serializer.serialize(msg) for msg in (
+        ContentSync('a', 'hello', 0),
+        ContentSync('a', '!', 5, 5),
+        ContentSync('a', '', 5, 6),
+        ContentSync('a', ' world', 5, 5),
+        ContentSync('b', 'other', 0),
+        ContentSync('a', 'H', 0, 1),
+        Shutdown(),
+        ContentSync('a', 'x', 20, 20),
+        ContentSync('a', 'y', 21, 21),
+    ))
+    mock_clientsocket = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(data)
+    mock_listener = mock.MagicMock()
+    backend = Backend([mock_listener])
+    backend.connection[mock_clientsocket] = connection = FrontendConnection(backend, mock_clientsocket)
+
+    backend._receive(mock_clientsocket)
+
+    # consecutive edits of the same file are merged unless disjoint or out of sync:
+    syncs = [(c[0][0].file, c[0][0].data, c[0][0].start, c[0][0].end) for c in mock_listener.on_content_sync.call_args_list]
+    assert syncs == [('a', 'hello world', 0, 0), ('b', 'other', 0, None), ('a', 'H', 0, 1), ('a', 'x', 20, 20),
+                     ('a', 'y', 21, 21)]
+    assert connection.content_monitor['a'] == 'Hello world'
+    assert connection.content_monitor.version('a') == 2
+    assert mock_listener.on_shutdown.call_count == 1
+
+
+def test_content_fingerprint():
+    serializer = MessageSerializer()
+    mock_clientsocket = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(b''.join(serializer.serialize(msg) for msg in (
+        ContentSync('a', 'content', 0),
+        ContentFingerprint('a', fingerprint('content')),
+        ContentFingerprint('a', fingerprint('other')),
+        ContentFingerprint('b', 0),
+        ContentFingerprint('a', None),
+        ContentFingerprint('c', None),
+    )))
+    backend = Backend()
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+    backend.send_message = mock.MagicMock()
+
+    backend._receive(mock_clientsocket)
+
+    # only mismatches are answered:
+    sent = [c[0][1] for c in backend.send_message.call_args_list]
+    assert [(type(msg), msg.file) for msg in sent] == [(OutOfSync, 'a'), (OutOfSync, 'b'), (OutOfSync, 'a'), (OutOfSync, 'c')]
+
+
+def test_resync_by_delta():
+    stale = 'set(VAR value)\n' * 1000
+    current = stale[:5000] + 'edited' + stale[5100:]
+    backend = Backend()
+    connection = FrontendConnection(backend, mock.MagicMock())
+    connection.content_monitor.synchronize('a', stale, 0)
+    frontend_serializer = MessageSerializer()
+    frontend_serializer.use_features(FEATURES)
+    backend.send_message = mock.MagicMock()
+
+    # backend sends checksums of its stale content:
+    backend.on_content_sync(ContentSync('a', 'x', 20000, 20001), connection)
+    out_of_sync = backend.send_message.call_args[0][1]
+    assert out_of_sync.blockSize == 1024
+    assert out_of_sync.blocks == block_checksums(stale, 1024)
+    out_of_sync = frontend_serializer.deserialize(frontend_serializer.serialize(out_of_sync))
+
+    # frontend answers with changed blocks only:
+    content_delta = resync_message('a', current, out_of_sync)
+    assert sum(len(segment.data) for segment in content_delta.segments) < 2 * 1024
+    backend.on_content_delta(content_delta, connection)
+    assert connection.content_monitor['a'] == current
+    assert backend.send_message.call_count == 1
+
+    # a delta not matching the fingerprint requests the complete content:
+    content_delta.fingerprint += 1
+    backend.on_content_delta(content_delta, connection)
+    assert connection.content_monitor['a'] == current
+    out_of_sync = backend.send_message.call_args[0][1]
+    assert out_of_sync.file == 'a'
+    assert not out_of_sync.blocks
+
+
+def test_malformed_delta_requests_content():
+    mock_clientsocket = mock.MagicMock()
+    serializer = MessageSerializer()
+    mock_clientsocket.recv_into = receiving(b''.join(serializer.serialize(msg) for msg in (
+        ContentDelta('a', 1024, [DeltaSegment('', 1, -1)], 0, ''),
+        ContentDelta('a', 1024, None, None, None),
+    )))
+    backend = Backend()
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+    backend.connection[mock_clientsocket].content_monitor.synchronize('a', 'x' * 5000, 0)
+    backend.send_message = mock.MagicMock()
+
+    backend._receive(mock_clientsocket)
+
+    sent = [c[0][1] for c in backend.send_message.call_args_list]
+    assert len(sent) == 2
+    for out_of_sync in sent:
+        assert isinstance(out_of_sync, OutOfSync)
+        assert not out_of_sync.blocks
+
+
 def test_static_syntax_registration():
     mock_syntax_fileset = mock.MagicMock()
     backend = Backend(syntax_fileset=mock_syntax_fileset)
@@ -282,3 +427,104 @@ def test_on_static_syntax_request_found():
     assert syntax.name == mock.sentinel.NAME1
     assert syntax.fileExtensions is mock.sentinel.EXTENSIONS
     assert syntax.definition is mock.sentinel.DEFINITION
+
+
+@mock.patch('jep_py.backend.datetime')
+def test_send_batch_window(mock_datetime_mod):
+    now = datetime.datetime.now()
+    mock_datetime_mod.datetime.now = mock.MagicMock(side_effect=lambda: now)
+    mock_clientsocket = mock.MagicMock(send=mock.MagicMock(side_effect=len), sendmsg=mock.MagicMock(side_effect=lambda chunks: sum(len(c) for c in chunks)))
+    backend = Backend(send_batch_window=datetime.timedelta(milliseconds=10))
+    backend.sockets = [mock.sentinel.SERVER_SOCKET, mock_clientsocket]
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+    backend.ts_alive_sent = now
+
+    backend.connection[mock_clientsocket].send_message(BackendAlive())
+    backend.connection[mock_clientsocket].send_message(BackendAlive())
+
+    # messages are held back during batch window, select wakes up in time:
+    backend._cyclic()
+    assert not mock_clientsocket.send.called and not mock_clientsocket.sendmsg.called
+    assert backend._select_timeout() == 0.01
+
+    # and sent with a single write afterwards:
+    now += datetime.timedelta(milliseconds=10)
+    assert backend._sockets_to_flush() == [mock_clientsocket]
+    backend._cyclic()
+    assert mock_clientsocket.sendmsg.call_count == 1
+    assert not backend.connection[mock_clientsocket].send_queue
+
+
+@mock.patch('jep_py.backend.select')
+def test_blocked_send_queue_flushed_when_writable(mock_select_mod):
+    mock_clientsocket = mock.MagicMock(send=mock.MagicMock(side_effect=BlockingIOError))
+    backend = Backend()
+    backend.sockets = [mock.sentinel.SERVER_SOCKET, mock_clientsocket]
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+    backend.state = State.Running
+    backend.ts_alive_sent = datetime.datetime.now()
+
+    # frontend does not read, so queued data stays due:
+    backend.connection[mock_clientsocket].send_message(BackendAlive())
+    backend._cyclic()
+    assert backend.connection[mock_clientsocket].send_queue
+
+    # select waits for the socket to become writable instead of returning immediately:
+    assert backend._select_timeout() == TIMEOUT_SELECT_SEC
+
+    def select(readable, writable, exceptional, timeout):
+        assert writable == [mock_clientsocket]
+        assert timeout == TIMEOUT_SELECT_SEC
+        mock_clientsocket.send.side_effect = len
+        backend.state = State.Stopped
+        return [], [mock_clientsocket], []
+
+    mock_select_mod.select = mock.MagicMock(side_effect=select)
+    backend._run()
+    assert not backend.connection[mock_clientsocket].send_queue
+
+
+def test_receive_framed_enables_features():
+    mock_clientsocket = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(EMPTY_FRAME)
+    backend = Backend()
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket, serializer=MessageSerializer(codec='umsgpack'))
+
+    backend._receive(mock_clientsocket)
+
+    serializer = backend.connection[mock_clientsocket].serializer
+    assert serializer.framed
+    assert serializer.compress_threshold is not None
+
+
+def test_receive_subscribed_listener():
+    mock_clientsocket = mock.MagicMock()
+    mock_clientsocket.recv_into = receiving(MessageSerializer().serialize(Shutdown()) + MessageSerializer().serialize(CompletionRequest('file', 10)))
+    mock_subscriber = mock.MagicMock()
+    backend = Backend()
+    backend.subscribe(mock_subscriber, CompletionRequest)
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket)
+
+    backend._receive(mock_clientsocket)
+
+    # subscriber only receives messages of selected type:
+    assert not mock_subscriber.on_shutdown.called
+    assert mock_subscriber.on_completion_request.call_count == 1
+
+
+def test_receive_lazy_message_invalid_attribute_dropped():
+    mock_clientsocket = mock.MagicMock()
+    serializer = MessageSerializer()
+    invalid = serializer.codec.dumps({'_message': 'CompletionRequest', 'file': 'file', 'pos': 'not a number', 'token': 'token'})
+    mock_clientsocket.recv_into = receiving(invalid + serializer.serialize(CompletionRequest('file', 10)) + serializer.serialize(Shutdown()))
+    mock_listener = mock.MagicMock()
+    backend = Backend([mock_listener], lazy_messages=True)
+    backend.connection[mock_clientsocket] = FrontendConnection(backend, mock_clientsocket, serializer=MessageSerializer(lazy=True))
+
+    # invalid attribute is only detected when listener accesses it:
+    mock_listener.on_completion_request.side_effect = lambda msg, context: msg.pos
+    backend._receive(mock_clientsocket)
+
+    assert mock_listener.on_completion_request.call_count == 2
+    assert mock_listener.on_shutdown.call_count == 1
+    assert backend.connection[mock_clientsocket].serializer.messages_dropped == 1
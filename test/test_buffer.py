@@ -0,0 +1,146 @@
+from unittest import mock
+from jep_py.buffer import ReceiveBuffer, SendQueue
+
+
+def socket_delivering(*chunks):
+    """Mock socket whose recv_into() returns the given chunks."""
+    chunks = list(chunks)
+
+    def recv_into(view):
+        chunk = chunks.pop(0)
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    sock = mock.MagicMock()
+    sock.recv_into = mock.MagicMock(side_effect=recv_into)
+    return sock
+
+
+def test_receive_buffer_recv_into():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    sock = socket_delivering(b'abc', b'defg')
+
+    assert buffer.recv_into(sock) == 3
+    assert buffer.recv_into(sock) == 4
+    assert len(buffer) == 7
+    assert bytes(buffer.view()) == b'abcdefg'
+    assert buffer.capacity == 16
+
+
+def test_receive_buffer_consume_resets_offsets_when_empty():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    buffer.extend(b'abcdef')
+    buffer.consume(2)
+    assert bytes(buffer.view()) == b'cdef'
+    assert buffer.read_pos == 2
+
+    buffer.consume(4)
+    assert not buffer
+    assert buffer.read_pos == buffer.write_pos == 0
+
+
+def test_receive_buffer_compacts_in_place():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    data = buffer.data
+    buffer.extend(b'0123456789ab')
+    buffer.consume(10)
+
+    # only 4 bytes free at the end, but enough space after moving the remaining 2 bytes to the front:
+    buffer.reserve(8)
+    assert buffer.data is data
+    assert buffer.read_pos == 0
+    assert bytes(buffer.view()) == b'ab'
+
+
+def test_receive_buffer_grows():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    buffer.extend(b'0123456789')
+    buffer.consume(1)
+    buffer.extend(b'x' * 20)
+
+    assert buffer.capacity >= 29
+    assert bytes(buffer.view()) == b'123456789' + b'x' * 20
+
+
+def test_receive_buffer_shrinks_when_drained():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    buffer.extend(b'x' * 40)
+    buffer.consume(40)
+    # moderate growth is kept:
+    assert buffer.capacity >= 40
+
+    buffer.extend(b'x' * 100)
+    buffer.consume(50)
+    assert buffer.capacity >= 100
+    buffer.consume(50)
+    assert buffer.capacity == 16
+
+    buffer.extend(b'x' * 100)
+    buffer.clear()
+    assert buffer.capacity == 16
+
+
+def test_receive_buffer_grows_while_view_exported():
+    buffer = ReceiveBuffer(capacity=4, chunk_size=4)
+    buffer.extend(b'abc')
+    view = buffer.view()
+    buffer.extend(b'defgh')
+
+    assert bytes(view) == b'abc'
+    assert bytes(buffer.view()) == b'abcdefgh'
+
+
+def test_send_queue_single_chunk_uses_send():
+    sock = mock.MagicMock(send=mock.MagicMock(side_effect=len))
+    queue = SendQueue()
+    queue.append(b'abc', mock.sentinel.NOW)
+    assert len(queue) == 3
+    assert queue.ts_oldest is mock.sentinel.NOW
+
+    assert queue.flush(sock) == 3
+    sock.send.assert_called_once_with(b'abc')
+    assert not sock.sendmsg.called
+    assert not queue
+    assert queue.ts_oldest is None
+
+
+def test_send_queue_vectored_write():
+    sock = mock.MagicMock(sendmsg=mock.MagicMock(side_effect=lambda chunks: sum(len(c) for c in chunks)))
+    queue = SendQueue()
+    queue.append(b'abc', mock.sentinel.NOW1)
+    queue.append(b'de', mock.sentinel.NOW2)
+    assert queue.ts_oldest is mock.sentinel.NOW1
+
+    assert queue.flush(sock) == 5
+    sock.sendmsg.assert_called_once_with([b'abc', b'de'])
+    assert not sock.send.called
+    assert not queue
+
+
+def test_send_queue_partial_send():
+    sock = mock.MagicMock(sendmsg=mock.MagicMock(side_effect=[4, BlockingIOError]))
+    queue = SendQueue()
+    queue.append(b'abc')
+    queue.append(b'def')
+    queue.append(b'g')
+
+    # only part of the data is accepted by socket:
+    assert queue.flush(sock) == 4
+    assert len(queue) == 3
+    assert bytes(queue.chunks[0]) == b'ef'
+
+    # rest is sent with next flush:
+    sock.sendmsg = mock.MagicMock(side_effect=lambda chunks: sum(len(c) for c in chunks))
+    assert queue.flush(sock) == 3
+    assert [bytes(c) for c in sock.sendmsg.call_args[0][0]] == [b'ef', b'g']
+    assert not queue
+
+
+def test_send_queue_without_sendmsg_joins_chunks():
+    sock = mock.MagicMock(spec=['send'], send=mock.MagicMock(side_effect=len))
+    queue = SendQueue()
+    queue.append(b'abc')
+    queue.append(b'de')
+
+    assert queue.flush(sock) == 5
+    sock.send.assert_called_once_with(b'abcde')
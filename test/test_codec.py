@@ -0,0 +1,118 @@
+import pytest
+from jep_py.buffer import ReceiveBuffer
+from jep_py.codec import get_codec, available_codecs, register_codec, UMsgpackCodec, CMsgpackCodec, JsonCodec, msgpack
+from jep_py.protocol import MessageSerializer
+from jep_py.serializer import TextPayload
+from jep_py.schema import ProblemUpdate, FileProblems, Problem, ProblemColumns, Severity, CompletionResponse, CompletionOption, SemanticType, ContentSync
+from jep_py.unpacker import NEED_DATA
+
+
+def test_default_codec_prefers_c_extension():
+    expected = CMsgpackCodec if msgpack else UMsgpackCodec
+    assert isinstance(get_codec(), expected)
+    assert available_codecs()[-2:] == ['umsgpack', 'json']
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec('unknown')
+
+
+def test_register_codec():
+    class MyCodec(JsonCodec):
+        name = 'my'
+
+    register_codec(MyCodec)
+    try:
+        assert isinstance(get_codec('my'), MyCodec)
+    finally:
+        from jep_py import codec
+        del codec._codecs['my']
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_codec_streaming_contract(name):
+    codec = get_codec(name)
+    buffer = ReceiveBuffer()
+    unpacker = codec.unpacker(buffer)
+    objs = [{'a': 1, 'b': ['x', None, True]}, {'_message': 'Shutdown'}, 'text']
+    data = b''.join(codec.dumps(obj) for obj in objs)
+
+    assert unpacker.unpack() is NEED_DATA
+    for i in range(len(data)):
+        buffer.extend(data[i:i + 1])
+    assert list(unpacker) == objs
+    assert unpacker.unpack() is NEED_DATA
+    assert unpacker.pending == 0
+
+
+@pytest.mark.parametrize('name', available_codecs())
+@pytest.mark.parametrize('compact', [False, True])
+def test_codec_message_roundtrip(name, compact):
+    serializer = MessageSerializer(codec=name)
+    serializer.compact = compact
+    messages = [
+        ProblemUpdate([FileProblems('thefile', [Problem('themsg', Severity.info, 99)], 50, 10, 20)], True),
+        CompletionResponse(11, 12, True, [CompletionOption('display', 'desc', semantics=SemanticType.string)], 'token'),
+        ContentSync('file', 'äöü', 3),
+    ]
+
+    for message in messages:
+        serializer.enque_data(serializer.serialize(message))
+
+    for message, received in zip(messages, serializer):
+        assert type(received) is type(message)
+        assert serializer.serialize(received) == serializer.serialize(message)
+
+
+@pytest.mark.skipif(not msgpack, reason='C accelerated msgpack not installed.')
+def test_c_and_python_msgpack_compatible():
+    message = ProblemUpdate([FileProblems('thefile', [Problem('themsg', Severity.info, 99)] * 20)], True)
+    c_serializer = MessageSerializer(codec='msgpack')
+    py_serializer = MessageSerializer(codec='umsgpack')
+
+    py_serializer.enque_data(c_serializer.serialize(message))
+    c_serializer.enque_data(py_serializer.serialize(message))
+
+    assert py_serializer.serialize(next(iter(py_serializer))) == py_serializer.serialize(message)
+    assert c_serializer.serialize(next(iter(c_serializer))) == c_serializer.serialize(message)
+
+    c_serializer.compact = py_serializer.compact = True
+    assert c_serializer.serialize(message) == py_serializer.serialize(message)
+
+
+@pytest.mark.parametrize('name', available_codecs())
+@pytest.mark.parametrize('compact', [False, True])
+def test_codec_problem_columns(name, compact):
+    sender = MessageSerializer(codec=name)
+    sender.compact = compact
+    problems = [Problem('msg %d' % (i % 3), Severity.warn, i) for i in range(10)] + [Problem(None, Severity.error, 10)]
+    columns = ProblemColumns.from_items(problems)
+
+    # columns are encoded like lists of problems unless the peer supports the compact form:
+    data = sender.serialize(ProblemUpdate([FileProblems('file', columns)]))
+    assert (data == sender.serialize(ProblemUpdate([FileProblems('file', problems)]))) is not compact
+
+    receiver = MessageSerializer(codec=name)
+    receiver.enque_data(data)
+    received = receiver.dequeue_message().fileProblems[0].problems
+    assert isinstance(received, ProblemColumns) is compact
+    assert [(p.message, p.severity, p.line) for p in received] == list(columns.rows())
+
+
+@pytest.mark.parametrize('name', available_codecs())
+@pytest.mark.parametrize('compact', [False, True])
+def test_codec_text_payload(name, compact):
+    sender = MessageSerializer(codec=name)
+    sender.compact = compact
+    text = 'Grüße\n' * 100
+
+    # payloads are sent as strings unless the peer supports the compact form:
+    data = sender.serialize(ContentSync('file', TextPayload.from_text(text)))
+    assert (data == sender.serialize(ContentSync('file', text))) is not (compact and name != 'json')
+
+    receiver = MessageSerializer(codec=name)
+    receiver.enque_data(data)
+    received = receiver.dequeue_message().data
+    assert isinstance(received, TextPayload) is (compact and name != 'json')
+    assert received == text
@@ -1,11 +1,18 @@
 """Test of content synchronization of KEP backend."""
+import random
 from unittest import mock
-from jep_py.content import ContentMonitor, SynchronizationResult, NewlineMode
+import pytest
+from jep_py import content
+from jep_py.content import ContentMonitor, SynchronizationResult, NewlineMode, SpillFile, FULL_REPARSE, compose_edits, merge_edits
+from jep_py.delta import content_digest
+from jep_py.rope import fingerprint
+from jep_py.serializer import TextPayload
 
 
 def test_content_empty():
     monitor = ContentMonitor()
     assert monitor[mock.sentinel.UNKNOWN_FILE] is None
+    assert monitor.fingerprint(mock.sentinel.UNKNOWN_FILE) is None
 
 
 def test_initial_sync():
@@ -42,6 +49,183 @@ def test_append():
     assert monitor[mock.sentinel.FILEPATH] == 'This is the string. Really!'
 
 
+def test_large_file_edits():
+    monitor = ContentMonitor()
+    text = 'line of text\n' * 100000
+    monitor.synchronize(mock.sentinel.FILEPATH, text, 0)
+    assert monitor[mock.sentinel.FILEPATH] is monitor[mock.sentinel.FILEPATH]
+
+    for i, c in enumerate('typed'):
+        monitor.synchronize(mock.sentinel.FILEPATH, c, 500000 + i, 500000 + i)
+    monitor.synchronize(mock.sentinel.FILEPATH, '', 0, 13)
+
+    expected = text[13:500000] + 'typed' + text[500000:]
+    assert monitor.rope(mock.sentinel.FILEPATH)[499980:500000] == expected[499980:500000]
+    assert monitor[mock.sentinel.FILEPATH] == expected
+
+
+def test_line_index():
+    monitor = ContentMonitor()
+    monitor.synchronize(mock.sentinel.FILEPATH, 'first\nsecond\n\nfourth', 0)
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 0) == (1, 0)
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 8) == (2, 2)
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 13) == (3, 0)
+    assert monitor.line_col_to_offset(mock.sentinel.FILEPATH, 2, 2) == 8
+    assert monitor.line_col_to_offset(mock.sentinel.FILEPATH, 4, 6) == 20
+    assert monitor.line(mock.sentinel.FILEPATH, 4) == 'fourth'
+
+    # index follows updates:
+    monitor.synchronize(mock.sentinel.FILEPATH, 'new\n', 6, 6)
+    assert monitor.line(mock.sentinel.FILEPATH, 3) == 'second'
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 12) == (3, 2)
+
+    with pytest.raises(IndexError):
+        monitor.line_col_to_offset(mock.sentinel.FILEPATH, 1, 6)
+    with pytest.raises(IndexError):
+        monitor.line(mock.sentinel.FILEPATH, 6)
+    with pytest.raises(KeyError):
+        monitor.line(mock.sentinel.UNKNOWN_FILE, 1)
+
+
+def test_line_index_carriage_return():
+    monitor = ContentMonitor()
+    monitor.synchronize(mock.sentinel.FILEPATH, 'first\rsecond\r\nthird', 0)
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 8) == (2, 2)
+    assert monitor.offset_to_line_col(mock.sentinel.FILEPATH, 14) == (3, 0)
+    assert monitor.line_col_to_offset(mock.sentinel.FILEPATH, 3, 1) == 15
+    assert monitor.line(mock.sentinel.FILEPATH, 2) == 'second'
+
+    # column of line end, but not of the '\n' following its '\r':
+    assert monitor.line_col_to_offset(mock.sentinel.FILEPATH, 2, 6) == 12
+    with pytest.raises(IndexError):
+        monitor.line_col_to_offset(mock.sentinel.FILEPATH, 2, 7)
+
+
+def test_snapshots():
+    monitor = ContentMonitor()
+    assert monitor.version(mock.sentinel.FILEPATH) == 0
+    assert monitor.snapshot(mock.sentinel.FILEPATH) is None
+
+    monitor.synchronize(mock.sentinel.FILEPATH, 'first\nversion', 0)
+    first = monitor.snapshot(mock.sentinel.FILEPATH)
+    assert first.version == monitor.version(mock.sentinel.FILEPATH) == 1
+    assert monitor.is_current(first)
+
+    monitor.synchronize(mock.sentinel.FILEPATH, 'second', 0, 5)
+    assert monitor.synchronize(mock.sentinel.FILEPATH, 'x', 100) == SynchronizationResult.OutOfSync
+    second = monitor.snapshot(mock.sentinel.FILEPATH)
+    assert second.version == 2
+    assert not monitor.is_current(first)
+
+    # earlier snapshot is not affected by updates:
+    assert first.text == 'first\nversion'
+    assert first.line(2) == 'version'
+    assert second.text == 'second\nversion'
+    assert second[:6] == 'second'
+    assert second.offset_to_line_col(8) == (2, 1)
+
+
+def test_character_budget_spills_least_recently_used(tmpdir):
+    monitor = ContentMonitor(character_budget=250, spill_directory=str(tmpdir))
+    for name in 'abc':
+        monitor.synchronize(name, name * 98 + '\r\n', 0)
+
+    assert monitor.resident_characters == 200
+    assert monitor.spilled_bytes == 100
+    assert monitor.evictions == 1
+    assert monitor.version('a') == 1
+    assert monitor.newline_mode('a') == NewlineMode.RN
+    assert monitor.fingerprint('a') == fingerprint('a' * 98 + '\r\n')
+    assert monitor.resident_characters == 200
+
+    # reading a back moves b, which was used least recently, to spill file:
+    first_a = monitor.snapshot('a')
+    assert first_a.text == 'a' * 98 + '\r\n'
+    assert monitor.reloads == 1
+    assert monitor.evictions == 2
+
+    # flat text of b counts against budget as well, so a is moved to spill file:
+    monitor.synchronize('b', 'B', 0, 1)
+    assert monitor['b'] == 'B' + 'b' * 97 + '\r\n'
+    assert monitor.version('b') == 2
+    assert monitor.reloads == 2
+    assert monitor.spilled_bytes == 200
+
+    # snapshots stay valid and current while spilled:
+    monitor.synchronize('c', 'C', 0, 1)
+    assert monitor.version('a') == 1
+    assert monitor.spilled_bytes == 200
+    assert monitor.is_current(first_a)
+    assert monitor.line('a', 1) == 'a' * 98
+    assert monitor.is_current(first_a)
+
+    monitor.close()
+    assert monitor['a'] is None
+    assert monitor.spilled_bytes == 0
+
+
+def test_character_budget_counts_flat_text(tmpdir):
+    monitor = ContentMonitor(character_budget=350, spill_directory=str(tmpdir))
+    for name in 'abc':
+        monitor.synchronize(name, name * 100, 0)
+    assert monitor.resident_characters == 300
+
+    # flat text built for c counts as well, so a is moved to spill file:
+    assert monitor['c'] == 'c' * 100
+    assert monitor.resident_characters == 300
+    assert monitor.evictions == 1
+
+    # flat text of c is dropped with update:
+    monitor.synchronize('c', 'C', 0, 1)
+    assert monitor.resident_characters == 200
+
+    # flat text built through snapshot is counted on next access:
+    monitor.snapshot('b').text
+    assert monitor.resident_characters == 200
+    monitor.length('b')
+    assert monitor.resident_characters == 300
+    assert monitor.evictions == 1
+
+
+def test_spill_lone_surrogate(tmpdir):
+    monitor = ContentMonitor(character_budget=10, spill_directory=str(tmpdir))
+    monitor.synchronize('a', 'lone \ud800', 0)
+    monitor.synchronize('b', 'b' * 10, 0)
+    assert monitor.evictions == 1
+    assert monitor['a'] == 'lone \ud800'
+
+
+def test_spill_file(tmpdir):
+    spill = SpillFile(str(tmpdir))
+    spill.put('x', ['äöü', '\n' * 10])
+    spill.put('empty', [])
+    spill.put('y', ['y' * 100])
+    assert 'x' in spill
+    assert spill.used == spill.size == 116
+
+    assert spill.take('empty') == ''
+    assert spill.take('x') == 'äöü' + '\n' * 10
+    assert 'x' not in spill
+    assert spill.used == 100
+    assert spill.size == 116
+
+    # compacted once more than half of the file is unused:
+    with mock.patch.object(content, 'SPILL_COMPACTION_MIN', 10):
+        spill.put('z', ['z' * 90])
+        assert spill.take('z') == 'z' * 90
+    assert spill.size == spill.used == 100
+    assert spill.take('y') == 'y' * 100
+    assert spill.size == 0
+    spill.close()
+
+
+def test_text_payload():
+    monitor = ContentMonitor()
+    monitor.synchronize(mock.sentinel.FILEPATH, TextPayload('Grüße.'.encode('utf-8')), 0)
+    assert monitor.synchronize(mock.sentinel.FILEPATH, TextPayload(memoryview(b' Bye!')), 6, 6) == SynchronizationResult.Updated
+    assert monitor[mock.sentinel.FILEPATH] == 'Grüße. Bye!'
+
+
 def test_out_of_sync():
     monitor = ContentMonitor()
     monitor.synchronize(mock.sentinel.FILEPATH, 'This is the string.', 0)
@@ -69,6 +253,27 @@ def test_newline_mode_detect():
     assert NewlineMode.detect('\rHello\n') == NewlineMode.R | NewlineMode.N
     assert NewlineMode.detect('\r\nHello\n') == NewlineMode.RN | NewlineMode.N
     assert NewlineMode.detect('\r\nHel\rlo\n') == NewlineMode.RN | NewlineMode.N | NewlineMode.R == NewlineMode.All
+    assert NewlineMode.detect('\r\r\n') == NewlineMode.R | NewlineMode.RN
+
+
+def test_newline_mode_tracked_incrementally():
+    rng = random.Random(4711)
+    monitor = ContentMonitor()
+    text = ''.join(rng.choice('ab\r\n') for _ in range(1000))
+    monitor.synchronize(mock.sentinel.FILEPATH, text, 0)
+
+    for _ in range(500):
+        start = rng.randint(0, len(text))
+        end = min(len(text), start + rng.choice((0, 1, 2, 10)))
+        data = ''.join(rng.choice('ab\r\n') for _ in range(rng.choice((0, 1, 2, 5))))
+        text = text[:start] + data + text[end:]
+        with mock.patch.object(NewlineMode, 'count', wraps=NewlineMode.count) as mock_count:
+            monitor.synchronize(mock.sentinel.FILEPATH, data, start, end)
+        # only the edited range and its neighbours were counted:
+        assert all(len(args[0]) <= 12 for args, _ in mock_count.call_args_list)
+        assert monitor.snapshot(mock.sentinel.FILEPATH).newline_counts == NewlineMode.count(text)
+        assert monitor.newline_mode(mock.sentinel.FILEPATH) == NewlineMode.detect(text)
+        assert monitor.fingerprint(mock.sentinel.FILEPATH) == fingerprint(text)
 
 
 def test_newline_mode_open_mode():
@@ -76,3 +281,108 @@ def test_newline_mode_open_mode():
     assert NewlineMode.open_newline_mode(NewlineMode.R) == '\r'
     assert NewlineMode.open_newline_mode(NewlineMode.RN) == '\r\n'
     assert NewlineMode.open_newline_mode(NewlineMode.All) == ''
+
+
+def test_merge_edits():
+    # typing and deleting:
+    assert merge_edits(10, ('a', 3, 3), ('b', 4, 4)) == ('ab', 3, 3)
+    assert merge_edits(10, ('ab', 3, 3), ('', 4, 5)) == ('a', 3, 3)
+    assert merge_edits(10, ('', 5, 6), ('', 4, 5)) == ('', 4, 6)
+    assert merge_edits(10, ('xyz', 0, None), ('_', 1, 2)) == ('x_z', 0, 10)
+
+    # disjoint or invalid:
+    assert merge_edits(10, ('a', 3, 3), ('b', 5, 5)) is None
+    assert merge_edits(10, ('a', 3, 3), ('b', 1, 2)) is None
+    assert merge_edits(10, ('a', 11, 11), ('b', 11, 12)) is None
+    assert merge_edits(10, ('a', 3, 3), ('b', 4, 12)) is None
+
+
+def test_merge_edits_equivalent():
+    rng = random.Random(4711)
+    for _ in range(2000):
+        text = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 10)))
+        edits = []
+        for _ in range(2):
+            start = rng.randint(0, 12)
+            end = rng.choice((None, start, start + 1, start + 3))
+            edits.append((rng.choice(('', 'x', 'yz')), start, end))
+
+        merged = merge_edits(len(text), *edits)
+        if merged is None:
+            continue
+
+        separate = ContentMonitor()
+        separate.synchronize(mock.sentinel.FILEPATH, text, 0)
+        for edit in edits:
+            assert separate.synchronize(mock.sentinel.FILEPATH, *edit) is SynchronizationResult.Updated
+        combined = ContentMonitor()
+        combined.synchronize(mock.sentinel.FILEPATH, text, 0)
+        assert combined.synchronize(mock.sentinel.FILEPATH, *merged) is SynchronizationResult.Updated
+        assert combined[mock.sentinel.FILEPATH] == separate[mock.sentinel.FILEPATH]
+
+
+def test_compose_edits():
+    assert compose_edits([]) == []
+    # typing and deleting again:
+    assert compose_edits([(5, 5, 1), (6, 6, 1), (7, 7, 1), (7, 8, 0)]) == [(5, 5, 2)]
+    assert compose_edits([(5, 5, 1), (5, 6, 0)]) == []
+    # changes before other changes shift them:
+    assert compose_edits([(10, 12, 5), (0, 1, 0), (20, 20, 1)]) == [(0, 1, 0), (10, 12, 5), (18, 18, 1)]
+    # touching changes are merged:
+    assert compose_edits([(10, 12, 5), (5, 10, 0)]) == [(5, 12, 5)]
+    assert compose_edits([(10, 12, 5), (2, 4, 0), (13, 15, 1)]) == [(2, 4, 0), (10, 14, 6)]
+
+
+def test_compose_edits_equivalent():
+    rng = random.Random(4711)
+    for _ in range(500):
+        original = text = ''.join(rng.choice('abcdefgh') for _ in range(rng.randint(0, 30)))
+        edits = []
+        for _ in range(rng.randint(1, 6)):
+            start = rng.randint(0, len(text))
+            end = rng.randint(start, min(len(text), start + 5))
+            data = ''.join(rng.choice('XYZ') for _ in range(rng.randint(0, 4)))
+            text = text[:start] + data + text[end:]
+            edits.append((start, end, len(data)))
+
+        # text is original text with changed ranges replaced by parts of the resulting text:
+        composed = []
+        pos = shift = 0
+        for start, end, length in compose_edits(edits):
+            assert pos <= start <= end
+            composed.append(original[pos:start])
+            composed.append(text[start + shift:start + shift + length])
+            shift += length - (end - start)
+            pos = end
+        composed.append(original[pos:])
+        assert ''.join(composed) == text
+
+
+def test_edits_since():
+    monitor = ContentMonitor(edit_log_size=3)
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 0) == FULL_REPARSE
+
+    monitor.synchronize(mock.sentinel.FILEPATH, 'Hello World', 0)
+    analyzed = monitor.snapshot(mock.sentinel.FILEPATH)
+    assert monitor.edits_since(mock.sentinel.FILEPATH, analyzed.version) == []
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 0) == FULL_REPARSE
+
+    monitor.synchronize(mock.sentinel.FILEPATH, ',', 5, 5)
+    monitor.synchronize(mock.sentinel.FILEPATH, 'w', 7, 8)
+    assert monitor[mock.sentinel.FILEPATH] == 'Hello, world'
+    assert monitor.edits_since(mock.sentinel.FILEPATH, analyzed.version) == [(5, 5, 1), (6, 7, 1)]
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 2) == [(7, 8, 1)]
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 4) == FULL_REPARSE
+
+    # log is truncated:
+    monitor.synchronize(mock.sentinel.FILEPATH, '!', 12, 12)
+    monitor.synchronize(mock.sentinel.FILEPATH, '!', 13, 13)
+    assert monitor.edits_since(mock.sentinel.FILEPATH, analyzed.version) == FULL_REPARSE
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 2) == [(7, 8, 1), (12, 12, 2)]
+
+    # content replaced as a whole:
+    monitor.apply_delta(mock.sentinel.FILEPATH, 5, [('Bye', 0, 0)], fingerprint('Bye'), content_digest(('Bye',)))
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 5) == FULL_REPARSE
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 6) == []
+    monitor.synchronize(mock.sentinel.FILEPATH, '!', 3, 3)
+    assert monitor.edits_since(mock.sentinel.FILEPATH, 6) == [(3, 3, 1)]
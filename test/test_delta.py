@@ -0,0 +1,128 @@
+import random
+import pytest
+from unittest import mock
+from jep_py.content import ContentMonitor, SynchronizationResult
+from jep_py.delta import block_size, block_checksums, content_digest, delta, resync_message
+from jep_py.rope import fingerprint
+from jep_py.schema import ContentSync, ContentDelta, OutOfSync
+
+
+def edited(text, rng, edits):
+    for _ in range(edits):
+        start = rng.randint(0, len(text))
+        end = min(len(text), start + rng.choice((0, 1, 10, 500)))
+        text = text[:start] + ''.join(rng.choice('xyz\n') for _ in range(rng.choice((0, 1, 20, 700)))) + text[end:]
+    return text
+
+
+def test_block_checksums():
+    assert block_size(100) == block_size(0) == 1024
+    assert block_size(10 ** 8) == 10000
+
+    assert block_checksums('abcdefg', 3) == [fingerprint('abc'), fingerprint('def')]
+    assert block_checksums('ab', 3) == []
+
+
+def test_delta_unchanged():
+    text = 'line\n' * 1000
+    assert delta(text, 100, block_checksums(text, 100)) == [('', 0, 50)]
+    assert delta(text + 'tail', 100, block_checksums(text, 100)) == [('', 0, 50), ('tail', 0, 0)]
+    assert delta('short', 100, block_checksums(text, 100)) == [('short', 0, 0)]
+
+
+def test_delta_moved_block():
+    stale = 'a' * 10 + 'b' * 10 + 'c' * 10
+    assert delta('X' + 'c' * 10 + 'a' * 10, 10, block_checksums(stale, 10)) == [('X', 2, 1), ('', 0, 1)]
+
+
+def test_delta_applied():
+    rng = random.Random(4711)
+    for _ in range(20):
+        stale = ''.join(rng.choice('abc \n') for _ in range(rng.randint(0, 20000)))
+        current = edited(stale, rng, rng.randint(0, 5))
+        size = rng.choice((16, 100, 1024))
+
+        segments = delta(current, size, block_checksums(stale, size))
+        monitor = ContentMonitor()
+        monitor.synchronize(mock.sentinel.FILEPATH, stale, 0)
+        assert monitor.apply_delta(mock.sentinel.FILEPATH, size, segments, fingerprint(current), content_digest((current,))) is SynchronizationResult.Updated
+        assert monitor[mock.sentinel.FILEPATH] == current
+        assert monitor.version(mock.sentinel.FILEPATH) == 2
+
+        if stale == current and len(stale) % size == 0:
+            assert all(not data for data, _, _ in segments)
+
+
+def test_delta_rejected():
+    monitor = ContentMonitor()
+    assert monitor.apply_delta(mock.sentinel.FILEPATH, 10, [('new', 0, 0)], fingerprint('new'), content_digest(('new',))) is SynchronizationResult.OutOfSync
+
+    monitor.synchronize(mock.sentinel.FILEPATH, 'a' * 20, 0)
+    assert monitor.apply_delta(mock.sentinel.FILEPATH, 10, [('', 1, 2)], fingerprint('a' * 20), content_digest(('a' * 20,))) is SynchronizationResult.OutOfSync
+    assert monitor.apply_delta(mock.sentinel.FILEPATH, 10, [('b', 0, 2)], fingerprint('b' + 'a' * 19), content_digest(('b' + 'a' * 19,))) is SynchronizationResult.OutOfSync
+    assert monitor[mock.sentinel.FILEPATH] == 'a' * 20
+    assert monitor.version(mock.sentinel.FILEPATH) == 1
+
+
+def test_delta_colliding_blocks_rejected():
+    monitor = ContentMonitor()
+    monitor.synchronize(mock.sentinel.FILEPATH, 'a' * 20, 0)
+
+    # block copied due to colliding checksums has the expected fingerprint, but not the expected digest:
+    assert monitor.apply_delta(mock.sentinel.FILEPATH, 10, [('', 0, 2)], fingerprint('a' * 20),
+                               content_digest(('b' * 10, 'a' * 10))) is SynchronizationResult.OutOfSync
+    assert monitor.version(mock.sentinel.FILEPATH) == 1
+
+
+def test_content_digest():
+    assert content_digest(('ab', 'c')) == content_digest(('abc',)) != content_digest(('abd',))
+    assert content_digest(('lone \ud800',))
+
+
+@pytest.mark.parametrize('size,segments', [
+    (10, [('', 1, -1)]),
+    (10, [('', -1, 1)]),
+    (10, [('', 2, 1)]),
+    (0, [('', 0, 1)]),
+    (-10, [('', -1, 1)]),
+    (None, [('', 0, 1)]),
+    (10, [('', '0', 1)]),
+    (10, [('', 0, 1.5)]),
+    (10, [(None, 0, 1)]),
+    (10, None),
+    (10, [None]),
+    (10, [('', 0)]),
+])
+def test_delta_malformed_rejected(size, segments):
+    monitor = ContentMonitor()
+    monitor.synchronize(mock.sentinel.FILEPATH, 'a' * 20, 0)
+    assert monitor.apply_delta(mock.sentinel.FILEPATH, size, segments, fingerprint('a' * 10), content_digest(('a' * 10,))) is SynchronizationResult.OutOfSync
+    assert monitor[mock.sentinel.FILEPATH] == 'a' * 20
+
+
+def test_resync_message():
+    message = resync_message('file', 'content', OutOfSync('file'))
+    assert isinstance(message, ContentSync)
+    assert message.data == 'content'
+
+    # invalid block sizes:
+    for size in (-1, 0, '1024'):
+        assert isinstance(resync_message('file', 'content', OutOfSync('file', size, [0])), ContentSync)
+
+    stale = 'x' * 3000
+    out_of_sync = OutOfSync('file', 1024, block_checksums(stale, 1024))
+    message = resync_message('file', stale + 'new', out_of_sync)
+    assert isinstance(message, ContentDelta)
+    assert message.blockSize == 1024
+    assert [(s.data, s.block, s.count) for s in message.segments] == [('', 0, 2), ('x' * 952 + 'new', 0, 0)]
+    assert message.fingerprint == fingerprint(stale + 'new')
+    assert message.digest == content_digest((stale + 'new',))
+
+
+def test_delta_rolled_over_changes():
+    rng = random.Random(4711)
+    stale = ''.join(rng.choice('abcdefgh\n\u20ac\U0001f600') for _ in range(1000))
+    # every block is shifted by an odd number of characters:
+    current = 'x' + stale[:500] + 'yyy' + stale[500:]
+    segments = delta(current, 50, block_checksums(stale, 50))
+    assert segments == [('x', 0, 10), ('yyy', 10, 10)]
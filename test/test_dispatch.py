@@ -0,0 +1,88 @@
+from unittest import mock
+from jep_py.backend import FrontendListener
+from jep_py.dispatch import Dispatcher, ListenerList
+from jep_py.frontend import BackendListener
+from jep_py.schema import Shutdown, ContentSync, CompletionRequest, Message
+
+
+class ContentListener(FrontendListener):
+    def __init__(self):
+        self.received = []
+
+    def on_content_sync(self, content_sync, context):
+        self.received.append(content_sync)
+
+
+def test_handler_name():
+    assert Shutdown.handler_name() == 'on_shutdown'
+    assert ContentSync.handler_name() == 'on_content_sync'
+    for cls in Message.__subclasses__():
+        assert hasattr(FrontendListener, cls.handler_name()) or hasattr(BackendListener, cls.handler_name())
+
+
+def test_dispatch_skips_handlers_not_implemented():
+    dispatcher = Dispatcher(FrontendListener)
+    listener = ContentListener()
+    listeners = [listener, FrontendListener()]
+    message = ContentSync('file', 'data')
+
+    with mock.patch.object(ContentSync, 'invoke', autospec=True, side_effect=ContentSync.invoke) as mock_invoke:
+        dispatcher.dispatch(message, mock.sentinel.CONTEXT, listeners)
+        mock_invoke.assert_called_once_with(message, listener, mock.sentinel.CONTEXT)
+
+    with mock.patch.object(Shutdown, 'invoke') as mock_invoke:
+        dispatcher.dispatch(Shutdown(), mock.sentinel.CONTEXT, listeners)
+        assert not mock_invoke.called
+
+    assert listener.received == [message]
+
+
+def test_dispatch_follows_changed_listeners():
+    dispatcher = Dispatcher(FrontendListener)
+    listeners = []
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+
+    listener = ContentListener()
+    listeners.append(listener)
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+    assert len(listener.received) == 1
+
+
+def test_dispatch_follows_changed_listener_list():
+    dispatcher = Dispatcher(FrontendListener)
+    listeners = ListenerList([FrontendListener()])
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+
+    # table is kept while the list is unchanged, without comparing the list:
+    with mock.patch.object(Dispatcher, '_targets', side_effect=AssertionError) as mock_targets, \
+            mock.patch.object(ListenerList, '__eq__', side_effect=AssertionError):
+        dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+        assert not mock_targets.called
+
+    listener = ContentListener()
+    listeners.append(listener)
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+    assert len(listener.received) == 1
+
+    listeners[1] = FrontendListener()
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+    del listeners[0]
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, listeners)
+    assert len(listener.received) == 1
+
+
+def test_dispatch_subscribed_by_type():
+    dispatcher = Dispatcher(FrontendListener)
+    subscriber = mock.MagicMock()
+    dispatcher.subscribe(subscriber, CompletionRequest)
+
+    dispatcher.dispatch(ContentSync('file', 'data'), mock.sentinel.CONTEXT, [])
+    assert not subscriber.on_content_sync.called
+
+    request = CompletionRequest('file', 17)
+    dispatcher.dispatch(request, mock.sentinel.CONTEXT, [])
+    subscriber.on_completion_request.assert_called_once_with(request, mock.sentinel.CONTEXT)
+
+    dispatcher.unsubscribe(subscriber)
+    dispatcher.dispatch(request, mock.sentinel.CONTEXT, [])
+    assert subscriber.on_completion_request.call_count == 1
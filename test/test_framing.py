@@ -0,0 +1,59 @@
+import pytest
+import umsgpack
+from jep_py.buffer import ReceiveBuffer
+from jep_py.framing import frame_header, read_frame, peek_message_name, FrameError, FRAME_MARKER, EMPTY_FRAME
+from jep_py.unpacker import NEED_DATA
+
+
+def test_frame_header():
+    assert frame_header(0) == EMPTY_FRAME
+    assert frame_header(0x7f) == b'\xc1\x7f'
+    assert frame_header(0x80) == b'\xc1\x80\x01'
+    assert frame_header(300) == b'\xc1\xac\x02'
+
+
+@pytest.mark.parametrize('length', [0, 1, 127, 128, 300, 70000])
+def test_read_frame(length):
+    payload = bytes(range(256)) * (length // 256) + bytes(range(length % 256))
+    buffer = ReceiveBuffer(16, 16)
+    data = frame_header(length) + payload + b'rest'
+
+    # frame is returned once complete only:
+    for b in data[:-5]:
+        buffer.extend(bytes((b,)))
+        assert read_frame(buffer) is NEED_DATA
+    buffer.extend(data[-5:])
+    assert read_frame(buffer) == payload
+    assert bytes(buffer.view()) == b'rest'
+
+
+def test_read_frame_does_not_reserve_announced_length():
+    buffer = ReceiveBuffer(16, 16)
+    buffer.extend(frame_header(1000) + b'x')
+    assert read_frame(buffer) is NEED_DATA
+    assert buffer.capacity == 16
+
+
+def test_read_frame_corrupt_length():
+    buffer = ReceiveBuffer()
+    buffer.extend(bytes((FRAME_MARKER,)) + b'\xff' * 11)
+    with pytest.raises(FrameError):
+        read_frame(buffer)
+
+
+def test_read_frame_max_length():
+    buffer = ReceiveBuffer(16, 16)
+    buffer.extend(frame_header(1000))
+    assert read_frame(buffer, 1000) is NEED_DATA
+    with pytest.raises(FrameError):
+        read_frame(buffer, 999)
+
+
+def test_peek_message_name():
+    assert peek_message_name(umsgpack.packb({'_message': 'Shutdown'}), '_message') == 'Shutdown'
+    assert peek_message_name(umsgpack.packb({'_message': 'x' * 40, 'a': 1}), '_message') == 'x' * 40
+    assert peek_message_name(umsgpack.packb({str(i): i for i in range(20)}), '_message') is None
+    assert peek_message_name(umsgpack.packb([1, 2]), '_message') is None
+    assert peek_message_name(umsgpack.packb({'_message': 'Shutdown'})[:-2], '_message') is None
+    assert peek_message_name(b'', '_message') is None
+    assert peek_message_name(b'\x81' + umsgpack.packb('_message') + b'\xa2\xff\xfe', '_message') is None
@@ -5,8 +5,11 @@ from unittest import mock
 import datetime
 import itertools
 import pytest
+from jep_py.buffer import ReceiveBuffer
 from jep_py.config import TIMEOUT_LAST_MESSAGE
+from jep_py.framing import EMPTY_FRAME
 from jep_py.frontend import Frontend, State, BackendConnection, TIMEOUT_BACKEND_STARTUP, TIMEOUT_BACKEND_SHUTDOWN
+from jep_py.protocol import MessageSerializer
 from jep_py.schema import Shutdown, BackendAlive, CompletionResponse, CompletionRequest
 from test.logconfig import configure_test_logger
 
@@ -148,9 +151,9 @@ def test_backend_connection_initial_state():
 
 def test_backend_connection_send_message_ok():
     mock_serializer = mock.MagicMock()
-    mock_serializer.serialize = mock.MagicMock(return_value=mock.sentinel.SERIALIZED)
+    mock_serializer.serialize = mock.MagicMock(return_value=b'SERIALIZED')
     mock_socket = mock.MagicMock()
-    mock_socket.send = mock.MagicMock()
+    mock_socket.send = mock.MagicMock(side_effect=len)
 
     connection = BackendConnection(mock.sentinel.FRONTEND, mock.sentinel.SERVICE_CONFIG, [], serializer=mock_serializer)
     connection._socket = mock_socket
@@ -160,14 +163,14 @@ def test_backend_connection_send_message_ok():
     connection.send_message(mock.sentinel.MESSAGE)
 
     mock_serializer.serialize.assert_called_once_with(mock.sentinel.MESSAGE)
-    mock_socket.send.assert_called_once_with(mock.sentinel.SERIALIZED)
+    mock_socket.send.assert_called_once_with(b'SERIALIZED')
 
 
 def test_backend_connection_send_message_wrong_state():
     mock_serializer = mock.MagicMock()
-    mock_serializer.serialize = mock.MagicMock(return_value=mock.sentinel.SERIALIZED)
+    mock_serializer.serialize = mock.MagicMock(return_value=b'SERIALIZED')
     mock_socket = mock.MagicMock()
-    mock_socket.send = mock.MagicMock()
+    mock_socket.send = mock.MagicMock(side_effect=len)
 
     connection = BackendConnection(mock.sentinel.FRONTEND, mock.sentinel.SERVICE_CONFIG, [], serializer=mock_serializer)
     connection._socket = mock_socket
@@ -184,7 +187,7 @@ def test_backend_connection_send_message_serialization_failed():
     mock_serializer = mock.MagicMock()
     mock_serializer.serialize = mock.MagicMock(side_effect=NotImplementedError)
     mock_socket = mock.MagicMock()
-    mock_socket.send = mock.MagicMock()
+    mock_socket.send = mock.MagicMock(side_effect=len)
 
     connection = BackendConnection(mock.sentinel.FRONTEND, mock.sentinel.SERVICE_CONFIG, [], serializer=mock_serializer)
     connection._socket = mock_socket
@@ -197,7 +200,7 @@ def test_backend_connection_send_message_serialization_failed():
 
 def test_backend_connection_send_message_send_failed():
     mock_serializer = mock.MagicMock()
-    mock_serializer.serialize = mock.MagicMock(return_value=mock.sentinel.SERIALIZED)
+    mock_serializer.serialize = mock.MagicMock(return_value=b'SERIALIZED')
     mock_socket = mock.MagicMock()
     mock_socket.send = mock.MagicMock(NotImplementedError)
 
@@ -249,7 +252,7 @@ def test_backend_connection_connect(mock_os_module, mock_datetime_module, mock_s
     mock_os_module.path = path
 
     mock_listener = mock.MagicMock()
-    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [mock_listener], serializer=mock.sentinel.SERIALIZER, provide_async_reader=mock_provide_async_reader)
+    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [mock_listener], serializer=mock.MagicMock(), provide_async_reader=mock_provide_async_reader)
     connection.connect()
 
     # process and reader thread were started and state is adapted:
@@ -293,7 +296,7 @@ def test_backend_connection_connect_no_port_announcement(mock_os_module, mock_da
     mock_async_reader, mock_process, mock_provide_async_reader, mock_service_config = prepare_connecting_mocks(mock_datetime_module, mock_socket_module,
                                                                                                                mock_subprocess_module, now)
 
-    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.sentinel.SERIALIZER, provide_async_reader=mock_provide_async_reader)
+    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.MagicMock(), provide_async_reader=mock_provide_async_reader)
     connection.connect()
 
     # run state methods during "connected":
@@ -326,7 +329,7 @@ def test_backend_connection_connect_connection_none(mock_os_module, mock_datetim
     mock_async_reader, mock_process, mock_provide_async_reader, mock_service_config = prepare_connecting_mocks(mock_datetime_module, mock_socket_module,
                                                                                                                mock_subprocess_module, now)
 
-    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.sentinel.SERIALIZER, provide_async_reader=mock_provide_async_reader)
+    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.MagicMock(), provide_async_reader=mock_provide_async_reader)
     connection.connect()
 
     # run state methods during "connected":
@@ -357,7 +360,7 @@ def test_backend_connection_connect_connection_exception(mock_os_module, mock_da
     mock_async_reader, mock_process, mock_provide_async_reader, mock_service_config = prepare_connecting_mocks(mock_datetime_module, mock_socket_module,
                                                                                                                mock_subprocess_module, now)
 
-    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.sentinel.SERIALIZER, provide_async_reader=mock_provide_async_reader)
+    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock.MagicMock(), provide_async_reader=mock_provide_async_reader)
     connection.connect()
 
     # run state methods during "connected":
@@ -384,11 +387,13 @@ def prepare_connected_mocks(mock_datetime_module, mock_socket_module, mock_subpr
     mock_async_reader, mock_process, mock_provide_async_reader, mock_service_config = prepare_connecting_mocks(mock_datetime_module, mock_socket_module,
                                                                                                                mock_subprocess_module, now)
     mock_serializer = mock.MagicMock()
-    mock_serializer.serialize = mock.MagicMock(return_value=mock.sentinel.SERIALIZED_SHUTDOWN)
+    mock_serializer.serialize = mock.MagicMock(return_value=b'SHUTDOWN')
+    mock_serializer.buffer = ReceiveBuffer()
     connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=mock_serializer, provide_async_reader=mock_provide_async_reader)
     connection.connect()
     mock_async_reader.queue_.put('This is the JEP service, listening on port 4711')
     mock_socket = mock.MagicMock()
+    mock_socket.send = mock.MagicMock(side_effect=len)
     mock_socket_module.create_connection.return_value = mock_socket
     decorate_connection_state_dispatch(connection, 0.5, mock_datetime_module)
     connection.run(datetime.timedelta(seconds=0.4))
@@ -406,8 +411,8 @@ def test_backend_connected_disconnect_backend_shutdown_ok(mock_os_module, mock_d
     connection.disconnect()
 
     # frontend tried to send shutdown to connected backend:
-    assert isinstance(mock_serializer.serialize.call_args[0][0], Shutdown)
-    mock_socket.send.assert_called_once_with(mock.sentinel.SERIALIZED_SHUTDOWN)
+    assert isinstance(mock_serializer.serialize.call_args[0][0].message, Shutdown)
+    mock_socket.send.assert_called_once_with(b'SHUTDOWN')
 
     # run to wait for backend to shut down gracefully:
     mock_process.poll = mock.MagicMock(return_value=0)
@@ -434,8 +439,8 @@ def test_backend_connected_reconnect(mock_os_module, mock_datetime_module, mock_
     connection.reconnect(mock_service_config2)
 
     # frontend tried to send shutdown to connected backend:
-    assert isinstance(mock_serializer.serialize.call_args[0][0], Shutdown)
-    mock_socket.send.assert_called_once_with(mock.sentinel.SERIALIZED_SHUTDOWN)
+    assert isinstance(mock_serializer.serialize.call_args[0][0].message, Shutdown)
+    mock_socket.send.assert_called_once_with(b'SHUTDOWN')
 
     # run to wait for backend to shut down gracefully:
     mock_process.poll = mock.MagicMock(return_value=0)
@@ -510,7 +515,7 @@ def test_backend_connected_receive_data(mock_os_module, mock_datetime_module, mo
 
     # prepare data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=iterate_first_and_then(mock.sentinel.SERIALIZED, BlockingIOError))
+    mock_socket.recv_into = mock.MagicMock(side_effect=iterate_first_and_then(8, BlockingIOError))
     mock_serializer.__iter__ = mock.Mock(return_value=iter([BackendAlive()]))
 
     mock_listener = mock.MagicMock()
@@ -540,7 +545,7 @@ def test_backend_connected_receive_data_resets_alive_timeout(mock_os_module, moc
 
     # prepare data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=iterate_first_and_then(mock.sentinel.SERIALIZED, BlockingIOError))
+    mock_socket.recv_into = mock.MagicMock(side_effect=iterate_first_and_then(8, BlockingIOError))
     mock_serializer.__iter__ = mock.Mock(return_value=iter([BackendAlive()]))
 
     connection.run(TIMEOUT_LAST_MESSAGE)
@@ -557,7 +562,7 @@ def test_backend_connected_receive_data_none(mock_os_module, mock_datetime_modul
 
     # prepare None data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(return_value=None)
+    mock_socket.recv_into = mock.MagicMock(return_value=0)
 
     connection.run(datetime.timedelta(seconds=2))
 
@@ -575,7 +580,7 @@ def test_backend_connected_receive_data_exception(mock_os_module, mock_datetime_
 
     # prepare None data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=ConnectionResetError)
+    mock_socket.recv_into = mock.MagicMock(side_effect=ConnectionResetError)
 
     connection.run(datetime.timedelta(seconds=2))
     # backend tries to reconnect:
@@ -647,7 +652,7 @@ def test_backend_connected_run_wit__other_response_received(mock_os_module, mock
 
     # prepare data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=iterate_first_and_then(mock.sentinel.SERIALIZED, BlockingIOError))
+    mock_socket.recv_into = mock.MagicMock(side_effect=iterate_first_and_then(8, BlockingIOError))
     mock_serializer.__iter__ = mock.Mock(return_value=iter([CompletionResponse(0, 1, token=mock.sentinel.OTHER_TOKEN)]))
 
     decorate_connection_state_dispatch(connection, 0.1, mock_datetime_module)
@@ -673,7 +678,7 @@ def test_backend_connected_run_with_response_received(mock_os_module, mock_datet
 
     # prepare data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=iterate_first_and_then(mock.sentinel.SERIALIZED, BlockingIOError))
+    mock_socket.recv_into = mock.MagicMock(side_effect=iterate_first_and_then(8, BlockingIOError))
     mock_serializer.__iter__ = mock.Mock(return_value=iter([CompletionResponse(0, 1, token=mock.sentinel.TOKEN)]))
 
     decorate_connection_state_dispatch(connection, 0.1, mock_datetime_module)
@@ -722,7 +727,7 @@ def test_backend_connected_request_message_with_response(mock_os_module, mock_da
 
     # prepare data ready for reception:
     mock_select_module.select = mock.MagicMock(return_value=([mock_socket], [], []))
-    mock_socket.recv = mock.MagicMock(side_effect=iterate_first_and_then(mock.sentinel.SERIALIZED, BlockingIOError))
+    mock_socket.recv_into = mock.MagicMock(side_effect=iterate_first_and_then(8, BlockingIOError))
     mock_serializer.__iter__ = mock.Mock(return_value=iter([CompletionResponse(0, 1, token=mock.sentinel.TOKEN)]))
 
     request = CompletionRequest('file', 0, token=mock.sentinel.TOKEN)
@@ -733,3 +738,34 @@ def test_backend_connected_request_message_with_response(mock_os_module, mock_da
 
     # synchronous call returns immediately upon reception of response with correct token:
     assert mock_datetime_module.datetime.now() == now + datetime.timedelta(seconds=0.1)
+
+
+def test_parse_port_announcement():
+    assert BackendConnection._parse_port_announcement(['JEP service, listening on port 4711']) == (4711, ())
+    assert BackendConnection._parse_port_announcement(['other', 'JEP service, listening on port 4711 (features: framed, compressed)']) == (4711, ('framed', 'compressed'))
+    assert BackendConnection._parse_port_announcement(['other']) == (None, ())
+
+
+@mock.patch('jep_py.frontend.subprocess')
+@mock.patch('jep_py.frontend.socket')
+@mock.patch('jep_py.frontend.datetime')
+@mock.patch('jep_py.frontend.os')
+def test_backend_connection_connect_with_features(mock_os_module, mock_datetime_module, mock_socket_module, mock_subprocess_module):
+    now = datetime.datetime.now()
+    mock_async_reader, mock_process, mock_provide_async_reader, mock_service_config = prepare_connecting_mocks(mock_datetime_module, mock_socket_module,
+                                                                                                               mock_subprocess_module, now)
+    mock_os_module.path = path
+    serializer = MessageSerializer(codec='umsgpack')
+    connection = BackendConnection(mock.sentinel.FRONTEND, mock_service_config, [], serializer=serializer, provide_async_reader=mock_provide_async_reader)
+    connection.connect()
+    mock_async_reader.queue_.put('JEP service, listening on port 4711 (features: framed, compressed)')
+    mock_socket = mock.MagicMock(send=mock.MagicMock(side_effect=len))
+    mock_socket_module.create_connection.return_value = mock_socket
+    decorate_connection_state_dispatch(connection, 0.6, mock_datetime_module)
+    connection.run(datetime.timedelta(seconds=0.5))
+    assert connection.state is State.Connected
+
+    # frontend enables announced features and lets backend know:
+    assert serializer.framed
+    assert serializer.compress_threshold is not None
+    mock_socket.send.assert_called_once_with(EMPTY_FRAME)
@@ -0,0 +1,75 @@
+import enum
+import umsgpack
+import pytest
+from jep_py.packer import packb, pack_message, field_plan
+from jep_py.schema import ProblemUpdate, FileProblems, Problem, Severity, CompletionResponse, CompletionOption, SemanticType, ContentSync
+from jep_py.serializer import Serializable, serialize_to_builtins
+from test.test_unpacker import SAMPLES
+
+
+def test_packb_matches_umsgpack():
+    for sample in SAMPLES:
+        assert packb(sample) == umsgpack.packb(sample)
+
+
+def test_packb_tuple_and_enum():
+    class MyEnum(enum.Enum):
+        Literal1 = 1
+
+    assert packb((1, 'a')) == umsgpack.packb([1, 'a'])
+    assert packb(MyEnum.Literal1) == umsgpack.packb('Literal1')
+
+
+def test_packb_out_of_range():
+    with pytest.raises(OverflowError):
+        packb(2 ** 64)
+    with pytest.raises(OverflowError):
+        packb(-2 ** 63 - 1)
+
+
+def test_packb_unsupported_type():
+    with pytest.raises(TypeError):
+        packb(object())
+
+
+def test_pack_serializable_elides_defaults():
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b', c: [int] = ()):
+            super().__init__()
+            self.a = a
+            self.b = b
+            self.c = c
+
+    assert umsgpack.unpackb(packb(A(1))) == {'a': 1}
+    assert umsgpack.unpackb(packb(A(1, 'x', [2]))) == {'a': 1, 'b': 'x', 'c': [2]}
+    assert [field.name for field in field_plan(A)] == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('message', [
+    ProblemUpdate([FileProblems('thefile', [Problem('themsg', Severity.info, 99), Problem('other', Severity.error, 1)], 50, 10, 20)], True),
+    CompletionResponse(11, 12, True, [CompletionOption('display', 'desc', semantics=SemanticType.string, extensionId='id')] * 20, 'token'),
+    ContentSync('file', 'data', 3),
+])
+def test_pack_message_matches_builtins(message):
+    expected = serialize_to_builtins(message)
+    expected['_message'] = type(message).__name__
+
+    packed = pack_message(message, '_message', type(message).__name__)
+    assert umsgpack.unpackb(packed) == expected
+
+    # type name is written first, so it can be read without decoding the fields:
+    assert packed[1:10] == umsgpack.packb('_message')
+
+
+@pytest.mark.parametrize('message', [
+    ProblemUpdate([FileProblems('thefile', [Problem('themsg', Severity.info, 99), Problem('other', Severity.error, 1)])], True),
+    CompletionResponse(11, 12, True, [CompletionOption('display', 'desc', semantics=SemanticType.string)], 'token'),
+])
+def test_pack_message_compact_matches_builtins(message):
+    expected = {field.name: serialize_to_builtins(getattr(message, field.name), compact=True) for field in field_plan(type(message))
+                if message.is_serialized_and_not_default(field.name, getattr(message, field.name))}
+    expected['_message'] = type(message).__name__
+
+    packed = pack_message(message, '_message', type(message).__name__, compact=True)
+    assert umsgpack.unpackb(packed) == expected
+    assert len(packed) < len(pack_message(message, '_message', type(message).__name__))
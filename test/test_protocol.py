@@ -2,7 +2,10 @@ from unittest import mock
 import umsgpack
 import pytest
 from test.logconfig import configure_test_logger
-from jep_py.protocol import MessageSerializer
+from jep_py.codec import available_codecs
+from jep_py.config import COMPRESSION_THRESHOLD
+from jep_py.framing import FRAME_MARKER, EMPTY_FRAME, frame_header
+from jep_py.protocol import MessageSerializer, FrozenMessage, EncodedMessageCache, content_key, COMPRESSED_EXT_TYPE
 from jep_py.schema import Shutdown, BackendAlive, ContentSync, OutOfSync, CompletionRequest, CompletionResponse, CompletionOption, SemanticType, ProblemUpdate, Problem, \
     Severity, FileProblems, CompletionInvocation, StaticSyntaxRequest, SyntaxFormatType, StaticSyntaxList, StaticSyntax
 
@@ -239,3 +242,338 @@ def test_descode_static_syntax_request():
 
     message = next(iter(serializer))
     assert isinstance(message, StaticSyntaxRequest)
+
+
+def test_message_serializer_undecodable_message_dropped():
+    serializer = MessageSerializer()
+    serializer.enque_data(umsgpack.packb({'_message': 'UnknownMessage'}))
+    serializer.enque_data(serializer.serialize(Shutdown()))
+
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+    assert not serializer.dequeue_message()
+
+
+def test_message_serializer_invalid_message_counted():
+    serializer = MessageSerializer()
+    serializer.enque_data(umsgpack.packb({'_message': 'UnknownMessage'}))
+    serializer.enque_data(umsgpack.packb([1, 2]))
+
+    assert not serializer.dequeue_message()
+    assert serializer.messages_dropped == 2
+    assert not serializer.buffer
+
+
+@pytest.mark.parametrize('codec,corrupt', [(codec, bytes((FRAME_MARKER,)) + b'\xff' * 12) for codec in available_codecs()] +
+                         [('umsgpack', b'\xa4\xff\xfe\xfd\xfc'), ('json', b'{garbage\n')] +
+                         ([('msgpack', b'\xa4\xff\xfe\xfd\xfc')] if 'msgpack' in available_codecs() else []))
+def test_message_serializer_corrupt_stream_discarded(codec, corrupt):
+    serializer = MessageSerializer(codec=codec)
+    serializer.enque_data(corrupt + b'trailing')
+
+    assert not serializer.dequeue_message()
+    assert serializer.bytes_discarded > 0
+    assert not serializer.buffer
+
+    # stream is decoded again once the peer resynchronizes:
+    serializer.enque_data(serializer.serialize(Shutdown()))
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+
+
+#: Packer exposing the plain load/dump interface, decoded by the serializer's legacy stream path.
+LEGACY_PACKER = mock.Mock(load=umsgpack.load, dumps=umsgpack.dumps)
+
+
+def test_message_serializer_corrupt_stream_discarded_legacy_packer():
+    serializer = MessageSerializer(LEGACY_PACKER)
+    serializer.enque_data(serializer.serialize(Shutdown()))
+    serializer.enque_data(b'\xc1garbage')
+
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+    assert not serializer.dequeue_message()
+    assert serializer.bytes_discarded == 8
+
+    serializer.enque_data(serializer.serialize(Shutdown()))
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+
+
+@pytest.mark.parametrize('packer', [None, LEGACY_PACKER])
+def test_message_serializer_incomplete_data_limited(packer):
+    serializer = MessageSerializer(packer, max_buffered=100)
+    data = serializer.serialize(ContentSync('file', 'x' * 200))
+
+    # the C unpacker holds a copy of the data, which counts against the limit as well:
+    serializer.enque_data(data[:40])
+    assert not serializer.dequeue_message()
+    assert not serializer.bytes_discarded
+
+    serializer.enque_data(data[40:-1])
+    assert not serializer.dequeue_message()
+    assert serializer.bytes_discarded
+    assert not serializer.buffer
+
+
+@pytest.mark.parametrize('codec', [codec for codec in available_codecs() if codec != 'json'])
+def test_message_serializer_incomplete_container_limited(codec):
+    serializer = MessageSerializer(codec=codec, max_buffered=1000)
+    # message with array announcing 2**32 - 1 items, whose items are consumed by the pure Python unpacker as they arrive:
+    serializer.enque_data(b'\x82' + umsgpack.packb('_message') + umsgpack.packb('ContentSync') + b'\xdd\xff\xff\xff\xff')
+
+    for _ in range(5):
+        serializer.enque_data(b'\x01' * 300)
+        assert not serializer.dequeue_message()
+        assert len(serializer.buffer) + serializer.unpacker.partial <= 1000
+    assert serializer.bytes_discarded
+
+
+@pytest.mark.parametrize('codec', [codec for codec in available_codecs() if codec != 'json'])
+def test_message_serializer_rest_of_discarded_data_reported_once(codec):
+    serializer = MessageSerializer(codec=codec, max_buffered=100)
+    data = serializer.serialize(ContentSync('file', 'x' * 200))
+
+    with mock.patch('jep_py.protocol._logger') as mock_logger:
+        serializer.enque_data(data[:150])
+        assert not serializer.dequeue_message()
+        assert serializer.bytes_discarded
+
+        # rest of discarded message is decoded to objects that are dropped silently:
+        serializer.enque_data(data[150:] + b'\x01' * 10)
+        assert not serializer.dequeue_message()
+        assert serializer.messages_dropped > 10
+        assert mock_logger.warning.call_count == 1
+
+        serializer.enque_data(serializer.serialize(Shutdown()) + b'\x01')
+        assert isinstance(serializer.dequeue_message(), Shutdown)
+        assert not serializer.dequeue_message()
+        assert mock_logger.warning.call_count == 2
+
+
+@pytest.mark.skipif('msgpack' not in available_codecs(), reason='C msgpack extension not installed')
+def test_message_serializer_unpacker_copy_limited():
+    serializer = MessageSerializer(codec='msgpack', max_buffered=1000)
+    data = serializer.serialize(ContentSync('file', 'x' * 2000))
+
+    # data fed to the C unpacker is held twice:
+    serializer.enque_data(data[:600])
+    assert not serializer.dequeue_message()
+    assert serializer.bytes_discarded == 600
+    assert not serializer.unpacker.copied
+
+
+def test_message_serializer_frame_with_corrupt_name_dropped():
+    serializer = MessageSerializer(codec='umsgpack')
+    serializer.use_features(['framed'])
+    corrupt = b'\x81' + umsgpack.packb('_message') + b'\xa2\xff\xfe'
+    serializer.enque_data(frame_header(len(corrupt)) + corrupt + serializer.serialize(Shutdown()))
+
+    # only the corrupt frame is dropped, the following one is still decoded:
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+    assert serializer.messages_dropped == 1
+    assert not serializer.bytes_discarded
+
+
+def test_message_serializer_framed_length_limited():
+    serializer = MessageSerializer(codec='umsgpack', max_buffered=100)
+    serializer.use_features(['framed'])
+    serializer.enque_data(frame_header(1 << 40))
+
+    assert not serializer.dequeue_message()
+    assert not serializer.buffer
+    assert serializer.buffer.capacity < 1 << 20
+
+
+def test_message_serializer_decompression_limited():
+    serializer = MessageSerializer(codec='umsgpack', max_buffered=1000)
+    serializer.use_features(['compressed'])
+    sender = MessageSerializer(codec='umsgpack')
+    sender.use_features(['compressed'])
+    serializer.enque_data(sender.serialize(ContentSync('file', 'x' * 10000)))
+    serializer.enque_data(sender.serialize(Shutdown()))
+
+    assert isinstance(serializer.dequeue_message(), Shutdown)
+    assert serializer.messages_dropped == 1
+
+
+def test_frozen_message_encoded_once():
+    serializer = MessageSerializer(codec='umsgpack')
+    frozen = FrozenMessage(Shutdown())
+
+    with mock.patch.object(serializer, 'encode', wraps=serializer.encode) as mock_encode:
+        data = serializer.serialize(frozen)
+        assert serializer.serialize(frozen) is data
+        assert mock_encode.call_count == 1
+
+    # other encodings are computed separately:
+    assert MessageSerializer(codec='json').serialize(frozen) == MessageSerializer(codec='json').serialize(Shutdown())
+    assert MessageSerializer(codec='umsgpack').serialize(frozen) is data
+
+
+def test_encoded_message_cache_shared_by_serializers():
+    cache = EncodedMessageCache(message_types=(OutOfSync,))
+    serializer1 = MessageSerializer(codec='umsgpack', cache=cache)
+    serializer2 = MessageSerializer(codec='umsgpack', cache=cache)
+
+    data = serializer1.serialize(OutOfSync('/path/to/file'))
+    assert serializer2.serialize(OutOfSync('/path/to/file')) is data
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # different content or encoding is not mixed up:
+    assert serializer1.serialize(OutOfSync('/path/to/other')) != data
+    assert MessageSerializer(codec='json', cache=cache).serialize(OutOfSync('/path/to/file')) != data
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # message types not meant for caching bypass it:
+    serializer1.serialize(ContentSync('/path/to/file', 'content'))
+    assert len(cache) == 3
+
+
+def test_encoded_message_cache_default_types():
+    cache = EncodedMessageCache()
+    assert cache.accepts(Shutdown())
+    assert not cache.accepts(CompletionResponse(1, 2, False, (), 'token'))
+    assert not cache.accepts(OutOfSync('file', 1024, [1, 2, 3]))
+
+
+def test_encoded_message_cache_evicts_least_recently_used():
+    cache = EncodedMessageCache(size=2, message_types=(OutOfSync,))
+    serializer = MessageSerializer(codec='umsgpack', cache=cache)
+
+    serializer.serialize(OutOfSync('a'))
+    serializer.serialize(OutOfSync('b'))
+    serializer.serialize(OutOfSync('a'))
+    serializer.serialize(OutOfSync('c'))
+    assert len(cache) == 2
+
+    # b was evicted, a is still cached:
+    cache.hits = 0
+    serializer.serialize(OutOfSync('a'))
+    assert cache.hits == 1
+    serializer.serialize(OutOfSync('b'))
+    assert cache.hits == 1
+
+
+def test_content_key():
+    options = [CompletionOption('a', 'b', semantics=SemanticType.string)]
+    assert content_key(CompletionResponse(0, 1, False, options)) == content_key(CompletionResponse(0, 1, False, list(options)))
+    assert content_key(CompletionResponse(0, 1, False, options)) != content_key(CompletionResponse(0, 1, True, options))
+    assert content_key(CompletionResponse(1, 1, False, options)) != content_key(CompletionResponse(True, 1, False, options))
+
+
+@pytest.mark.parametrize('codec', [name for name in available_codecs() if name != 'json'])
+def test_message_serializer_compression(codec):
+    serializer = MessageSerializer(codec=codec, compress_threshold=100)
+    receiver = MessageSerializer(codec=codec)
+    definition = 'name: "source.cmake", patterns: [{"match": "\\\\bif\\\\b"}]\n' * 100
+    message = StaticSyntaxList(SyntaxFormatType.textmate, [StaticSyntax('CMake', ['cmake'], definition)])
+
+    data = serializer.serialize(message)
+    assert len(data) < len(definition) / 10
+    assert umsgpack.unpackb(data).type == COMPRESSED_EXT_TYPE
+    assert serializer.stats.messages_compressed == 1
+    assert serializer.stats.bytes_saved > len(definition) * 0.9
+
+    # receiver decodes compressed messages without enabling compression itself:
+    receiver.enque_data(data[:10])
+    receiver.enque_data(data[10:])
+    decoded = receiver.dequeue_message()
+    assert isinstance(decoded, StaticSyntaxList)
+    assert decoded.syntaxes[0].definition == definition
+    assert receiver.stats.messages_decompressed == 1
+    assert receiver.stats.bytes_saved == serializer.stats.bytes_saved
+    assert isinstance(receiver.deserialize(data), StaticSyntaxList)
+
+
+def test_message_serializer_compression_threshold():
+    serializer = MessageSerializer(codec='umsgpack', compress_threshold=100)
+
+    # small and incompressible messages are sent as they are:
+    assert serializer.serialize(Shutdown()) == MessageSerializer(codec='umsgpack').serialize(Shutdown())
+    with mock.patch('jep_py.protocol.zlib.compress', lambda data, level: data):
+        assert isinstance(umsgpack.unpackb(serializer.serialize(OutOfSync('x' * 200))), dict)
+    assert serializer.stats.messages_compressed == 0
+
+
+def test_message_serializer_compression_requires_msgpack():
+    with pytest.raises(ValueError):
+        MessageSerializer(codec='json', compress_threshold=100)
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_message_serializer_framed(codec):
+    sender = MessageSerializer(codec=codec)
+    receiver = MessageSerializer(codec=codec)
+    bare = sender.serialize(OutOfSync('/bare'))
+    sender.use_features(['framed'])
+    framed = sender.serialize(OutOfSync('/framed'))
+    assert framed[0] == FRAME_MARKER
+    assert sender.deserialize(framed).file == '/framed'
+
+    # bare and framed messages may follow each other, even in a single chunk:
+    data = bare + EMPTY_FRAME + framed + bare
+    for i in range(len(data)):
+        receiver.enque_data(data[i:i + 1])
+    assert [message.file for message in receiver] == ['/bare', '/framed', '/bare']
+    assert receiver.peer_framed
+    assert not receiver.buffer
+
+    receiver = MessageSerializer(codec=codec)
+    receiver.enque_data(data)
+    assert [message.file for message in receiver] == ['/bare', '/framed', '/bare']
+
+
+def test_message_serializer_framed_unknown_message_skipped():
+    serializer = MessageSerializer(codec='umsgpack')
+    serializer.use_features(['framed'])
+    unknown = umsgpack.packb({'_message': 'UnknownMessage', 'data': 'x' * 100})
+    serializer.enque_data(frame_header(len(unknown)) + unknown)
+    serializer.enque_data(serializer.serialize(Shutdown()))
+
+    with mock.patch.object(serializer.codec, 'loads', wraps=serializer.codec.loads) as mock_loads:
+        assert isinstance(serializer.dequeue_message(), Shutdown)
+        assert mock_loads.call_count == 1
+    assert serializer.messages_skipped == 1
+
+
+def test_message_serializer_use_features():
+    serializer = MessageSerializer(codec='umsgpack')
+    serializer.use_features(['framed', 'compressed', 'compact', 'unknown'])
+    assert serializer.framed
+    assert serializer.compress_threshold == COMPRESSION_THRESHOLD
+    assert serializer.compact
+
+    serializer.use_features([])
+    assert not serializer.framed
+    assert serializer.compress_threshold is None
+    assert not serializer.compact
+
+    serializer = MessageSerializer(codec='json')
+    serializer.use_features(['framed', 'compressed'])
+    assert serializer.framed
+    assert serializer.compress_threshold is None
+
+
+def test_message_serializer_lazy():
+    serializer = MessageSerializer(lazy=True)
+    update = ProblemUpdate([FileProblems('file', [Problem('msg', Severity.warn, 12)])])
+    data = serializer.serialize(update)
+    serializer.enque_data(data)
+
+    message = serializer.dequeue_message()
+    assert isinstance(message, ProblemUpdate)
+    assert message.fileProblems[0].problems[0].severity is Severity.warn
+    assert serializer.serialize(message) == data
+
+
+def test_message_serializer_compact():
+    serializer = MessageSerializer(codec='umsgpack')
+    update = ProblemUpdate([FileProblems('file', [Problem('msg', Severity.warn, 12)] * 10)])
+    data = serializer.serialize(update)
+
+    serializer.use_features(['compact'])
+    compact = serializer.serialize(update)
+    assert len(compact) < len(data)
+
+    # compact form is detected on input regardless of the features used for output:
+    receiver = MessageSerializer(codec='umsgpack')
+    receiver.enque_data(compact)
+    message = receiver.dequeue_message()
+    assert receiver.serialize(message) == data
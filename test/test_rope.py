@@ -0,0 +1,195 @@
+import random
+import pytest
+from jep_py.rope import Rope, Branch, LEAF_SIZE, FINGERPRINT_MODULUS, build, join, split, fingerprint
+
+
+def check_balanced(node):
+    """Returns number of leaves of balanced tree, asserting invariants."""
+    if not node.height:
+        assert 0 < node.length <= LEAF_SIZE
+        return 1
+    assert abs(node.left.height - node.right.height) <= 1
+    assert node.height == max(node.left.height, node.right.height) + 1
+    assert node.length == node.left.length + node.right.length
+    return check_balanced(node.left) + check_balanced(node.right)
+
+
+def test_rope_empty():
+    rope = Rope()
+    assert len(rope) == 0
+    assert str(rope) == ''
+    assert rope == ''
+    assert rope[:] == ''
+    assert rope.replace(0, 0, 'text') == 'text'
+
+
+def test_rope_indexing():
+    text = ''.join(chr(ord('a') + i % 26) for i in range(5 * LEAF_SIZE + 7))
+    rope = Rope(text)
+    check_balanced(rope.root)
+
+    assert len(rope) == len(text)
+    assert str(rope) == text
+    assert rope[0] == text[0]
+    assert rope[-1] == text[-1]
+    assert rope[LEAF_SIZE - 3:3 * LEAF_SIZE + 5] == text[LEAF_SIZE - 3:3 * LEAF_SIZE + 5]
+    assert rope[-10:] == text[-10:]
+    assert rope[::3] == text[::3]
+    with pytest.raises(IndexError):
+        rope[len(text)]
+
+
+def test_rope_is_persistent():
+    rope = Rope('x' * 10 * LEAF_SIZE)
+    edited = rope.replace(5, 5, 'inserted')
+    assert str(rope) == 'x' * 10 * LEAF_SIZE
+    assert edited[:20] == 'xxxxxinsertedxxxxxxx'
+
+    # unchanged subtrees are shared:
+    assert edited.root.right is rope.root.right
+
+
+def test_rope_random_edits():
+    rng = random.Random(4711)
+    text = ''.join(rng.choice('abc \n') for _ in range(20000))
+    rope = Rope(text)
+
+    for _ in range(2000):
+        start = rng.randint(0, len(text))
+        end = min(len(text), start + rng.choice((0, 0, 1, 5, 300, 5000)))
+        insert = ''.join(rng.choice('xyz\n') for _ in range(rng.choice((0, 1, 1, 2, 50, 3000))))
+        text = text[:start] + insert + text[end:]
+        rope = rope.replace(start, end, insert)
+
+    assert str(rope) == text
+    assert rope.fingerprint == fingerprint(text)
+    leaves = check_balanced(rope.root)
+    # keystrokes are merged into leaves instead of adding leaves of their own:
+    assert leaves < 3 * len(text) // LEAF_SIZE + 10
+
+
+def test_rope_replace_out_of_range():
+    with pytest.raises(IndexError):
+        Rope('abc').replace(2, 4, 'x')
+    with pytest.raises(IndexError):
+        Rope('abc').replace(2, 1, 'x')
+
+
+def test_join_and_split_balanced():
+    trees = [build('t%d' % i * (i * 100 + 1)) for i in range(30)]
+    joined = trees[0]
+    for tree in trees[1:]:
+        joined = join(joined, tree)
+    check_balanced(joined)
+
+    for index in (0, 1, 999, joined.length // 2, joined.length):
+        head, tail = split(joined, index)
+        assert head.length == index
+        assert Rope.from_root(join(head, tail)) == Rope.from_root(joined)
+        if isinstance(head, Branch):
+            check_balanced(head)
+
+
+def test_rope_lines():
+    lines = ['line %d' % i + 'x' * (i * 37 % 3000) for i in range(200)]
+    text = '\n'.join(lines)
+    rope = Rope(text)
+
+    assert rope.line_count == len(lines)
+    for index in (0, 1, 57, 198, 199):
+        start = len('\n'.join(lines[:index])) + (1 if index else 0)
+        assert rope.line_start(index) == start
+        assert rope.line_index(start) == index
+        assert rope.line_index(start + len(lines[index])) == index
+        assert rope.line(index) == lines[index]
+    assert rope.line_index(len(text)) == len(lines) - 1
+
+    with pytest.raises(IndexError):
+        rope.line_start(len(lines))
+    with pytest.raises(IndexError):
+        rope.line_index(len(text) + 1)
+
+
+def test_rope_lines_updated_by_edits():
+    rope = Rope('a\r\nb\r\n' * 3000)
+    assert rope.line(2999) == 'b'
+    rope = rope.replace(3, 3, 'new\nlines\n')
+    assert rope.line_count == 6003
+    assert [rope.line(i) for i in range(5)] == ['a', 'new', 'lines', 'b', 'a']
+    rope = rope.replace(0, rope.line_start(3), '')
+    assert rope.line_count == 6000
+    assert rope.line(0) == 'b'
+    check_balanced(rope.root)
+
+
+@pytest.mark.parametrize('newline', ['\r', '\r\n', '\n'])
+def test_rope_line_ends(newline):
+    # line ends are split between leaves at varying positions:
+    lines = ['x' * (i * 997 % (LEAF_SIZE + 3)) for i in range(40)]
+    text = newline.join(lines)
+    rope = Rope(text)
+    assert rope.line_count == len(lines)
+    start = 0
+    for index, line in enumerate(lines):
+        assert rope.line_start(index) == start
+        assert rope.line_end(index) == start + len(line)
+        assert rope.line_index(start + len(line)) == index
+        assert rope.line(index) == line
+        start += len(line) + len(newline)
+
+
+def test_rope_line_ends_mixed():
+    text = 'a\rb\r\nc\n\r\r\n\n'
+    rope = Rope(text)
+    assert rope.line_count == 7
+    assert [rope.line(i) for i in range(7)] == ['a', 'b', 'c', '', '', '', '']
+    assert [rope.line_index(offset) for offset in range(len(text) + 1)] == [0, 0, 1, 1, 1, 2, 2, 3, 4, 4, 5, 6]
+
+    # '\r\n' split between leaves counts once, also after edits joining or separating its characters:
+    rope = Rope('x' * (LEAF_SIZE - 1) + '\r\ny')
+    assert rope.line_count == 2
+    assert rope.line_start(1) == LEAF_SIZE + 1
+    assert rope.line_index(LEAF_SIZE) == 0
+    assert rope.line(0) == 'x' * (LEAF_SIZE - 1)
+    rope = rope.replace(LEAF_SIZE, LEAF_SIZE, 'z')
+    assert rope.line_count == 3
+    assert [rope.line(i) for i in range(1, 3)] == ['z', 'y']
+    rope = rope.replace(LEAF_SIZE, LEAF_SIZE + 1, '')
+    assert rope.line_count == 2
+    assert rope.line(1) == 'y'
+
+
+def test_fingerprint():
+    assert fingerprint('') == 0
+    assert fingerprint('a') == 0x61
+    assert fingerprint('ab') == 0x6100000062
+    assert fingerprint('\U0001f600') == 0x1f600
+
+    text = ''.join(chr(i % 0x3000 + 1) for i in range(3 * LEAF_SIZE))
+    assert fingerprint(text) == int.from_bytes(text.encode('utf-32-be'), 'big') % FINGERPRINT_MODULUS
+    assert Rope(text).fingerprint == fingerprint(text)
+    assert fingerprint(text) != fingerprint(text[1:] + text[0])
+
+    a, b = text[:1000], text[1000:]
+    assert fingerprint(a + b) == (fingerprint(a) * 2 ** (32 * len(b)) + fingerprint(b)) % FINGERPRINT_MODULUS
+
+    # characters swapped at distances that are multiples of 61 are told apart, unlike modulo 2**61-1:
+    assert fingerprint('a' + 'x' * 60 + 'b') != fingerprint('b' + 'x' * 60 + 'a')
+    assert Rope('a' + 'x' * 3000 + 'b').fingerprint != Rope('b' + 'x' * 3000 + 'a').fingerprint
+
+
+def test_rope_slice_and_concat():
+    text = ''.join(chr(ord('a') + i % 26) for i in range(10 * LEAF_SIZE))
+    rope = Rope(text)
+    sliced = rope.slice(LEAF_SIZE // 2, 7 * LEAF_SIZE)
+    assert sliced == text[LEAF_SIZE // 2:7 * LEAF_SIZE]
+    assert sliced.fingerprint == fingerprint(str(sliced))
+    check_balanced(sliced.root)
+
+    joined = rope.slice(0, 3) + Rope('new') + sliced + rope.slice(len(text), len(text))
+    assert joined == text[:3] + 'new' + str(sliced)
+    assert joined.fingerprint == fingerprint(str(joined))
+    check_balanced(joined.root)
+
+    with pytest.raises(IndexError):
+        rope.slice(5, len(text) + 1)
@@ -1,6 +1,30 @@
-from jep_py.schema import Message, Shutdown, CompletionResponse
+import pytest
+from jep_py.schema import Message, Shutdown, CompletionResponse, CompletionOption, Problem, FileProblems, ProblemUpdate, ProblemColumns, Severity
 
 
 def test_message_class_by_name():
     assert Message.class_by_name('Shutdown') is Shutdown
     assert Message.class_by_name('CompletionResponse') is CompletionResponse
+
+
+def test_schema_classes_without_instance_dict():
+    for cls in (Shutdown, CompletionResponse, Problem, FileProblems, ProblemUpdate, CompletionOption):
+        assert not hasattr(cls.__new__(cls), '__dict__'), cls.__name__
+
+
+def test_problem_columns():
+    messages = ['unused %s' % 'variable', 'syntax error', 'unused %s' % 'variable']
+    columns = ProblemColumns.from_lists(messages, [Severity.warn, Severity.error, Severity.warn], [1, 2, 3])
+
+    assert len(columns) == 3
+    assert list(columns.rows())[1] == ('syntax error', Severity.error, 2)
+    assert columns[0].message is columns[2].message
+    assert isinstance(columns[-1], Problem)
+    assert columns[-1].line == 3
+    assert [problem.line for problem in columns[1:]] == [2, 3]
+
+    problems = [Problem('msg', Severity.info, 1), Problem('msg', Severity.fatal, 5)]
+    assert list(ProblemColumns.from_items(problems).rows()) == [('msg', Severity.info, 1), ('msg', Severity.fatal, 5)]
+
+    with pytest.raises(ValueError):
+        ProblemColumns.from_lists(['msg'], [], [1])
@@ -2,7 +2,9 @@ from .logconfig import configure_test_logger
 import enum
 import inspect
 from unittest import mock
-from jep_py.serializer import Serializable, serialize_to_builtins, deserialize_from_builtins
+import pytest
+from jep_py.serializer import Serializable, serialize_to_builtins, deserialize_from_builtins, deserialize_reflective, compile_deserializer, \
+    compile_lazy_deserializer, LazyConversionError, enum_ordinal, Columns, register_columns, TextPayload
 
 
 def setup_function(function):
@@ -46,7 +48,52 @@ def test_serializable_meta():
     assert a.serialized_attribs['d'].default is None
 
     # make sure inherited member is still not in serialized list:
-    assert 'serialized_attribs' not in a.__dict__
+    assert 'serialized_attribs' not in A.__slots__
+
+    # attributes are stored in generated slots instead of instance dictionary:
+    assert A.__slots__ == ('a', 'b', 'c', 'd')
+    assert not hasattr(a, '__dict__')
+
+
+def test_serializable_meta_slots_inherited():
+    class A(Serializable):
+        def __init__(self, a: int):
+            super().__init__()
+            self.a = a
+
+    class B(A):
+        def __init__(self, a: int, b: str = None):
+            super().__init__(a)
+            self.b = b
+
+    class C(B):
+        pass
+
+    # only attributes not already slotted in base class are added:
+    assert Serializable.__slots__ == ()
+    assert B.__slots__ == ('b',)
+    assert C.__slots__ == ()
+
+    c = C(1, 'one')
+    assert not hasattr(c, '__dict__')
+    assert serialize_to_builtins(c) == {'a': 1, 'b': 'one'}
+
+
+def test_serializable_meta_explicit_slots():
+    class A(Serializable):
+        __slots__ = ('a', '__dict__')
+
+        def __init__(self, a: int):
+            super().__init__()
+            self.a = a
+            self.cache = None
+
+    a = A(1)
+    assert A.__slots__ == ('a', '__dict__')
+    assert a.__dict__ == {'cache': None}
+
+    # attributes not passed to constructor are not serialized:
+    assert serialize_to_builtins(a) == {'a': 1}
 
 
 def test_serialize_to_builtins_builtins():
@@ -204,3 +251,255 @@ def test_serializable_is_serialized_and_not_default():
     assert not o.is_serialized_and_not_default('a', 42)
     assert o.is_serialized_and_not_default('b', 'other value')
     assert not o.is_serialized_and_not_default('b', 'forty-two')
+
+
+def test_compiled_deserializer_matches_reflective():
+    class MyEnum(enum.Enum):
+        Literal1 = 1
+        Literal2 = 2
+
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b', e: MyEnum = None):
+            super().__init__()
+            self.a = a
+            self.b = b
+            self.e = e
+
+    class B(Serializable):
+        def __init__(self, a_list: [A], a_dict: {int: A} = None, names: [str] = ()):
+            super().__init__()
+            self.a_list = a_list
+            self.a_dict = a_dict
+            self.names = names
+
+    serialized = {
+        'a_list': [{'a': 1, 'e': 'Literal2'}, {'a': 2, 'b': 'two'}],
+        'a_dict': {1: {'a': 3, 'b': 'three', 'e': 'Literal1'}},
+    }
+
+    compiled = deserialize_from_builtins(serialized, B)
+    reflective = deserialize_reflective(serialized, B)
+    assert serialize_to_builtins(compiled) == serialize_to_builtins(reflective)
+    assert compiled.a_list[0].e is MyEnum.Literal2
+    assert compiled.a_dict[1].b == 'three'
+    assert compiled.names == []
+
+    # decoder is compiled only once:
+    assert B._deserializer is not None
+    assert B.from_builtins(serialized).a_list[1].b == 'two'
+
+
+def test_compiled_deserializer_recursive_type():
+    class Node(Serializable):
+        def __init__(self, name: str, children: list = None):
+            super().__init__()
+            self.name = name
+            self.children = children
+
+    Node.serialized_attribs['children'].itemtype = Node
+    Node.serialized_attribs['children'].datatype = list
+
+    node = compile_deserializer(Node)({'name': 'root', 'children': [{'name': 'leaf'}]})
+    assert node.children[0].name == 'leaf'
+    assert node.children[0].children is None
+
+
+def test_compiled_deserializer_missing_required_attribute():
+    class A(Serializable):
+        def __init__(self, a: int):
+            super().__init__()
+            self.a = a
+
+    with pytest.raises(TypeError):
+        deserialize_from_builtins({}, A)
+
+
+def test_compiled_deserializer_bytes_for_string():
+    class A(Serializable):
+        def __init__(self, a: str):
+            super().__init__()
+            self.a = a
+
+    with pytest.raises(TypeError):
+        deserialize_from_builtins({'a': b'bytes'}, A)
+
+
+def test_lazy_deserializer():
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b'):
+            super().__init__()
+            self.a = a
+            self.b = b
+
+    class B(Serializable):
+        def __init__(self, name: str, a_list: [A] = None):
+            super().__init__()
+            self.name = name
+            self.a_list = a_list
+
+    serialized = {'name': 'lazy', 'a_list': [{'a': 1}, {'a': 2, 'b': 'two'}]}
+    b = B.from_builtins_lazy(serialized)
+
+    # lazy object looks like the original class:
+    assert isinstance(b, B)
+    assert type(b).__name__ == 'B'
+    assert not hasattr(b, '__dict__')
+
+    # attributes are converted on first access only:
+    slot = B.__dict__['a_list']
+    with pytest.raises(AttributeError):
+        slot.__get__(b, B)
+    assert b.a_list[1].b == 'two'
+    assert slot.__get__(b, B) is b.a_list
+
+    assert serialize_to_builtins(b) == serialize_to_builtins(B.from_builtins(serialized))
+    b.name = 'changed'
+    assert b.name == 'changed'
+
+
+def test_lazy_deserializer_missing_required_attribute():
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b'):
+            super().__init__()
+            self.a = a
+            self.b = b
+
+    with pytest.raises(TypeError):
+        A.from_builtins_lazy({'b': 'no a'})
+
+
+def test_lazy_deserializer_invalid_attribute():
+    class MyEnum(enum.Enum):
+        Literal1 = 1
+
+    class A(Serializable):
+        def __init__(self, a: int, b: MyEnum = MyEnum.Literal1):
+            super().__init__()
+            self.a = a
+            self.b = b
+
+    a = A.from_builtins_lazy({'a': 1, 'b': 17})
+    assert a.a == 1
+    with pytest.raises(LazyConversionError):
+        a.b
+
+
+def test_lazy_deserializer_without_slots():
+    class A(Serializable):
+        __slots__ = ('__dict__',)
+
+        def __init__(self, a: int):
+            super().__init__()
+            self.a = a
+
+    # decoded eagerly:
+    a = compile_lazy_deserializer(A)({'a': 1})
+    assert type(a) is A
+    assert a.a == 1
+
+
+def test_serialize_to_builtins_compact():
+    class E(enum.Enum):
+        x = 'x'
+        y = 'y'
+        z = 'y'
+
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b', c: E = None, d: int = 0):
+            super().__init__()
+            self.a = a
+            self.b = b
+            self.c = c
+            self.d = d
+
+    class B(Serializable):
+        def __init__(self, items: [A]):
+            super().__init__()
+            self.items = items
+
+    assert enum_ordinal(E.x) == 0
+    assert enum_ordinal(E.z) == 1
+
+    b = B([A(1), A(2, c=E.y), A(3, d=4)])
+    serialized = serialize_to_builtins(b, compact=True)
+
+    # positional values, trailing defaults omitted:
+    assert serialized == [[[1], [2, 'b', 1], [3, 'b', None, 4]]]
+
+    for decode in (B.from_builtins, B.from_builtins_lazy, lambda value: deserialize_reflective(value, B)):
+        decoded = decode(serialized)
+        assert serialize_to_builtins(decoded) == serialize_to_builtins(b)
+        assert decoded.items[1].c is E.y
+
+
+def test_compiled_deserializer_compact_missing_required_attribute():
+    class A(Serializable):
+        def __init__(self, a: int, b: str = 'b'):
+            super().__init__()
+            self.a = a
+            self.b = b
+
+    with pytest.raises(TypeError):
+        A.from_builtins([])
+    with pytest.raises(TypeError):
+        A.from_builtins_lazy([])
+
+
+def test_columns_compact_roundtrip():
+    class E(enum.Enum):
+        x = 1
+        y = 2
+
+    class A(Serializable):
+        def __init__(self, name: str, e: E, n: int = 0):
+            super().__init__()
+            self.name = name
+            self.e = e
+            self.n = n
+
+    class AColumns(Columns):
+        item_class = A
+
+    class B(Serializable):
+        def __init__(self, items: [A]):
+            super().__init__()
+            self.items = items
+
+    register_columns(AColumns)
+    columns = AColumns.from_items([A('a', E.y), A('b', E.x, 3), A('a', E.x)])
+
+    assert serialize_to_builtins(columns) == [{'name': 'a', 'e': 'y'}, {'name': 'b', 'e': 'x', 'n': 3}, {'name': 'a', 'e': 'x'}]
+    serialized = serialize_to_builtins(B(columns), compact=True)
+    assert serialized == [{'name': [0, 1, 0], 'e': [1, 0, 0], 'n': [0, 3, 0], '_strings': ['a', 'b']}]
+
+    for decode in (B.from_builtins, B.from_builtins_lazy, lambda value: deserialize_reflective(value, B)):
+        items = decode(serialized).items
+        assert isinstance(items, AColumns)
+        assert list(items.rows()) == list(columns.rows())
+
+    # optional columns may be left out, required ones not:
+    assert list(AColumns.from_builtins({'name': [0], 'e': ['y'], '_strings': ['a']}).rows()) == [('a', E.y, 0)]
+    with pytest.raises(TypeError):
+        AColumns.from_builtins({'name': [0], '_strings': ['a']})
+
+
+def test_text_payload():
+    payload = TextPayload(memoryview('äöü'.encode('utf-8')))
+    assert payload.text == 'äöü'
+    assert payload.text is payload.text
+    assert payload == 'äöü'
+    assert payload == TextPayload.from_text('äöü')
+    assert serialize_to_builtins(payload) == 'äöü'
+
+    class A(Serializable):
+        def __init__(self, data: TextPayload):
+            super().__init__()
+            self.data = data
+
+    # strings stay strings, binary data is wrapped without being decoded:
+    for decode in (A.from_builtins, A.from_builtins_lazy, lambda value: deserialize_reflective(value, A)):
+        assert decode({'data': 'text'}).data == 'text'
+        data = b'binary \xff'
+        received = decode({'data': data}).data
+        assert isinstance(received, TextPayload)
+        assert received.data.obj is data
@@ -0,0 +1,81 @@
+import umsgpack
+import pytest
+from jep_py.buffer import ReceiveBuffer
+from jep_py.unpacker import Unpacker, NEED_DATA, UnpackError
+
+SAMPLES = [
+    None, True, False, 0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1, -1, -32, -33, -128, -129, -2 ** 15 - 1, -2 ** 31 - 1, -2 ** 63,
+    1.5, '', 'a', 'x' * 31, 'x' * 32, 'y' * 300, 'z' * 70000, 'äöü€', b'', b'bin', b'b' * 300, b'b' * 70000,
+    [], [1, 2, 3], list(range(20)), list(range(70000)), {}, {'a': 1}, {str(i): i for i in range(20)},
+    {'nested': [{'a': [1, {'b': None}]}, [], {}], 'x': 'y'},
+    umsgpack.Ext(5, b'1'), umsgpack.Ext(5, b'12'), umsgpack.Ext(5, b'1234'), umsgpack.Ext(5, b'12345678'), umsgpack.Ext(5, b'x' * 16),
+    umsgpack.Ext(5, b'123'), umsgpack.Ext(-3, b'x' * 300),
+]
+
+
+def test_unpack_samples():
+    for sample in SAMPLES:
+        unpacker = Unpacker()
+        unpacker.feed(umsgpack.packb(sample))
+        assert unpacker.unpack() == sample
+        assert unpacker.unpack() is NEED_DATA
+
+
+def test_unpack_concatenated_samples():
+    unpacker = Unpacker()
+    for sample in SAMPLES:
+        unpacker.feed(umsgpack.packb(sample))
+    assert list(unpacker) == SAMPLES
+    assert unpacker.pending == 0
+
+
+def test_unpack_bytewise():
+    obj = {'_message': 'ContentSync', 'file': 'f', 'data': 'x' * 1000, 'list': [1, [2, {'a': 'b'}], 3.25]}
+    packed = umsgpack.packb(obj)
+    unpacker = Unpacker()
+
+    for b in packed[:-1]:
+        unpacker.feed(bytes([b]))
+        assert unpacker.unpack() is NEED_DATA
+
+    unpacker.feed(packed[-1:])
+    assert unpacker.unpack() == obj
+    assert unpacker.unpack() is NEED_DATA
+
+
+def test_unpack_incomplete_is_not_exceptional():
+    unpacker = Unpacker()
+    assert unpacker.unpack() is NEED_DATA
+    assert not NEED_DATA
+
+    unpacker.feed(umsgpack.packb('x' * 100)[:50])
+    assert unpacker.unpack() is NEED_DATA
+
+
+def test_unpack_map_with_array_key():
+    unpacker = Unpacker()
+    unpacker.feed(b'\x81\x92\x01\x02\xa1x')
+    assert unpacker.unpack() == {(1, 2): 'x'}
+
+
+def test_unpack_invalid_type_byte():
+    unpacker = Unpacker()
+    unpacker.feed(b'\xc1')
+    with pytest.raises(UnpackError):
+        unpacker.unpack()
+
+
+def test_unpack_consumes_from_receive_buffer():
+    buffer = ReceiveBuffer(capacity=16, chunk_size=8)
+    unpacker = Unpacker(buffer)
+    packed = umsgpack.packb(['x' * 20, 1])
+
+    unpacker.feed(packed[:10])
+    assert unpacker.unpack() is NEED_DATA
+    # array header is consumed, incomplete string stays buffered:
+    assert len(buffer) == 9
+
+    unpacker.feed(packed[10:])
+    assert unpacker.unpack() == ['x' * 20, 1]
+    assert len(buffer) == 0
+    assert buffer.read_pos == buffer.write_pos == 0